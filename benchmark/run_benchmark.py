@@ -0,0 +1,165 @@
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+import shapely
+
+from ssurgo_provider.object.gdb_pool import gdb_pool
+from ssurgo_provider.object.mapunit_raster import MapunitRaster
+from ssurgo_provider.object.point_batch import PointBatch
+from ssurgo_provider.object.soil_cache import soil_cache
+from ssurgo_provider.param import LOOKUP_MODE_VECTOR, LOOKUP_MODE_RASTER
+from ssurgo_provider.soil_tools import find_soil_id_ref, find_soil_horizon_distribution, extract_soil_horizon_data, \
+    build_soil_composition, find_soil_id_ref_from_raster
+from ssurgo_provider.spatial_tools import find_county_id, retrieve_zones_mu_keys
+from synthetic_ssurgo import build_synthetic_ssurgo, ORIGIN_X, ORIGIN_Y
+
+BENCHMARK_FOLDER = Path(__file__).resolve().parent
+DEFAULT_DATA_FOLDER = BENCHMARK_FOLDER / 'data'
+DEFAULT_BASELINE = BENCHMARK_FOLDER / 'baseline.json'
+COUNTY_NB = 4
+COUNTY_SIZE = 10000.
+# size (meter) of the square zones of the zone benchmarks, one zone by ZONE_POINT_RATIO points
+ZONE_SIZE = 500.
+ZONE_POINT_RATIO = 100
+
+
+def main():
+    parser = argparse.ArgumentParser(description='time each stage of the pipeline on synthetic ssurgo data')
+    parser.add_argument('--points', default='1000,10000', help='comma separated point counts')
+    parser.add_argument('--densities', default='400,2500', help='comma separated MUPOLYGON counts by county')
+    parser.add_argument('--repeat', type=int, default=3, help='number of timed runs by stage (best one is kept)')
+    parser.add_argument('--data-folder', default=str(DEFAULT_DATA_FOLDER), help='folder of the synthetic data')
+    parser.add_argument('--output', default=None, help='write the results to this json file')
+    parser.add_argument('--baseline', default=str(DEFAULT_BASELINE), help='baseline json file to compare with')
+    parser.add_argument('--save-baseline', action='store_true', help='write the results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='relative slowdown (or memory increase) reported as a regression (default: 0.2)')
+    args = parser.parse_args()
+
+    results = {}
+    for density in [int(density) for density in args.densities.split(',')]:
+        gpkg_pth = Path(args.data_folder) / f'synthetic_{density}.gpkg'
+        if not gpkg_pth.exists():
+            build_synthetic_ssurgo(gpkg_pth, county_nb=COUNTY_NB, mu_polygon_nb=density, county_size=COUNTY_SIZE)
+        for point_nb in [int(point_nb) for point_nb in args.points.split(',')]:
+            for stage, measure in benchmark_stages(gpkg_pth, point_nb, args.repeat).items():
+                results[f'{stage}/{density}/{point_nb}'] = measure
+                display_measure(stage, density, point_nb, measure)
+
+    if args.output is not None:
+        write_json(args.output, results)
+    if args.save_baseline:
+        write_json(args.baseline, results)
+        return
+    if Path(args.baseline).exists():
+        with open(args.baseline) as baseline_file:
+            regressions = compare_to_baseline(results, json.load(baseline_file), args.tolerance)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        if len(regressions) > 0:
+            sys.exit(1)
+
+
+def benchmark_stages(gpkg_pth, point_nb, repeat=3, seed=0):
+    """
+    Time each stage of the pipeline on random points of a synthetic state, every stage takes the output of the
+    previous one. Caches are warm (steady state of a service) except the soil cache, emptied before each run.
+    Returns:
+        (dict): seconds (best run), points_per_second and peak_mb (python allocations, numpy included, gdal
+                internals excluded) by stage
+    """
+    rng = np.random.default_rng(seed)
+    side = COUNTY_SIZE * np.ceil(np.sqrt(COUNTY_NB))
+    x = ORIGIN_X + rng.uniform(0, side, point_nb)
+    y = ORIGIN_Y + rng.uniform(0, side, point_nb)
+    # every stage fills its columns in place, the raster lookup works on its own batch
+    point_batch = PointBatch(np.full(point_nb, np.nan), np.full(point_nb, np.nan), x, y)
+    raster_batch = PointBatch(np.full(point_nb, np.nan), np.full(point_nb, np.nan), x, y)
+    zone_nb = max(1, point_nb // ZONE_POINT_RATIO)
+    zones = shapely.box(x[:zone_nb], y[:zone_nb], x[:zone_nb] + ZONE_SIZE, y[:zone_nb] + ZONE_SIZE)
+
+    measures = {}
+    with gdb_pool.connection(gpkg_pth) as gdb_connection:
+        gdb = gdb_connection.gdb
+        mapunit_raster = MapunitRaster.get(gpkg_pth)
+        stages = [
+            ('find_county_id', lambda: find_county_id(point_batch, gdb)),
+            ('find_soil_id_ref', lambda: find_soil_id_ref(county_batch, gdb)),
+            ('find_soil_id_ref_from_raster', lambda: find_soil_id_ref_from_raster(raster_batch, gdb, mapunit_raster)),
+            ('find_soil_horizon_distribution', lambda: find_soil_horizon_distribution(mu_key_batch, gdb)),
+            ('extract_soil_horizon_data', lambda: extract_soil_horizon_data(co_key_batch, gdb)),
+            ('build_soil_composition', lambda: build_soil_composition(co_key_batch, horizon_table)),
+            ('mu_key_by_zone_vector', lambda: retrieve_zones_mu_keys(zones, gpkg_pth, LOOKUP_MODE_VECTOR)),
+            ('mu_key_by_zone_raster', lambda: retrieve_zones_mu_keys(zones, gpkg_pth, LOOKUP_MODE_RASTER)),
+        ]
+        county_batch = mu_key_batch = co_key_batch = horizon_table = None
+        for stage, function in stages:
+            measure, output = measure_stage(function, repeat)
+            measure['points_per_second'] = (zone_nb if stage.startswith('mu_key_by_zone') else point_nb) / \
+                measure['seconds'] if measure['seconds'] > 0 else None
+            measures[stage] = measure
+            if stage == 'find_county_id':
+                county_batch = output
+            elif stage == 'find_soil_id_ref':
+                mu_key_batch = output
+            elif stage == 'find_soil_horizon_distribution':
+                co_key_batch = output
+            elif stage == 'extract_soil_horizon_data':
+                horizon_table = output
+    return measures
+
+
+def measure_stage(function, repeat):
+    """
+    Best time of repeat runs (after one warm up run) and peak memory of one run traced with tracemalloc
+    """
+    soil_cache.clear()
+    output = function()
+    seconds = []
+    for _ in range(repeat):
+        soil_cache.clear()
+        start_time = time.perf_counter()
+        function()
+        seconds.append(time.perf_counter() - start_time)
+
+    soil_cache.clear()
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'seconds': min(seconds), 'peak_mb': peak / 1024 / 1024}, output
+
+
+def compare_to_baseline(results, baseline, tolerance):
+    """
+    Measures slower (or using more memory) than the baseline by more than tolerance
+    Returns:
+        (list(str)): description of each regression
+    """
+    regressions = []
+    for key, measure in results.items():
+        if key not in baseline:
+            continue
+        for metric in ['seconds', 'peak_mb']:
+            if measure[metric] > baseline[key][metric] * (1 + tolerance):
+                regressions.append(f'{key} {metric}: {measure[metric]:.4f} (baseline {baseline[key][metric]:.4f})')
+    return regressions
+
+
+def display_measure(stage, density, point_nb, measure):
+    print(f'{stage:32s} density {density:6d} points {point_nb:8d}: {measure["seconds"]:8.4f} s '
+          f'{measure["points_per_second"] or 0:12.0f} /s {measure["peak_mb"]:8.1f} MB')
+
+
+def write_json(json_pth, results):
+    with open(json_pth, 'w') as json_file:
+        json.dump(results, json_file, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
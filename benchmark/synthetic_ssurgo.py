@@ -0,0 +1,213 @@
+import argparse
+import math
+from pathlib import Path
+
+import numpy as np
+from osgeo import gdal, ogr, osr
+
+from ssurgo_provider.object.mapunit_raster import find_sibling_raster_path
+from ssurgo_provider.object.ssurgo_soil_dto import HORIZON_FIELDS
+from ssurgo_provider.spatial_tools import ALBERS_WKT
+
+# lower left corner of the synthetic state (USA_Contiguous_Albers, around Ohio)
+ORIGIN_X = 1000000.
+ORIGIN_Y = 1900000.
+RASTER_NODATA = 2147483647
+# chorizon fields stored as text or integer in gSSURGO, the other fields are real
+HORIZON_STR_FIELDS = ['hzname', 'desgnmaster', 'desgnmasterprime', 'excavdifcl', 'excavdifms', 'chkey', 'cokey']
+HORIZON_INT_FIELDS = ['desgndisc', 'desgnvert', 'hzdept_r', 'hzdepb_r', 'hzthk_r', 'fraggt10_r', 'frag3to10_r']
+HORIZON_NAMES = ['Ap', 'A', 'E', 'Bt1', 'Bt2', 'BC', 'C', 'Cr']
+
+
+def build_synthetic_ssurgo(output_pth, county_nb=4, mu_polygon_nb=2500, mapunit_nb=400, component_nb=3, horizon_nb=4,
+                           county_size=10000., vertex_nb=8, pixel_size=10., seed=0):
+    """
+    Write a synthetic ssurgo state: a GeoPackage with the gdb layers used by ssurgo_provider (SAPOLYGON, MUPOLYGON,
+    mapunit, legend, component, chorizon) and its map unit raster (GeoTIFF next to it, see find_sibling_raster_path)
+    Counties are squares of county_size meters on a grid, each county is divided in mu_polygon_nb square map unit
+    polygons, each polygon takes one of the mapunit_nb map units of its county
+    Args:
+        output_pth (path): path of the GeoPackage (.gpkg)
+        county_nb (int): number of counties (survey areas)
+        mu_polygon_nb (int): number of MUPOLYGON features by county (polygon density)
+        mapunit_nb (int): number of map units by county
+        component_nb (int): number of components by map unit
+        horizon_nb (int): number of horizons by component
+        county_size (float): size of a county (meter)
+        vertex_nb (int): number of vertices by polygon edge
+        pixel_size (float): size of a raster pixel (meter)
+        seed (int): random seed, the same arguments always write the same data
+
+    Returns:
+        (path): path of the GeoPackage
+    """
+    output_pth = Path(output_pth)
+    output_pth.parent.mkdir(parents=True, exist_ok=True)
+    if output_pth.exists():
+        output_pth.unlink()
+    rng = np.random.default_rng(seed)
+    srs = osr.SpatialReference()
+    srs.ImportFromWkt(ALBERS_WKT)
+
+    county_by_row = math.ceil(math.sqrt(county_nb))
+    cell_by_row = math.ceil(math.sqrt(mu_polygon_nb))
+    cell_size = county_size / cell_by_row
+    data_source = ogr.GetDriverByName('GPKG').CreateDataSource(str(output_pth))
+
+    sa_layer = create_layer(data_source, 'SAPOLYGON', srs, ogr.wkbMultiPolygon,
+                            [('AREASYMBOL', ogr.OFTString), ('SPATIALVER', ogr.OFTInteger)])
+    mu_layer = create_layer(data_source, 'MUPOLYGON', srs, ogr.wkbMultiPolygon,
+                            [('AREASYMBOL', ogr.OFTString), ('SPATIALVER', ogr.OFTInteger), ('MUSYM', ogr.OFTString),
+                             ('MUKEY', ogr.OFTString)])
+    legend_layer = create_layer(data_source, 'legend', None, ogr.wkbNone,
+                                [('lkey', ogr.OFTString), ('areasymbol', ogr.OFTString)])
+    mapunit_layer = create_layer(data_source, 'mapunit', None, ogr.wkbNone,
+                                 [('mukey', ogr.OFTString), ('musym', ogr.OFTString), ('lkey', ogr.OFTString)])
+    component_layer = create_layer(data_source, 'component', None, ogr.wkbNone,
+                                   [('mukey', ogr.OFTString), ('cokey', ogr.OFTString), ('comppct_r', ogr.OFTInteger)])
+    chorizon_layer = create_layer(data_source, 'chorizon', None, ogr.wkbNone,
+                                  [(field, horizon_field_type(field)) for _, field in HORIZON_FIELDS])
+
+    for layer in [sa_layer, mu_layer, legend_layer, mapunit_layer, component_layer, chorizon_layer]:
+        layer.StartTransaction()
+    mu_key = 100000
+    co_key = 10000000
+    ch_key = 50000000
+    for county_idx in range(county_nb):
+        area_symbol = f'XX{county_idx + 1:03d}'
+        min_x = ORIGIN_X + (county_idx % county_by_row) * county_size
+        min_y = ORIGIN_Y + (county_idx // county_by_row) * county_size
+        add_feature(sa_layer, {'AREASYMBOL': area_symbol, 'SPATIALVER': 1},
+                    square_polygon(min_x, min_y, county_size, vertex_nb))
+        lkey = str(county_idx + 1)
+        add_feature(legend_layer, {'lkey': lkey, 'areasymbol': area_symbol})
+
+        county_mu_keys = []
+        for mapunit_idx in range(mapunit_nb):
+            county_mu_keys.append(mu_key)
+            add_feature(mapunit_layer, {'mukey': str(mu_key), 'musym': f'M{mapunit_idx}', 'lkey': lkey})
+            comp_pct = rng.dirichlet(np.ones(component_nb)) * 100
+            for component_idx in range(component_nb):
+                add_feature(component_layer, {'mukey': str(mu_key), 'cokey': str(co_key),
+                                              'comppct_r': int(round(comp_pct[component_idx]))})
+                depths = np.r_[0, np.sort(rng.choice(np.arange(5, 200), horizon_nb, replace=False))]
+                for horizon_idx in range(horizon_nb):
+                    add_feature(chorizon_layer, horizon_values(rng, ch_key, co_key, horizon_idx, depths))
+                    ch_key += 1
+                co_key += 1
+            mu_key += 1
+
+        polygon_mu_keys = rng.choice(county_mu_keys, cell_by_row * cell_by_row)
+        for cell_idx, polygon_mu_key in enumerate(polygon_mu_keys.tolist()):
+            add_feature(mu_layer, {'AREASYMBOL': area_symbol, 'SPATIALVER': 1,
+                                   'MUSYM': f'M{polygon_mu_key - county_mu_keys[0]}', 'MUKEY': str(polygon_mu_key)},
+                        square_polygon(min_x + (cell_idx % cell_by_row) * cell_size,
+                                       min_y + (cell_idx // cell_by_row) * cell_size, cell_size, vertex_nb))
+    for layer in [sa_layer, mu_layer, legend_layer, mapunit_layer, component_layer, chorizon_layer]:
+        layer.CommitTransaction()
+
+    county_by_column = math.ceil(county_nb / county_by_row)
+    write_mapunit_raster(find_sibling_raster_path(output_pth), mu_layer, srs,
+                         (ORIGIN_X, ORIGIN_Y + county_by_column * county_size),
+                         int(math.ceil(county_by_row * county_size / pixel_size)),
+                         int(math.ceil(county_by_column * county_size / pixel_size)), pixel_size)
+    data_source = None
+    return output_pth
+
+
+def create_layer(data_source, name, srs, geometry_type, fields):
+    layer = data_source.CreateLayer(name, srs=srs, geom_type=geometry_type)
+    for field_name, field_type in fields:
+        layer.CreateField(ogr.FieldDefn(field_name, field_type))
+    return layer
+
+
+def add_feature(layer, values, geometry=None):
+    feature = ogr.Feature(layer.GetLayerDefn())
+    for field_name, value in values.items():
+        if value is not None:
+            feature.SetField(field_name, value)
+    if geometry is not None:
+        feature.SetGeometry(geometry)
+    layer.CreateFeature(feature)
+
+
+def horizon_field_type(field):
+    if field in HORIZON_STR_FIELDS:
+        return ogr.OFTString
+    if field in HORIZON_INT_FIELDS:
+        return ogr.OFTInteger
+    return ogr.OFTReal
+
+
+def horizon_values(rng, ch_key, co_key, horizon_idx, depths):
+    """
+    Values of one chorizon row: keys and depths are consistent, other fields are random (about 5% null)
+    """
+    values = {}
+    for _, field in HORIZON_FIELDS:
+        field_type = horizon_field_type(field)
+        if rng.random() < 0.05:
+            values[field] = None
+        elif field_type == ogr.OFTString:
+            values[field] = HORIZON_NAMES[min(horizon_idx, len(HORIZON_NAMES) - 1)]
+        elif field_type == ogr.OFTInteger:
+            values[field] = int(rng.integers(0, 100))
+        else:
+            values[field] = round(float(rng.uniform(0, 100)), 2)
+    values.update({'chkey': str(ch_key), 'cokey': str(co_key), 'hzdept_r': int(depths[horizon_idx]),
+                   'hzdepb_r': int(depths[horizon_idx + 1]),
+                   'hzthk_r': int(depths[horizon_idx + 1] - depths[horizon_idx])})
+    return values
+
+
+def square_polygon(min_x, min_y, size, vertex_nb):
+    """
+    Square multipolygon with vertex_nb vertices by edge
+    """
+    steps = np.linspace(0, size, vertex_nb + 1)[:-1]
+    ring = ogr.Geometry(ogr.wkbLinearRing)
+    for x, y in ([(min_x + step, min_y) for step in steps] + [(min_x + size, min_y + step) for step in steps] +
+                 [(min_x + size - step, min_y + size) for step in steps] + [(min_x, min_y + size - step)
+                                                                             for step in steps]):
+        ring.AddPoint_2D(float(x), float(y))
+    ring.CloseRings()
+    polygon = ogr.Geometry(ogr.wkbPolygon)
+    polygon.AddGeometry(ring)
+    multi_polygon = ogr.Geometry(ogr.wkbMultiPolygon)
+    multi_polygon.AddGeometry(polygon)
+    return multi_polygon
+
+
+def write_mapunit_raster(raster_pth, mu_layer, srs, top_left, width, height, pixel_size):
+    """
+    Rasterize MUPOLYGON (pixel value MUKEY) as gSSURGO MapunitRaster_10m
+    """
+    dataset = gdal.GetDriverByName('GTiff').Create(str(raster_pth), width, height, 1, gdal.GDT_Int32,
+                                                   options=['COMPRESS=DEFLATE', 'TILED=YES'])
+    dataset.SetGeoTransform((top_left[0], pixel_size, 0., top_left[1], 0., -pixel_size))
+    dataset.SetProjection(srs.ExportToWkt())
+    band = dataset.GetRasterBand(1)
+    band.SetNoDataValue(RASTER_NODATA)
+    band.Fill(RASTER_NODATA)
+    mu_layer.ResetReading()
+    gdal.RasterizeLayer(dataset, [1], mu_layer, options=['ATTRIBUTE=MUKEY'])
+    dataset.FlushCache()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='write a synthetic ssurgo state (GeoPackage and map unit raster)')
+    parser.add_argument('output', help='path of the GeoPackage (.gpkg)')
+    parser.add_argument('--county-nb', type=int, default=4)
+    parser.add_argument('--mu-polygon-nb', type=int, default=2500, help='number of MUPOLYGON features by county')
+    parser.add_argument('--mapunit-nb', type=int, default=400, help='number of map units by county')
+    parser.add_argument('--component-nb', type=int, default=3, help='number of components by map unit')
+    parser.add_argument('--horizon-nb', type=int, default=4, help='number of horizons by component')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    print(build_synthetic_ssurgo(args.output, args.county_nb, args.mu_polygon_nb, args.mapunit_nb, args.component_nb,
+                                 args.horizon_nb, seed=args.seed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,331 @@
+import asyncio
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial
+
+import uvicorn
+from shapely.geometry import Point
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, PlainTextResponse
+from starlette.routing import Route
+
+from ssurgo_provider.main import find_ssurgo_state_folder_path, manage_retrieve_soils_composition, \
+    retrieve_mu_key_by_zones, route_points, retrieve_multiple_soil_properties, \
+    retrieve_state_soil_properties_from_mukey, parse_depths, soil_properties_to_dict_list
+from ssurgo_provider.object.map_load import OpenMap
+from ssurgo_provider.object.micro_batcher import MicroBatcher
+from ssurgo_provider.object.state_info import StateInfo, StateInfoStatus
+from ssurgo_provider.object.survey_area_index import SurveyAreaIndex
+from ssurgo_provider.param import LOOKUP_MODE_VECTOR
+from ssurgo_provider.spatial_tools import retrieve_state_code, convert_geojson_to_polygon, \
+    retrieve_mu_key_from_raster_by_zone
+
+# number of worker processes running the gdb work
+WORKER_NB = int(os.environ.get('SSURGO_WORKERS', os.cpu_count() or 1))
+# maximum number of requests running or waiting for a worker, other requests are rejected with 429
+MAX_PENDING_REQUESTS = int(os.environ.get('SSURGO_MAX_PENDING_REQUESTS', 4 * WORKER_NB))
+# maximum number of points (or zones) of one batch request, larger requests are rejected with 413
+MAX_BATCH_SIZE = int(os.environ.get('SSURGO_MAX_BATCH_SIZE', 10000))
+# single point GET /soil_data requests are coalesced during this window (millisecond) or up to this number of points
+BATCH_WINDOW_MS = float(os.environ.get('SSURGO_BATCH_WINDOW_MS', 5))
+BATCH_MAX_POINTS = int(os.environ.get('SSURGO_BATCH_MAX_POINTS', 256))
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class BoundedExecutor:
+    def __init__(self, max_workers=WORKER_NB, max_pending=MAX_PENDING_REQUESTS):
+        """
+            Process pool running the blocking gdb work out of the event loop, with a bounded number of pending jobs
+        Args:
+            max_workers (int): number of worker processes
+            max_pending (int): maximum number of jobs running or waiting for a worker
+        """
+        self.max_pending = max_pending
+        self.pending = 0
+        self.executor = ProcessPoolExecutor(max_workers=max_workers, initializer=open_state_map)
+
+    async def run(self, function, *args, **kwargs):
+        """
+            Run a function in a worker process
+        Raises:
+            QueueFullError: if max_pending jobs are already running or waiting
+        """
+        if self.pending >= self.max_pending:
+            raise QueueFullError(f"{self.pending} requests in progress, retry later")
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor,
+                                                                    partial(function, *args, **kwargs))
+        finally:
+            self.pending -= 1
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+
+def open_state_map():
+    # load the survey area index (or the state map without index) once by worker, before the first request
+    if SurveyAreaIndex.open() is None:
+        OpenMap(is_permanent=True).state_locator
+
+
+def find_state_job(lat, long):
+    states_info_list = retrieve_state_code([Point(lat, long)], states_gdf=OpenMap(is_permanent=True),
+                                           disable_location_error=False)
+    return {'state_code': states_info_list[0].state_code, 'lat': lat, 'long': long}
+
+
+def soil_data_job(coordinates, state_code=None, lookup_mode=LOOKUP_MODE_VECTOR, disable_error=True):
+    """
+    Retrieve the soil composition of a list of location in a worker process
+    Args:
+        coordinates (list(tuple)): location (lat, long) of each point
+        state_code (str/None): state code of every point, found from the state map if None
+        lookup_mode (str): LOOKUP_MODE_VECTOR or LOOKUP_MODE_RASTER
+        disable_error (bool): if False raise an exception when a point is out of USA or its state gdb is missing
+
+    Returns:
+        (list(dict)): state_code, status and soil_data (None if not processed) of each point, in the same order
+    """
+    points = [Point(coordinate[0], coordinate[1]) for coordinate in coordinates]
+    if state_code is None:
+        states_info_list = route_points(points, disable_location_error=disable_error, disable_file_error=disable_error)
+    else:
+        states_info_list = [StateInfo(state_code=state_code, points=point, status=StateInfoStatus.IN_PROGRESS)
+                            for point in points]
+        find_ssurgo_state_folder_path(states_info_list, disable_file_error=disable_error)
+    manage_retrieve_soils_composition(states_info_list, lookup_mode=lookup_mode)
+    return [{'state_code': state_info.state_code, 'status': state_info.status.value,
+             'soil_data': state_info.soil_data_to_dict() if state_info.soil_data is not None else None}
+            for state_info in states_info_list]
+
+
+def soil_properties_job(properties, depths, coordinates=None, mu_keys=None, state_code=None,
+                        lookup_mode=LOOKUP_MODE_VECTOR):
+    """
+    Depth weighted soil properties of a list of location (or of map units of a state) in a worker process
+    Args:
+        properties (list(str)): numeric chorizon fields
+        depths (list(tuple)): (top, bottom) of each depth interval (cm)
+        coordinates (list(tuple)/None): location (lat, long) of each point
+        mu_keys (list(int)/None): map unit keys, read instead of coordinates if not None
+        state_code (str/None): state code of the map units
+        lookup_mode (str): LOOKUP_MODE_VECTOR or LOOKUP_MODE_RASTER
+
+    Returns:
+        (list(dict)): state_code, status and properties (None if not processed) of each location, in the same order
+    """
+    if mu_keys is not None:
+        state_info, values = retrieve_state_soil_properties_from_mukey(mu_keys, state_code, properties, depths)
+        states_info_list = [state_info] * len(mu_keys)
+    else:
+        states_info_list, values = retrieve_multiple_soil_properties(coordinates, properties, depths,
+                                                                     lookup_mode=lookup_mode)
+    return [{'state_code': state_info.state_code, 'status': state_info.status.value,
+             'properties': location_properties if state_info.status == StateInfoStatus.SUCCEED else None}
+            for state_info, location_properties in zip(states_info_list, soil_properties_to_dict_list(values, depths))]
+
+
+def mu_key_by_zone_job(geojson, state_code=None, lookup_mode=LOOKUP_MODE_VECTOR, all_touched=False):
+    polygon = convert_geojson_to_polygon(geojson)
+    points = polygon.Centroid()
+    if state_code is None:
+        states_info_list = route_points([points], disable_location_error=False, disable_file_error=False)
+    else:
+        states_info_list = [StateInfo(state_code=state_code, points=points, status=StateInfoStatus.IN_PROGRESS)]
+        find_ssurgo_state_folder_path(states_info_list, disable_file_error=False)
+    return retrieve_mu_key_from_raster_by_zone(polygon, states_info_list[0].state_folder_pth,
+                                               lookup_mode=lookup_mode, all_touched=all_touched)
+
+
+def mu_key_by_zones_job(feature_collection, state_code=None, lookup_mode=LOOKUP_MODE_VECTOR, all_touched=False):
+    return retrieve_mu_key_by_zones(feature_collection, state_code=state_code, lookup_mode=lookup_mode,
+                                    all_touched=all_touched)
+
+
+async def run_job(request, function, *args, **kwargs):
+    """
+    Run a job in the worker pool and convert its result (or error) to a json response
+    """
+    try:
+        return JSONResponse(await request.app.state.executor.run(function, *args, **kwargs))
+    except QueueFullError as err:
+        return JSONResponse({"error": str(err)}, status_code=429)
+    except Exception as err:
+        return JSONResponse({"error": str(err)}, status_code=500)
+
+
+async def status(request):
+    return PlainTextResponse("READY TO RETURN SSURGO DATA")
+
+
+async def get_state_name(request):
+    try:
+        lat = float(request.query_params.get('lat'))
+        long = float(request.query_params.get('long'))
+    except (TypeError, ValueError) as err:
+        return JSONResponse({"error": str(err)}, status_code=400)
+    return await run_job(request, find_state_job, lat, long)
+
+
+async def get_soil_data(request):
+    try:
+        lat = float(request.query_params.get('lat'))
+        long = float(request.query_params.get('long'))
+    except (TypeError, ValueError) as err:
+        return JSONResponse({"error": str(err)}, status_code=400)
+    # concurrent single point requests are processed in one batch (see MicroBatcher)
+    key = (request.query_params.get('state_code', None), request.query_params.get('lookup_mode', LOOKUP_MODE_VECTOR))
+    try:
+        point_result = await request.app.state.soil_batcher.submit((lat, long), key)
+    except QueueFullError as err:
+        return JSONResponse({"error": str(err)}, status_code=429)
+    except Exception as err:
+        return JSONResponse({"error": str(err)}, status_code=500)
+    if point_result['soil_data'] is None:
+        error = 'point is not in USA, please select a point in USA' if point_result['state_code'] is None else \
+            f"no ssurgo data find for state {point_result['state_code']}, please download it"
+        return JSONResponse({"error": error}, status_code=500)
+    return JSONResponse(point_result['soil_data'])
+
+
+async def post_soil_data(request):
+    """
+    Soil composition of many points: body {"coordinates": [[lat, long], ...]}, one result by point in the same order
+    """
+    try:
+        coordinates = [(float(coordinate[0]), float(coordinate[1])) for coordinate in
+                       (await request.json())['coordinates']]
+    except (TypeError, ValueError, KeyError, IndexError) as err:
+        return JSONResponse({"error": f"body should be {{'coordinates': [[lat, long], ...]}} ({err})"},
+                             status_code=400)
+    if len(coordinates) > MAX_BATCH_SIZE:
+        return JSONResponse({"error": f"more than {MAX_BATCH_SIZE} points, split the request"}, status_code=413)
+    return await run_job(request, soil_data_job, coordinates, request.query_params.get('state_code', None),
+                         request.query_params.get('lookup_mode', LOOKUP_MODE_VECTOR))
+
+
+async def get_soil_properties(request):
+    """
+    Depth weighted soil properties of one point (lat, long) or one map unit (mu_key, state_code), e.g.
+    ?lat=40.5&long=-83.2&properties=claytotal_r,om_r&depths=0-30,30-100
+    """
+    params = request.query_params
+    try:
+        properties = params['properties'].split(',')
+        depths = parse_depths(params.get('depths', '0-30')).tolist()
+        if 'mu_key' in params:
+            job_args = {'mu_keys': [int(params['mu_key'])], 'state_code': params['state_code']}
+        else:
+            job_args = {'coordinates': [(float(params['lat']), float(params['long']))]}
+    except (TypeError, ValueError, KeyError) as err:
+        return JSONResponse({"error": str(err)}, status_code=400)
+    try:
+        location_result = (await request.app.state.executor.run(
+            soil_properties_job, properties, depths, lookup_mode=params.get('lookup_mode', LOOKUP_MODE_VECTOR),
+            **job_args))[0]
+    except QueueFullError as err:
+        return JSONResponse({"error": str(err)}, status_code=429)
+    except Exception as err:
+        return JSONResponse({"error": str(err)}, status_code=500)
+    if location_result['properties'] is None:
+        return JSONResponse({"error": f"location not processed ({location_result['status']})"}, status_code=500)
+    return JSONResponse(location_result['properties'])
+
+
+async def post_soil_properties(request):
+    """
+    Depth weighted soil properties of many points or map units, body {"properties": [...], "depths": [[0, 30], ...],
+    "coordinates": [[lat, long], ...]} or {..., "mu_keys": [...], "state_code": "OH"}
+    """
+    try:
+        body = await request.json()
+        properties = [str(soil_property) for soil_property in body['properties']]
+        depths = body.get('depths', [[0, 30]])
+        if 'mu_keys' in body:
+            job_args = {'mu_keys': [int(mu_key) for mu_key in body['mu_keys']], 'state_code': body['state_code']}
+        else:
+            job_args = {'coordinates': [(float(coordinate[0]), float(coordinate[1]))
+                                        for coordinate in body['coordinates']]}
+    except (TypeError, ValueError, KeyError, IndexError) as err:
+        return JSONResponse({"error": f"body should hold properties, depths and coordinates or mu_keys ({err})"},
+                            status_code=400)
+    if len(next(iter(job_args.values()))) > MAX_BATCH_SIZE:
+        return JSONResponse({"error": f"more than {MAX_BATCH_SIZE} locations, split the request"}, status_code=413)
+    return await run_job(request, soil_properties_job, properties, depths,
+                         lookup_mode=request.query_params.get('lookup_mode', LOOKUP_MODE_VECTOR), **job_args)
+
+
+async def get_stats(request):
+    return JSONResponse({'pending_requests': request.app.state.executor.pending,
+                         'soil_data_batcher': request.app.state.soil_batcher.stats()})
+
+
+async def get_mu_key_by_zone(request):
+    try:
+        geojson = json.loads(request.query_params.get('geojson'))
+    except (TypeError, ValueError) as err:
+        return JSONResponse({"error": str(err)}, status_code=400)
+    return await run_job(request, mu_key_by_zone_job, geojson, request.query_params.get('state_code', None),
+                         request.query_params.get('lookup_mode', LOOKUP_MODE_VECTOR),
+                         request.query_params.get('all_touched', 'false').lower() == 'true')
+
+
+async def post_mu_key_by_zones(request):
+    try:
+        feature_collection = await request.json()
+        zone_nb = len(feature_collection['features'])
+    except (TypeError, ValueError, KeyError) as err:
+        return JSONResponse({"error": f"body should be a geojson FeatureCollection ({err})"}, status_code=400)
+    if zone_nb > MAX_BATCH_SIZE:
+        return JSONResponse({"error": f"more than {MAX_BATCH_SIZE} zones, split the request"}, status_code=413)
+    return await run_job(request, mu_key_by_zones_job, feature_collection, request.query_params.get('state_code', None),
+                         request.query_params.get('lookup_mode', LOOKUP_MODE_VECTOR),
+                         request.query_params.get('all_touched', 'false').lower() == 'true')
+
+
+def create_app(max_workers=WORKER_NB, max_pending=MAX_PENDING_REQUESTS, batch_window_ms=BATCH_WINDOW_MS,
+               batch_max_points=BATCH_MAX_POINTS):
+    """
+    Build the ASGI application, the worker pool is started with the application and stopped gracefully with it
+    Args:
+        max_workers (int): number of worker processes
+        max_pending (int): maximum number of requests running or waiting for a worker
+        batch_window_ms (float): time (millisecond) a single point request waits for other requests to batch with
+        batch_max_points (int): maximum number of single point requests in one batch
+    """
+    @asynccontextmanager
+    async def lifespan(app):
+        app.state.executor = BoundedExecutor(max_workers, max_pending)
+
+        async def retrieve_soil_batch(key, coordinates):
+            return await app.state.executor.run(soil_data_job, coordinates, key[0], key[1])
+
+        app.state.soil_batcher = MicroBatcher(retrieve_soil_batch, batch_max_points, batch_window_ms / 1000)
+        yield
+        app.state.executor.shutdown()
+
+    return Starlette(routes=[
+        Route('/', status),
+        Route('/stats', get_stats, methods=['GET']),
+        Route('/find_state', get_state_name, methods=['GET']),
+        Route('/soil_data', get_soil_data, methods=['GET']),
+        Route('/soil_data/batch', post_soil_data, methods=['POST']),
+        Route('/soil_properties', get_soil_properties, methods=['GET']),
+        Route('/soil_properties/batch', post_soil_properties, methods=['POST']),
+        Route('/mu_key_by_zone', get_mu_key_by_zone, methods=['GET']),
+        Route('/mu_key_by_zone/batch', post_mu_key_by_zones, methods=['POST']),
+    ], lifespan=lifespan)
+
+
+def launch(port=8180, host="0.0.0.0"):
+    uvicorn.run(create_app(), host=host, port=int(port))
+
+
+if __name__ == '__main__':
+    launch()
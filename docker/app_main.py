@@ -3,21 +3,32 @@ import json
 from flask import Flask, Response, request
 from shapely.geometry import Point
 
-from ssurgo_provider.main import find_ssurgo_state_folder_path, manage_retrieve_soils_composition
+from ssurgo_provider.instrumentation import enable_instrumentation, render_prometheus
+from ssurgo_provider.main import find_ssurgo_state_folder_path, manage_retrieve_soils_composition, \
+    retrieve_mu_key_by_zones, route_points, retrieve_multiple_soil_properties, \
+    retrieve_state_soil_properties_from_mukey, parse_depths, soil_properties_to_dict_list
 from ssurgo_provider.object.map_load import OpenMap
 from ssurgo_provider.object.state_info import StateInfo, StateInfoStatus
+from ssurgo_provider.object.survey_area_index import SurveyAreaIndex
+from ssurgo_provider.param import LOOKUP_MODE_VECTOR
 from ssurgo_provider.spatial_tools import retrieve_state_code, convert_geojson_to_polygon, \
     retrieve_mu_key_from_raster_by_zone
 
 
 def launch(port="8180", host="0.0.0.0"):
     app = Flask(__name__)
-    states_gdf = OpenMap(is_permanent=True)
+    enable_instrumentation()
+    # the state map is only loaded at launch when the points are not routed with the survey area index
+    states_gdf = OpenMap(is_permanent=True) if SurveyAreaIndex.open() is None else None
 
     @app.route('/')
     def status():
         return "READY TO RETURN SSURGO DATA"
 
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        return Response(response=render_prometheus(), mimetype='text/plain; version=0.0.4')
+
     @app.route('/find_state', methods=['GET'])
     def get_state_name():
         arguments = request.args
@@ -45,14 +56,15 @@ def launch(port="8180", host="0.0.0.0"):
             lat = float(arguments.get('lat'))
             long = float(arguments.get('long'))
             state_code = arguments.get('state_code', None)
+            lookup_mode = arguments.get('lookup_mode', LOOKUP_MODE_VECTOR)
             if state_code is None:
-                states_info_list = retrieve_state_code(points=[Point(lat, long)], states_gdf=states_gdf,
-                                                       disable_location_error=False)
+                states_info_list = route_points([Point(lat, long)], states_gdf=states_gdf,
+                                                disable_location_error=False, disable_file_error=False)
             else:
                 states_info_list = [
-                    StateInfo(state_code=state_code, points=[Point(lat, long)], status=StateInfoStatus.IN_PROGRESS)]
-            find_ssurgo_state_folder_path(states_info_list, disable_file_error=False)
-            soil_data_list = manage_retrieve_soils_composition(states_info_list)
+                    StateInfo(state_code=state_code, points=Point(lat, long), status=StateInfoStatus.IN_PROGRESS)]
+                find_ssurgo_state_folder_path(states_info_list, disable_file_error=False)
+            soil_data_list = manage_retrieve_soils_composition(states_info_list, lookup_mode=lookup_mode)
             return Response(
                 response=json.dumps(soil_data_list[0].soil_data_to_dict(), sort_keys=True, ensure_ascii=False),
                 mimetype='application/json')
@@ -62,6 +74,59 @@ def launch(port="8180", host="0.0.0.0"):
                 mimetype='application/json', status=500
             )
 
+    @app.route('/soil_properties', methods=['GET'])
+    def get_soil_properties():
+        arguments = request.args
+
+        try:
+            properties = arguments.get('properties').split(',')
+            depths = parse_depths(arguments.get('depths', '0-30'))
+            if arguments.get('mu_key', None) is not None:
+                _, values = retrieve_state_soil_properties_from_mukey([int(arguments.get('mu_key'))],
+                                                                      arguments.get('state_code'), properties, depths,
+                                                                      disable_file_error=False)
+            else:
+                _, values = retrieve_multiple_soil_properties(
+                    [(float(arguments.get('lat')), float(arguments.get('long')))], properties, depths,
+                    disable_file_error=False, disable_location_error=False,
+                    lookup_mode=arguments.get('lookup_mode', LOOKUP_MODE_VECTOR), states_gdf=states_gdf)
+            return Response(
+                response=json.dumps(soil_properties_to_dict_list(values, depths)[0], sort_keys=True,
+                                    ensure_ascii=False),
+                mimetype='application/json')
+        except Exception as err:
+            return Response(
+                response=json.dumps({"error": str(err)}, sort_keys=True, ensure_ascii=False),
+                mimetype='application/json', status=500
+            )
+
+    @app.route('/soil_properties/batch', methods=['POST'])
+    def post_soil_properties():
+        try:
+            body = request.get_json(force=True)
+            properties = body['properties']
+            depths = body.get('depths', [[0, 30]])
+            if 'mu_keys' in body:
+                state_info, values = retrieve_state_soil_properties_from_mukey(body['mu_keys'], body['state_code'],
+                                                                               properties, depths)
+                states_info_list = [state_info] * len(body['mu_keys'])
+            else:
+                states_info_list, values = retrieve_multiple_soil_properties(
+                    body['coordinates'], properties, depths,
+                    lookup_mode=request.args.get('lookup_mode', LOOKUP_MODE_VECTOR), states_gdf=states_gdf)
+            response = [{'state_code': state_info.state_code, 'status': state_info.status.value,
+                         'properties': location_properties if state_info.status == StateInfoStatus.SUCCEED else None}
+                        for state_info, location_properties in zip(states_info_list,
+                                                                   soil_properties_to_dict_list(values, depths))]
+            return Response(
+                response=json.dumps(response, sort_keys=True, ensure_ascii=False),
+                mimetype='application/json')
+        except Exception as err:
+            return Response(
+                response=json.dumps({"error": str(err)}, sort_keys=True, ensure_ascii=False),
+                mimetype='application/json', status=500
+            )
+
     @app.route('/mu_key_by_zone', methods=['GET'])
     def get_mu_key_by_zone():
         arguments = request.args
@@ -69,14 +134,18 @@ def launch(port="8180", host="0.0.0.0"):
         try:
             geojson = json.loads(arguments.get('geojson'))
             state_code = arguments.get('state_code', None)
+            lookup_mode = arguments.get('lookup_mode', LOOKUP_MODE_VECTOR)
+            all_touched = arguments.get('all_touched', 'false').lower() == 'true'
             polygon = convert_geojson_to_polygon(geojson)
             points = polygon.Centroid()
             if state_code is None:
-                states_info_list = retrieve_state_code(points=[points], disable_location_error=False)
+                states_info_list = route_points([points], states_gdf=states_gdf, disable_location_error=False,
+                                                disable_file_error=False)
             else:
                 states_info_list = [StateInfo(state_code=state_code, points=points, status=StateInfoStatus.IN_PROGRESS)]
-            find_ssurgo_state_folder_path(states_info_list, disable_file_error=False)
-            mu_key_dict = retrieve_mu_key_from_raster_by_zone(polygon, states_info_list[0].state_folder_pth)
+                find_ssurgo_state_folder_path(states_info_list, disable_file_error=False)
+            mu_key_dict = retrieve_mu_key_from_raster_by_zone(polygon, states_info_list[0].state_folder_pth,
+                                                              lookup_mode=lookup_mode, all_touched=all_touched)
             return Response(
                 response=json.dumps(mu_key_dict, sort_keys=True, ensure_ascii=False),
                 mimetype='application/json')
@@ -86,6 +155,26 @@ def launch(port="8180", host="0.0.0.0"):
                 mimetype='application/json', status=500
             )
 
+    @app.route('/mu_key_by_zone/batch', methods=['POST'])
+    def post_mu_key_by_zones():
+        arguments = request.args
+
+        try:
+            feature_collection = request.get_json(force=True)
+            state_code = arguments.get('state_code', None)
+            lookup_mode = arguments.get('lookup_mode', LOOKUP_MODE_VECTOR)
+            all_touched = arguments.get('all_touched', 'false').lower() == 'true'
+            mu_key_list = retrieve_mu_key_by_zones(feature_collection, states_gdf=states_gdf, state_code=state_code,
+                                                   lookup_mode=lookup_mode, all_touched=all_touched)
+            return Response(
+                response=json.dumps(mu_key_list, sort_keys=True, ensure_ascii=False),
+                mimetype='application/json')
+        except Exception as err:
+            return Response(
+                response=json.dumps({"error": str(err)}, sort_keys=True, ensure_ascii=False),
+                mimetype='application/json', status=500
+            )
+
     app.run(host=host, port=port)
 
 
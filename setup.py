@@ -20,8 +20,13 @@ setup(
     packages=find_packages('src'),
     install_requires=[
         'gdal',
+        'numpy',
         'pandas',
         'geopandas',
-        'shapely'
-    ]
+        'shapely>=2.0',
+        'pyarrow>=14.0'
+    ],
+    entry_points={
+        'console_scripts': ['ssurgo-provider=ssurgo_provider.cli:main']
+    }
 )
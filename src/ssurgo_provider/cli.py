@@ -0,0 +1,257 @@
+import argparse
+import json
+import os
+import shutil
+import sys
+import time
+from pathlib import Path
+
+import pandas as pd
+
+from ssurgo_provider.main import retrieve_multiple_soil_data, parse_depths
+from ssurgo_provider.object.cell_cache import configure_cell_cache
+from ssurgo_provider.object.map_load import build_state_map, SIMPLIFY_TOLERANCE
+from ssurgo_provider.object.soil_pack import build_soil_pack
+from ssurgo_provider.object.ssurgo_soil_dto import SsurgoSoilDto
+from ssurgo_provider.object.survey_area_index import build_survey_area_index
+from ssurgo_provider.param import LOOKUP_MODE_VECTOR, LOOKUP_MODE_RASTER
+from ssurgo_provider.raster_export import export_soil_property_raster, geojson_to_export_zone, RESOLUTION
+
+# number of points processed between two checkpoints
+CHECKPOINT_SIZE = 100000
+CHECKPOINT_FILE = 'checkpoint.json'
+PART_FILE = 'part-{:06d}.parquet'
+
+
+def main(argv=None):
+    """
+    Entry point of the ssurgo-provider command
+    Args:
+        argv (list(str)/None): command line arguments, sys.argv[1:] if None
+    """
+    parser = argparse.ArgumentParser(prog='ssurgo-provider', description='ssurgo soil data provider')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    batch_parser = subparsers.add_parser('batch', help='retrieve soil composition of a CSV or Parquet point file')
+    batch_parser.add_argument('input', help='CSV or Parquet file with a latitude and a longitude column')
+    batch_parser.add_argument('output', help='Parquet file written with one row by point')
+    batch_parser.add_argument('--lat-column', default='lat', help='latitude column name (default: lat)')
+    batch_parser.add_argument('--long-column', default='long', help='longitude column name (default: long)')
+    batch_parser.add_argument('--lookup-mode', default=LOOKUP_MODE_VECTOR,
+                              choices=[LOOKUP_MODE_VECTOR, LOOKUP_MODE_RASTER])
+    batch_parser.add_argument('--max-workers', type=int, default=None,
+                              help='number of worker processes (default: one by cpu)')
+    batch_parser.add_argument('--checkpoint-size', type=int, default=CHECKPOINT_SIZE,
+                              help=f'number of points between two checkpoints (default: {CHECKPOINT_SIZE})')
+    batch_parser.add_argument('--restart', action='store_true', help='ignore the checkpoint of a previous run')
+    batch_parser.add_argument('--cell-cache', default=None,
+                              help='sqlite file caching the mu_key of each 10 m cell (default: SSURGO_CELL_CACHE)')
+    batch_parser.set_defaults(function=run_batch)
+
+    map_parser = subparsers.add_parser('build-map', help='precompile the US state map')
+    map_parser.add_argument('--map-folder', default=None, help='map folder (default: see find_map_folder_path)')
+    map_parser.add_argument('--tolerance', type=float, default=SIMPLIFY_TOLERANCE,
+                            help=f'simplification tolerance in degree (default: {SIMPLIFY_TOLERANCE})')
+    map_parser.set_defaults(function=run_build_map)
+
+    pack_parser = subparsers.add_parser('build-soil-pack', help='export the tabular layers of state gdb to packs')
+    pack_parser.add_argument('gdb', nargs='+', help='path to gSSURGO_XX.gdb')
+    pack_parser.set_defaults(function=run_build_soil_pack)
+
+    index_parser = subparsers.add_parser('build-routing-index',
+                                         help='index the survey areas of every state gdb to route the points')
+    index_parser.add_argument('--ssurgo-data', default=None, help='folder of the state gdb (default: SSURGO_DATA)')
+    index_parser.set_defaults(function=run_build_routing_index)
+
+    raster_parser = subparsers.add_parser('raster', help='write a GeoTIFF of depth weighted soil properties')
+    raster_parser.add_argument('gdb', help='path to gSSURGO_XX.gdb')
+    raster_parser.add_argument('output', help='GeoTIFF written, one band by property')
+    area_group = raster_parser.add_mutually_exclusive_group(required=True)
+    area_group.add_argument('--bbox', help='min_lat,min_long,max_lat,max_long of the area')
+    area_group.add_argument('--geojson', help='geojson file of the area (polygon, feature or feature collection)')
+    raster_parser.add_argument('--properties', required=True,
+                               help='comma separated numeric chorizon fields (e.g. claytotal_r,om_r)')
+    raster_parser.add_argument('--depth', default='0-30', help='depth interval in cm (default: 0-30)')
+    raster_parser.add_argument('--resolution', type=float, default=RESOLUTION,
+                               help=f'pixel size in meter, a multiple of 10 (default: {RESOLUTION})')
+    raster_parser.add_argument('--max-workers', type=int, default=None,
+                               help='number of worker processes (default: one by cpu)')
+    raster_parser.set_defaults(function=run_raster)
+
+    args = parser.parse_args(argv)
+    args.function(args)
+
+
+def run_build_map(args):
+    print(build_state_map(args.map_folder, args.tolerance))
+
+
+def run_build_soil_pack(args):
+    for gdb_path in args.gdb:
+        print(build_soil_pack(gdb_path))
+
+
+def run_build_routing_index(args):
+    print(build_survey_area_index(args.ssurgo_data))
+
+
+def run_raster(args):
+    depths = parse_depths(args.depth)
+    if len(depths) != 1:
+        raise ValueError(f"the raster has a single depth interval, got {args.depth}")
+    bbox = None if args.bbox is None else [float(value) for value in args.bbox.split(',')]
+    zone = None
+    if args.geojson is not None:
+        with open(args.geojson) as geojson_file:
+            zone = geojson_to_export_zone(json.load(geojson_file))
+    print(export_soil_property_raster(args.output, args.gdb, args.properties.split(','), depths[0], bbox, zone,
+                                      args.resolution, args.max_workers))
+
+
+def run_batch(args):
+    """
+    Retrieve the soil composition of every point of the input file by chunk of checkpoint_size points
+    Each finished chunk is written to <output>.parts and recorded in the checkpoint, a killed run restarts after
+    the last finished chunk. The parts are merged in the output file at the end.
+    """
+    if args.cell_cache is not None:
+        configure_cell_cache(args.cell_cache)
+    output_pth = Path(args.output)
+    parts_pth = Path(f'{output_pth}.parts')
+    checkpoint = read_checkpoint(parts_pth, args)
+    total_nb = count_rows(args.input)
+
+    start_time = time.time()
+    start_nb = checkpoint['done_nb']
+    for coordinates_df in read_coordinates(args.input, args.lat_column, args.long_column, args.checkpoint_size,
+                                           checkpoint['done_nb']):
+        coordinates = list(zip(coordinates_df[args.lat_column].to_numpy(),
+                               coordinates_df[args.long_column].to_numpy()))
+        state_info_list = retrieve_multiple_soil_data(coordinates, lookup_mode=args.lookup_mode,
+                                                      max_workers=args.max_workers)
+        rows = [state_info_to_flat_dict(index, coordinate, state_info)
+                for index, coordinate, state_info in zip(coordinates_df.index, coordinates, state_info_list)]
+        pd.DataFrame(rows).to_parquet(parts_pth / PART_FILE.format(checkpoint['part_nb']), index=False)
+
+        checkpoint['part_nb'] += 1
+        checkpoint['done_nb'] += len(coordinates_df)
+        write_checkpoint(parts_pth, checkpoint)
+        display_progress(checkpoint['done_nb'], total_nb, checkpoint['done_nb'] - start_nb, time.time() - start_time)
+
+    merge_parts(parts_pth, checkpoint['part_nb'], output_pth)
+    shutil.rmtree(parts_pth)
+    sys.stderr.write(f'\n{checkpoint["done_nb"]} points written to {output_pth}\n')
+
+
+def state_info_to_flat_dict(index, coordinate, state_info):
+    """
+    One output row: input row index, state code, status and the flat soil composition (see SsurgoSoilDto)
+    """
+    soil_data = state_info.soil_data if state_info.soil_data is not None else SsurgoSoilDto(None, None)
+    flat_dict = {'index': int(index), 'state_code': state_info.state_code, 'status': state_info.status.value}
+    flat_dict.update(soil_data.to_flat_dict())
+    flat_dict['latitude'] = float(coordinate[0])
+    flat_dict['longitude'] = float(coordinate[1])
+    return flat_dict
+
+
+def read_checkpoint(parts_pth, args):
+    """
+    Read the checkpoint of a previous run of the same batch, or start a new one
+    Returns:
+        (dict): input, checkpoint_size, number of points done and number of parts written
+    """
+    checkpoint = {'input': str(Path(args.input).resolve()), 'checkpoint_size': args.checkpoint_size,
+                  'lookup_mode': args.lookup_mode, 'done_nb': 0, 'part_nb': 0}
+    checkpoint_pth = parts_pth / CHECKPOINT_FILE
+    if checkpoint_pth.exists() and not args.restart:
+        with open(checkpoint_pth) as checkpoint_file:
+            previous_checkpoint = json.load(checkpoint_file)
+        if any(previous_checkpoint[key] != checkpoint[key] for key in ['input', 'checkpoint_size', 'lookup_mode']):
+            raise ValueError(f"checkpoint {checkpoint_pth} belongs to another batch, use --restart to ignore it")
+        sys.stderr.write(f'resume after {previous_checkpoint["done_nb"]} points\n')
+        return previous_checkpoint
+    if parts_pth.exists():
+        shutil.rmtree(parts_pth)
+    parts_pth.mkdir(parents=True)
+    write_checkpoint(parts_pth, checkpoint)
+    return checkpoint
+
+
+def write_checkpoint(parts_pth, checkpoint):
+    # write then rename, a run killed while writing keeps the previous checkpoint
+    tmp_pth = parts_pth / f'{CHECKPOINT_FILE}.tmp'
+    with open(tmp_pth, 'w') as checkpoint_file:
+        json.dump(checkpoint, checkpoint_file)
+    os.replace(tmp_pth, parts_pth / CHECKPOINT_FILE)
+
+
+def is_parquet(input_pth):
+    return Path(input_pth).suffix.lower() in ('.parquet', '.pq')
+
+
+def count_rows(input_pth):
+    """
+    Number of points of a Parquet file (read from its metadata), None for CSV files
+    """
+    if not is_parquet(input_pth):
+        return None
+    import pyarrow.parquet as pq
+    return pq.ParquetFile(input_pth).metadata.num_rows
+
+
+def read_coordinates(input_pth, lat_column, long_column, chunk_size, skip_nb=0):
+    """
+    Read the coordinate columns of a CSV or Parquet file by chunk
+    Args:
+        input_pth (path): CSV or Parquet file
+        lat_column (str): latitude column name
+        long_column (str): longitude column name
+        chunk_size (int): number of rows by chunk
+        skip_nb (int): number of first rows to skip (already processed)
+
+    Returns:
+        (generator(DataFrame)): chunks with the coordinate columns, indexed by row number in the file
+    """
+    if is_parquet(input_pth):
+        import pyarrow.parquet as pq
+        chunks = (batch.to_pandas() for batch in
+                  pq.ParquetFile(input_pth).iter_batches(batch_size=chunk_size, columns=[lat_column, long_column]))
+    else:
+        chunks = pd.read_csv(input_pth, usecols=[lat_column, long_column], chunksize=chunk_size)
+    start = 0
+    for chunk in chunks:
+        chunk.index = pd.RangeIndex(start, start + len(chunk))
+        start += len(chunk)
+        if start > skip_nb:
+            yield chunk.iloc[max(skip_nb - chunk.index[0], 0):]
+
+
+def merge_parts(parts_pth, part_nb, output_pth):
+    """
+    Merge the parts in one Parquet file, one part at a time (a column null or integer in a whole part takes the
+    type of the other parts)
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    part_pth_list = [parts_pth / PART_FILE.format(part_idx) for part_idx in range(part_nb)]
+    if len(part_pth_list) == 0:
+        pd.DataFrame().to_parquet(output_pth, index=False)
+        return
+    schema = pa.unify_schemas([pq.read_schema(part_pth) for part_pth in part_pth_list], promote_options='permissive')
+    with pq.ParquetWriter(output_pth, schema) as writer:
+        for part_pth in part_pth_list:
+            writer.write_table(pq.read_table(part_pth).cast(schema))
+
+
+def display_progress(done_nb, total_nb, session_nb, elapsed_time):
+    rate = session_nb / elapsed_time if elapsed_time > 0 else 0.
+    if total_nb:
+        sys.stderr.write(f'\r{done_nb}/{total_nb} points ({100 * done_nb / total_nb:.1f}%), {rate:.0f} points/s')
+    else:
+        sys.stderr.write(f'\r{done_nb} points, {rate:.0f} points/s')
+    sys.stderr.flush()
+
+
+if __name__ == '__main__':
+    main()
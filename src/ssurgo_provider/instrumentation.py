@@ -0,0 +1,139 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+# disabled by default, set SSURGO_INSTRUMENTATION=1 or call enable_instrumentation to record the metrics
+_ENABLED = os.environ.get('SSURGO_INSTRUMENTATION', '0').lower() in ('1', 'true', 'yes')
+_LOCK = threading.Lock()
+_STAGES = {}
+_COUNTERS = {}
+_CALLBACKS = []
+
+
+def enable_instrumentation(enabled=True):
+    """
+    Start (or stop) recording stage times and counters, when disabled every probe returns at once
+    """
+    global _ENABLED
+    _ENABLED = enabled
+
+
+def is_instrumentation_enabled():
+    return _ENABLED
+
+
+def add_callback(callback):
+    """
+    Register a function called for each recorded value: callback(kind, name, value) with kind 'stage' (value in
+    second) or 'counter' (increment), e.g. to forward the metrics to a tracing or statsd client
+    """
+    with _LOCK:
+        _CALLBACKS.append(callback)
+
+
+def remove_callback(callback):
+    with _LOCK:
+        _CALLBACKS.remove(callback)
+
+
+def reset_metrics():
+    with _LOCK:
+        _STAGES.clear()
+        _COUNTERS.clear()
+
+
+def record_stage(name, seconds):
+    """
+    Add the wall time of one run of a stage
+    """
+    if not _ENABLED:
+        return
+    with _LOCK:
+        calls, total = _STAGES.get(name, (0, 0.))
+        _STAGES[name] = (calls + 1, total + seconds)
+        callbacks = list(_CALLBACKS)
+    for callback in callbacks:
+        callback('stage', name, seconds)
+
+
+def count(name, value=1):
+    """
+    Increment a counter (features scanned, geometry predicates, attribute filter queries, cache hits, ...)
+    """
+    if not _ENABLED:
+        return
+    with _LOCK:
+        _COUNTERS[name] = _COUNTERS.get(name, 0) + value
+        callbacks = list(_CALLBACKS)
+    for callback in callbacks:
+        callback('counter', name, value)
+
+
+@contextmanager
+def stage(name):
+    """
+    Context manager recording the wall time of a block as a stage
+    """
+    if not _ENABLED:
+        yield
+        return
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - start_time)
+
+
+def timed_stage(name):
+    """
+    Decorator recording the wall time of each call of a function as a stage (generators are not supported)
+    """
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _ENABLED:
+                return function(*args, **kwargs)
+            start_time = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                record_stage(name, time.perf_counter() - start_time)
+        return wrapper
+    return decorator
+
+
+def metrics_snapshot():
+    """
+    Returns:
+        (dict): stages (calls and seconds by stage) and counters recorded by this process since the last reset
+    """
+    with _LOCK:
+        return {'stages': {name: {'calls': calls, 'seconds': seconds} for name, (calls, seconds) in _STAGES.items()},
+                'counters': dict(_COUNTERS)}
+
+
+def render_prometheus(prefix='ssurgo'):
+    """
+    Render the metrics of this process in the Prometheus text format
+    Args:
+        prefix (str): prefix of the metric names
+
+    Returns:
+        (str): metrics page
+    """
+    snapshot = metrics_snapshot()
+    lines = [f'# HELP {prefix}_stage_seconds_total Wall time spent in each pipeline stage',
+             f'# TYPE {prefix}_stage_seconds_total counter']
+    lines += [f'{prefix}_stage_seconds_total{{stage="{name}"}} {values["seconds"]:.6f}'
+              for name, values in sorted(snapshot['stages'].items())]
+    lines += [f'# HELP {prefix}_stage_calls_total Number of runs of each pipeline stage',
+              f'# TYPE {prefix}_stage_calls_total counter']
+    lines += [f'{prefix}_stage_calls_total{{stage="{name}"}} {values["calls"]}'
+              for name, values in sorted(snapshot['stages'].items())]
+    lines += [f'# HELP {prefix}_events_total Counters of the pipeline (features scanned, queries, cache hits, ...)',
+              f'# TYPE {prefix}_events_total counter']
+    lines += [f'{prefix}_events_total{{event="{name}"}} {value}'
+              for name, value in sorted(snapshot['counters'].items())]
+    return '\n'.join(lines) + '\n'
@@ -1,34 +1,155 @@
 import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from itertools import islice
+from math import isnan
 from pathlib import Path
 
-from osgeo import ogr
+import numpy as np
 from shapely.geometry import Point
 
-from ssurgo_provider.object.gbd_connect import GbdConnect
-from ssurgo_provider.object.state_info import StateInfoStatus
+from ssurgo_provider.instrumentation import timed_stage
+from ssurgo_provider.object.cell_cache import CellCache
+from ssurgo_provider.object.gdb_pool import gdb_pool
+from ssurgo_provider.object.mapunit_raster import MapunitRaster
+from ssurgo_provider.object.point_batch import PointBatch
+from ssurgo_provider.object.soil_cache import gdb_release
+from ssurgo_provider.object.soil_pack import SoilPack
+from ssurgo_provider.object.state_info import StateInfo, StateInfoStatus
+from ssurgo_provider.object.survey_area_index import SurveyAreaIndex
+from ssurgo_provider.param import LOOKUP_MODE_VECTOR, LOOKUP_MODE_RASTER
 from ssurgo_provider.soil_tools import find_soil_id_ref, find_soil_horizon_distribution, extract_soil_horizon_data, \
-    build_soil_composition, build_soil_composition_without_point
-from ssurgo_provider.spatial_tools import transform_wgs84_to_albers, find_county_id, retrieve_state_code
+    build_soil_composition, build_soil_composition_without_point, find_soil_id_ref_from_raster, \
+    aggregate_soil_properties
+from ssurgo_provider.spatial_tools import points_batch, find_county_id, retrieve_state_code, geojson_to_zone, \
+    project_zones_to_albers, retrieve_zones_mu_keys, retrieve_survey_area
 
+# maximum number of points of one state processed at once (one task when processed in parallel)
+STATE_CHUNK_SIZE = 20000
+# maximum number of points waiting in the state buffers of iter_soil_data
+MAX_BUFFERED_POINTS = 100000
 
-def retrieve_multiple_soil_data(coordinates, disable_file_error=True, disable_location_error=True):
+# long lived worker pools by number of workers, see worker_pool
+_WORKER_POOLS = {}
+_WORKER_POOLS_LOCK = threading.Lock()
+
+
+def retrieve_multiple_soil_data(coordinates, disable_file_error=True, disable_location_error=True,
+                                lookup_mode=LOOKUP_MODE_VECTOR, max_workers=1, executor=None):
     """
     Function to retrieve soil composition from a list of location (coordinates)
     Args:
         coordinates (list(tuple)): list of location [(lat, long ), (lat, long), ...]
         disable_file_error (bool): if True disable throw exception when data file is not found for a state
         disable_location_error (bool): if True disable throw exception when location is not in USA
+        lookup_mode (str): LOOKUP_MODE_VECTOR (MUPOLYGON, exact) or LOOKUP_MODE_RASTER (MapunitRaster_10m, faster)
+        max_workers (int/None): number of worker processes, see manage_retrieve_soils_composition
+        executor (Executor/None): process pool of the caller, see manage_retrieve_soils_composition
 
     Returns:
         soil_data_list (list(StateInfo)): list with complete soil StateInfo object
     """
     points = [Point(coordinate[0], coordinate[1]) for coordinate in coordinates]
-    states_info_list = retrieve_state_code(points=points, disable_location_error=disable_location_error)
-    states_info_list = find_ssurgo_state_folder_path(states_info_list, disable_file_error)
-    soil_data_list = manage_retrieve_soils_composition(states_info_list)
+    states_info_list = route_points(points, disable_location_error=disable_location_error,
+                                    disable_file_error=disable_file_error)
+    soil_data_list = manage_retrieve_soils_composition(states_info_list, lookup_mode=lookup_mode,
+                                                       max_workers=max_workers, executor=executor)
     return soil_data_list
 
 
+def iter_soil_data(coordinates, chunk_size=STATE_CHUNK_SIZE, max_buffered_points=MAX_BUFFERED_POINTS,
+                   disable_file_error=True, disable_location_error=True, lookup_mode=LOOKUP_MODE_VECTOR):
+    """
+    Generator to retrieve soil composition of a very large (or endless) flow of location with a bounded memory
+    Locations are read by chunk and kept in one buffer by state, a state buffer is processed as soon as it holds
+    chunk_size locations (or when all buffers hold more than max_buffered_points locations, the largest one)
+    Args:
+        coordinates (iterable(tuple)): location (lat, long), any iterable (list, generator, file reader, ...)
+        chunk_size (int): number of locations read and processed at once
+        max_buffered_points (int): maximum number of locations waiting in the state buffers
+        disable_file_error (bool): if True disable throw exception when data file is not found for a state
+        disable_location_error (bool): if True disable throw exception when location is not in USA
+        lookup_mode (str): LOOKUP_MODE_VECTOR (MUPOLYGON, exact) or LOOKUP_MODE_RASTER (MapunitRaster_10m, faster)
+
+    Returns:
+        (generator): (index of the location in coordinates, StateInfo) as soon as the location is processed, the
+                     locations are not yielded in input order
+    """
+    if chunk_size < 1 or max_buffered_points < chunk_size:
+        raise ValueError("chunk_size must be positive and lower than max_buffered_points")
+    buffers = {}
+    buffered_nb = 0
+    coordinates = iter(coordinates)
+    index = 0
+    while True:
+        coordinates_chunk = list(islice(coordinates, chunk_size))
+        if len(coordinates_chunk) == 0:
+            break
+        points = [Point(coordinate[0], coordinate[1]) for coordinate in coordinates_chunk]
+        states_info_list = route_points(points, disable_location_error=disable_location_error,
+                                        disable_file_error=disable_file_error)
+        for state_info in states_info_list:
+            if state_info.status == StateInfoStatus.IN_PROGRESS:
+                buffers.setdefault(state_info.state_code, []).append((index, state_info))
+                buffered_nb += 1
+            else:
+                yield index, state_info
+            index += 1
+
+        for state_code in [state_code for state_code, buffer in buffers.items() if len(buffer) >= chunk_size]:
+            buffered_nb -= len(buffers[state_code])
+            yield from flush_state_buffer(buffers.pop(state_code), chunk_size, lookup_mode)
+        while buffered_nb > max_buffered_points - chunk_size:
+            state_code = max(buffers, key=lambda code: len(buffers[code]))
+            buffered_nb -= len(buffers[state_code])
+            yield from flush_state_buffer(buffers.pop(state_code), chunk_size, lookup_mode)
+
+    for buffer in buffers.values():
+        yield from flush_state_buffer(buffer, chunk_size, lookup_mode)
+
+
+def flush_state_buffer(buffer, chunk_size=STATE_CHUNK_SIZE, lookup_mode=LOOKUP_MODE_VECTOR):
+    """
+    Process the locations of a state buffer of iter_soil_data, by chunk of chunk_size locations
+    Args:
+        buffer (list(tuple)): (index, StateInfo) of locations of the same state
+        chunk_size (int): number of locations processed at once
+        lookup_mode (str): LOOKUP_MODE_VECTOR or LOOKUP_MODE_RASTER
+
+    Returns:
+        (generator): (index, StateInfo) complete with soil data
+    """
+    for start in range(0, len(buffer), chunk_size):
+        chunk = buffer[start:start + chunk_size]
+        state_info_list = manage_retrieve_soils_composition([state_info for _, state_info in chunk],
+                                                            lookup_mode=lookup_mode, chunk_size=chunk_size)
+        yield from zip([index for index, _ in chunk], state_info_list)
+
+
+def route_points(points, states_gdf=None, disable_location_error=True, disable_file_error=True):
+    """
+    Find the state gdb of each point: with the national survey area index when it is built and up to date (one bulk
+    query, the survey area of each point is kept in StateInfo.area_symbol and the county lookup is skipped), with the
+    state map and the SSURGO_DATA folder otherwise
+    Args:
+        points (list(Point)): list of Point(lat, long)
+        states_gdf (GeoDataFrame/OpenMap/None): see retrieve_state_code, only used without the survey area index
+        disable_location_error (bool): if True disable throw exception when location is not in USA
+        disable_file_error (bool): if True disable throw exception when data file is not found for a state
+
+    Returns:
+        (list(StateInfo)): state info with state code and gdb path of each point, in the same order as points
+    """
+    survey_area_index = SurveyAreaIndex.open()
+    if survey_area_index is not None:
+        return retrieve_survey_area(points, survey_area_index, disable_location_error)
+    states_info_list = retrieve_state_code(points=points, states_gdf=states_gdf,
+                                           disable_location_error=disable_location_error)
+    return find_ssurgo_state_folder_path(states_info_list, disable_file_error)
+
+
+@timed_stage('find_ssurgo_state_folder_path')
 def find_ssurgo_state_folder_path(state_info_list, disable_file_error=True):
     """
     Find the gbd folder path associated to the state_code
@@ -40,10 +161,14 @@ def find_ssurgo_state_folder_path(state_info_list, disable_file_error=True):
     """
 
     ssurgo_data_pth = os.environ['SSURGO_DATA']
+    # the folder is listed once for all the points
+    ssurgo_state_folders = None
     for state_info in state_info_list:
         if state_info.status == StateInfoStatus.IN_PROGRESS:
+            if ssurgo_state_folders is None:
+                ssurgo_state_folders = set(os.listdir(ssurgo_data_pth))
             ssurgo_state_folder = f'gSSURGO_{state_info.state_code.upper()}.gdb'
-            if ssurgo_state_folder not in os.listdir(ssurgo_data_pth):
+            if ssurgo_state_folder not in ssurgo_state_folders:
                 if not disable_file_error:
                     raise ValueError(f"no ssurgo data find for state {state_info.state_code}, please download it")
                 else:
@@ -53,74 +178,211 @@ def find_ssurgo_state_folder_path(state_info_list, disable_file_error=True):
     return state_info_list
 
 
-def retrieve_soil_composition(coordinates, ssurgo_folder_path):
+@timed_stage('retrieve_soil_composition')
+def retrieve_soil_composition(coordinates, ssurgo_folder_path, lookup_mode=LOOKUP_MODE_VECTOR, county_ids=None):
     """
         This function is usefull to retrieve soil data for the location specified in coordinates
     Args:
-        coordinates (list): list of Points (lat, long coordinate) (espg 4326)
+        coordinates (list(tuple)/ndarray): location (lat, long) of each point (espg 4326)
         ssurgo_folder_path (path): path to the ssurgo database at the state level
+        lookup_mode (str): LOOKUP_MODE_VECTOR (MUPOLYGON, exact) or LOOKUP_MODE_RASTER (MapunitRaster_10m, faster)
+        county_ids (list(str)/None): survey area (AREASYMBOL) of each point when already known (see route_points),
+                                     the SAPOLYGON lookup is skipped
 
     Returns:
         soil_composition_list (list): list of SsurgoSoilDto, one for each location
 
     """
 
-    transform = transform_wgs84_to_albers()
+    # project all locations at once to USA_Contiguous_Albers, each stage then fills the columns of the batch in place
+    point_batch = points_batch(coordinates)
 
-    pts_coordinates = []
-    point_base = ogr.Geometry(ogr.wkbPoint)
-    for coordinate in coordinates:
-        point = point_base.__copy__()
-        point.AddPoint(coordinate[0], coordinate[1])
-        point.Transform(transform)
-        pts_coordinates.append(point)
+    # take a connection to geo database from the pool
+    soil_pack = SoilPack.open(ssurgo_folder_path)
+    with gdb_pool.connection(ssurgo_folder_path) as gdb_connection:
+        gdb = gdb_connection.gdb
+        # the release (modification time, SPATIALVER) namespaces the cell and soil caches, read once by chunk
+        release = gdb_release(gdb)
+        find_mu_key(point_batch, gdb, ssurgo_folder_path, lookup_mode, soil_pack, county_ids, release)
+        find_soil_horizon_distribution(point_batch, gdb, soil_pack, release)
+        horizon_table = extract_soil_horizon_data(point_batch, gdb, soil_pack, release)
 
-    # open connection to geo database
-    gdb_connection = GbdConnect(ssurgo_folder_path)
-    gdb = gdb_connection.gdb
+    # SsurgoSoilDto objects are only built here, from the columns of the batch
+    soil_composition_list = build_soil_composition(point_batch, horizon_table)
+    return soil_composition_list
 
-    pts_info_df = find_county_id(pts_coordinates, gdb)
-    pts_info_df = find_soil_id_ref(pts_info_df, gdb)
-    pts_info_df = find_soil_horizon_distribution(pts_info_df, gdb)
-    soil_data_dict = extract_soil_horizon_data(pts_info_df, gdb)
-    del gdb
 
-    soil_composition_list = build_soil_composition(pts_info_df, soil_data_dict)
-    return soil_composition_list
+def find_mu_key(point_batch, gdb, ssurgo_folder_path, lookup_mode=LOOKUP_MODE_VECTOR, soil_pack=None,
+                county_ids=None, release=None):
+    """
+        Find county id and soil references (mu_key) of each location with the selected lookup mode
+        In vector mode the locations whose grid cell is in the cell cache (see CellCache) skip the polygon lookups
+    Args:
+        point_batch (PointBatch): locations with x and y (USA_Contiguous_Albers), see points_batch
+        gdb (DataSource): ssurgo state datasource
+        ssurgo_folder_path (path): path to the ssurgo database at the state level
+        lookup_mode (str): LOOKUP_MODE_VECTOR or LOOKUP_MODE_RASTER
+        soil_pack (SoilPack/None): columnar pack of the gdb, read instead of the gdb tables if not None
+        county_ids (list(str)/None): survey area of each location when already known, see retrieve_soil_composition
+        release (tuple/None): release of the gdb read once by the caller, see gdb_release, read here if None
+
+    Returns:
+        point_batch (PointBatch): the same batch with county_id mu_sym mu_key spatial_ver area_symbol filled
+    """
+    if lookup_mode == LOOKUP_MODE_VECTOR:
+        cell_cache = CellCache.open()
+        if cell_cache is None:
+            return find_mu_key_from_polygons(point_batch, gdb, county_ids)
+        release = gdb_release(gdb) if release is None else release
+        missing = cell_cache.lookup(release, point_batch)
+        if len(missing) > 0:
+            missing_batch = find_mu_key_from_polygons(point_batch.take(missing), gdb,
+                                                      None if county_ids is None else [county_ids[position]
+                                                                                       for position in missing])
+            point_batch.put(missing, missing_batch)
+            cell_cache.store(release, missing_batch)
+        return point_batch
+    if lookup_mode == LOOKUP_MODE_RASTER:
+        return find_soil_id_ref_from_raster(point_batch, gdb, MapunitRaster.get(ssurgo_folder_path), soil_pack)
+    raise ValueError(f"unknown lookup mode {lookup_mode}, use {LOOKUP_MODE_VECTOR} or {LOOKUP_MODE_RASTER}")
+
+
+def find_mu_key_from_polygons(point_batch, gdb, county_ids=None):
+    """
+    Vector lookup: survey area (SAPOLYGON, skipped when county_ids is given) then map unit (MUPOLYGON) of each location
+    """
+    if county_ids is None:
+        find_county_id(point_batch, gdb)
+    else:
+        point_batch.county_id[:] = county_ids
+    return find_soil_id_ref(point_batch, gdb)
+
+
+def compare_lookup_modes(coordinates, ssurgo_folder_path):
+    """
+        Compare the mu_key found by the vector (exact) and the raster lookup modes for the same locations
+    Args:
+        coordinates (list(tuple)/ndarray): location (lat, long) of each point (espg 4326)
+        ssurgo_folder_path (path): path to the ssurgo database at the state level
+
+    Returns:
+        (dict): number of points, number of points found by the vector mode, agreement rate (between 0 and 1) on
+                the points found by the vector mode and index of the points in disagreement
+    """
+    point_batch = points_batch(coordinates)
+
+    with gdb_pool.connection(ssurgo_folder_path) as gdb_connection:
+        gdb = gdb_connection.gdb
+        # both modes fill the same batch, keep a copy of the vector mu_key (exact, the cell cache is not used)
+        vector_mu_key = find_mu_key_from_polygons(point_batch, gdb).mu_key.copy()
+        raster_mu_key = find_mu_key(point_batch, gdb, ssurgo_folder_path, LOOKUP_MODE_RASTER).mu_key
+
+    compared = ~np.isnan(vector_mu_key)
+    disagreement = compared & (vector_mu_key != raster_mu_key)
+    compared_nb = int(compared.sum())
+    return {'point_nb': len(vector_mu_key),
+            'compared_nb': compared_nb,
+            'agreement_rate': 1 - disagreement.sum() / compared_nb if compared_nb > 0 else None,
+            'disagreement_index': np.flatnonzero(disagreement).tolist()}
 
 
-def manage_retrieve_soils_composition(state_info_list):
+def manage_retrieve_soils_composition(state_info_list, lookup_mode=LOOKUP_MODE_VECTOR, max_workers=1,
+                                      chunk_size=STATE_CHUNK_SIZE, executor=None):
     """
     Manage all pipeline to retrieve soil data
+    Points are grouped by state, large states are split in chunks of neighbour points, and each chunk is processed
+    in a worker process (with its own gdb handles) when max_workers is not 1. The workers are kept between calls
+    (see worker_pool) so they reuse their gdb handles, caches and state map
     Args:
         state_info_list (list): list of state info object (with lat and long)
+        lookup_mode (str): LOOKUP_MODE_VECTOR (MUPOLYGON, exact) or LOOKUP_MODE_RASTER (MapunitRaster_10m, faster)
+        max_workers (int/None): number of worker processes, 1 to process in the current process, None for one by cpu
+        chunk_size (int): maximum number of points processed at once
+        executor (Executor/None): process pool of the caller used instead of worker_pool(max_workers)
 
     Returns:
-        (list(state_info)): list of state info object complete with soil data
+        (list(state_info)): list of state info object complete with soil data, in the same order
     """
     sort_by_state = {}
-    state_list = []
     for state_info in state_info_list:
         if state_info.status == StateInfoStatus.IN_PROGRESS:
-            if state_info not in state_list:
-                state_list.append(state_info.state_code)
-                sort_by_state[state_info.state_code] = [state_info]
-            else:
-                sort_by_state[state_info.state_code].append(state_info)
-    for state in state_list:
-        ssurgo_folder_path = sort_by_state[state][0].state_folder_pth
-        coordinates = [(state_info.points.x, state_info.points.y) for state_info in sort_by_state[state]]
-        soil_data_list = retrieve_soil_composition(coordinates, ssurgo_folder_path)
-        [state_info.set_soil(soil_data)
-         for state_info, soil_data in zip(sort_by_state[state], soil_data_list)]
+            sort_by_state.setdefault(state_info.state_code, []).append(state_info)
+
+    chunks = []
+    for state_info_group in sort_by_state.values():
+        if len(state_info_group) > chunk_size:
+            # neighbour points in the same chunk keep the spatial filters of each chunk small
+            state_info_group = sorted(state_info_group, key=lambda state_info: (state_info.points.y,
+                                                                                 state_info.points.x))
+        chunks += [state_info_group[start:start + chunk_size] for start in range(0, len(state_info_group), chunk_size)]
+
+    coordinates_list = [[(state_info.points.x, state_info.points.y) for state_info in chunk] for chunk in chunks]
+    ssurgo_folder_path_list = [chunk[0].state_folder_pth for chunk in chunks]
+    lookup_mode_list = [lookup_mode] * len(chunks)
+    county_ids_list = [chunk_county_ids(chunk) for chunk in chunks]
+    if (executor is not None or max_workers != 1) and len(chunks) > 1:
+        pool = worker_pool(max_workers) if executor is None else executor
+        try:
+            soil_data_lists = list(pool.map(retrieve_soil_composition, coordinates_list, ssurgo_folder_path_list,
+                                            lookup_mode_list, county_ids_list))
+        except BrokenProcessPool:
+            # a worker died, the next call starts a new pool
+            if executor is None:
+                discard_worker_pool(max_workers)
+            raise
+    else:
+        soil_data_lists = list(map(retrieve_soil_composition, coordinates_list, ssurgo_folder_path_list,
+                                   lookup_mode_list, county_ids_list))
+
+    for chunk, soil_data_list in zip(chunks, soil_data_lists):
+        [state_info.set_soil(soil_data) for state_info, soil_data in zip(chunk, soil_data_list)]
     return state_info_list
 
 
+def worker_pool(max_workers=None):
+    """
+    Process pool shared by the calls with the same number of workers, started on first use and kept until
+    discard_worker_pool (or exit)
+    Args:
+        max_workers (int/None): number of worker processes, None for one by cpu
+
+    Returns:
+        (ProcessPoolExecutor): the pool
+    """
+    with _WORKER_POOLS_LOCK:
+        executor = _WORKER_POOLS.get(max_workers)
+        if executor is None:
+            executor = ProcessPoolExecutor(max_workers=max_workers)
+            _WORKER_POOLS[max_workers] = executor
+    return executor
+
+
+def discard_worker_pool(max_workers=None):
+    """
+    Stop the pool of worker_pool(max_workers), if it is started
+    """
+    with _WORKER_POOLS_LOCK:
+        executor = _WORKER_POOLS.pop(max_workers, None)
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def chunk_county_ids(state_info_list):
+    """
+    Returns:
+        (list(str)/None): survey area of each point when every point was routed with the survey area index
+    """
+    county_ids = [state_info.area_symbol for state_info in state_info_list]
+    return None if any(county_id is None for county_id in county_ids) else county_ids
+
+
+@timed_stage('retrieve_soil_information_from_mukey')
 def retrieve_soil_information_from_mukey(pts_info_df, ssurgo_folder_path):
     """
         This function is usefull to retrieve soil data from mu_sym and mu_key
     Args:
-        pts_info_df (dataframe): see with mu_sym mu_key spatial_ver area_symbol for each location (see find_soil_id_ref)
+        pts_info_df (dataframe): with mu_sym mu_key spatial_ver area_symbol for each location (see find_soil_id_ref),
+                                 converted once to a PointBatch
         ssurgo_folder_path (path): path to the ssurgo database at the state level
 
     Returns:
@@ -128,13 +390,227 @@ def retrieve_soil_information_from_mukey(pts_info_df, ssurgo_folder_path):
 
     """
 
-    # open connection to geo database
-    gdb_connection = GbdConnect(ssurgo_folder_path)
-    gdb = gdb_connection.gdb
+    point_batch = PointBatch.from_dataframe(pts_info_df)
 
-    pts_info_df = find_soil_horizon_distribution(pts_info_df, gdb)
-    soil_data_dict = extract_soil_horizon_data(pts_info_df, gdb)
-    del gdb
+    # take a connection to geo database from the pool
+    soil_pack = SoilPack.open(ssurgo_folder_path)
+    with gdb_pool.connection(ssurgo_folder_path) as gdb_connection:
+        gdb = gdb_connection.gdb
+        release = gdb_release(gdb)
+        find_soil_horizon_distribution(point_batch, gdb, soil_pack, release)
+        horizon_table = extract_soil_horizon_data(point_batch, gdb, soil_pack, release)
 
-    soil_composition_list = build_soil_composition_without_point(pts_info_df, soil_data_dict)
+    soil_composition_list = build_soil_composition_without_point(point_batch, horizon_table)
     return soil_composition_list
+
+
+def retrieve_multiple_soil_properties(coordinates, properties, depths, disable_file_error=True,
+                                      disable_location_error=True, lookup_mode=LOOKUP_MODE_VECTOR,
+                                      chunk_size=STATE_CHUNK_SIZE, states_gdf=None):
+    """
+    Depth weighted soil properties of a list of location, see aggregate_soil_properties
+    Args:
+        coordinates (list(tuple)): list of location [(lat, long ), (lat, long), ...]
+        properties (list(str)): numeric chorizon fields (claytotal_r, om_r, awc_r, ksat_r, ...)
+        depths (list(tuple)): (top, bottom) of each depth interval (cm), e.g. [(0, 30), (30, 100)]
+        disable_file_error (bool): if True disable throw exception when data file is not found for a state
+        disable_location_error (bool): if True disable throw exception when location is not in USA
+        lookup_mode (str): LOOKUP_MODE_VECTOR (MUPOLYGON, exact) or LOOKUP_MODE_RASTER (MapunitRaster_10m, faster)
+        chunk_size (int): maximum number of points processed at once
+        states_gdf (GeoDataFrame/OpenMap/None): see retrieve_state_code
+
+    Returns:
+        (list(StateInfo), dict): state info of each location (status SUCCEED when processed) and ndarray
+                                 (location, depth interval) by property, nan for the locations not processed
+    """
+    depths = check_depths(depths)
+    points = [Point(coordinate[0], coordinate[1]) for coordinate in coordinates]
+    states_info_list = route_points(points, states_gdf, disable_location_error, disable_file_error)
+
+    sort_by_state = {}
+    for position, state_info in enumerate(states_info_list):
+        if state_info.status == StateInfoStatus.IN_PROGRESS:
+            sort_by_state.setdefault(state_info.state_code, []).append(position)
+    coordinates = np.asarray(coordinates, dtype=np.float64).reshape(-1, 2)
+    values = {soil_property: np.full((len(coordinates), len(depths)), np.nan) for soil_property in properties}
+    for state_positions in sort_by_state.values():
+        for start in range(0, len(state_positions), chunk_size):
+            positions = state_positions[start:start + chunk_size]
+            state_values = retrieve_soil_properties(coordinates[positions],
+                                                    states_info_list[positions[0]].state_folder_pth, properties,
+                                                    depths, lookup_mode,
+                                                    chunk_county_ids([states_info_list[position]
+                                                                      for position in positions]))
+            for soil_property in properties:
+                values[soil_property][positions] = state_values[soil_property]
+            for position in positions:
+                states_info_list[position].status = StateInfoStatus.SUCCEED
+    return states_info_list, values
+
+
+@timed_stage('retrieve_soil_properties')
+def retrieve_soil_properties(coordinates, ssurgo_folder_path, properties, depths, lookup_mode=LOOKUP_MODE_VECTOR,
+                             county_ids=None):
+    """
+        Depth weighted soil properties of locations of the same state, see aggregate_soil_properties
+    Args:
+        coordinates (list(tuple)/ndarray): location (lat, long) of each point (espg 4326)
+        ssurgo_folder_path (path): path to the ssurgo database at the state level
+        properties (list(str)): numeric chorizon fields
+        depths (list(tuple)): (top, bottom) of each depth interval (cm)
+        lookup_mode (str): LOOKUP_MODE_VECTOR (MUPOLYGON, exact) or LOOKUP_MODE_RASTER (MapunitRaster_10m, faster)
+        county_ids (list(str)/None): survey area of each point when already known, see retrieve_soil_composition
+
+    Returns:
+        (dict): ndarray (location, depth interval) by property
+    """
+    point_batch = points_batch(coordinates)
+    soil_pack = SoilPack.open(ssurgo_folder_path)
+    with gdb_pool.connection(ssurgo_folder_path) as gdb_connection:
+        gdb = gdb_connection.gdb
+        # the release (modification time, SPATIALVER) namespaces the cell and soil caches, read once by chunk
+        release = gdb_release(gdb)
+        find_mu_key(point_batch, gdb, ssurgo_folder_path, lookup_mode, soil_pack, county_ids, release)
+        find_soil_horizon_distribution(point_batch, gdb, soil_pack, release)
+        horizon_table = extract_soil_horizon_data(point_batch, gdb, soil_pack, release)
+    return aggregate_soil_properties(point_batch, horizon_table, properties, check_depths(depths))
+
+
+@timed_stage('retrieve_soil_properties_from_mukey')
+def retrieve_soil_properties_from_mukey(mu_keys, ssurgo_folder_path, properties, depths):
+    """
+        Depth weighted soil properties of map units of the same state, see aggregate_soil_properties
+    Args:
+        mu_keys (list(int)): map unit keys
+        ssurgo_folder_path (path): path to the ssurgo database at the state level
+        properties (list(str)): numeric chorizon fields
+        depths (list(tuple)): (top, bottom) of each depth interval (cm)
+
+    Returns:
+        (dict): ndarray (map unit, depth interval) by property
+    """
+    mu_keys = np.asarray(mu_keys, dtype=np.float64).reshape(-1)
+    unknown = np.full(len(mu_keys), np.nan)
+    point_batch = PointBatch(unknown, unknown, unknown, unknown)
+    point_batch.mu_key[:] = mu_keys
+    soil_pack = SoilPack.open(ssurgo_folder_path)
+    with gdb_pool.connection(ssurgo_folder_path) as gdb_connection:
+        gdb = gdb_connection.gdb
+        release = gdb_release(gdb)
+        find_soil_horizon_distribution(point_batch, gdb, soil_pack, release)
+        horizon_table = extract_soil_horizon_data(point_batch, gdb, soil_pack, release)
+    return aggregate_soil_properties(point_batch, horizon_table, properties, check_depths(depths))
+
+
+def retrieve_state_soil_properties_from_mukey(mu_keys, state_code, properties, depths, disable_file_error=True):
+    """
+    Depth weighted soil properties of map units of a state, see retrieve_soil_properties_from_mukey
+    Args:
+        mu_keys (list(int)): map unit keys
+        state_code (str): state code of the map units
+        properties (list(str)): numeric chorizon fields
+        depths (list(tuple)): (top, bottom) of each depth interval (cm)
+        disable_file_error (bool): if True disable throw exception when data file is not found for the state
+
+    Returns:
+        (StateInfo, dict): state info (status SUCCEED when processed) and ndarray (map unit, depth interval) by
+                           property, nan if the state is not processed
+    """
+    state_info = find_ssurgo_state_folder_path([StateInfo(state_code=state_code, points=None,
+                                                          status=StateInfoStatus.IN_PROGRESS)], disable_file_error)[0]
+    if state_info.status != StateInfoStatus.IN_PROGRESS:
+        return state_info, {soil_property: np.full((len(mu_keys), len(check_depths(depths))), np.nan)
+                            for soil_property in properties}
+    values = retrieve_soil_properties_from_mukey(mu_keys, state_info.state_folder_pth, properties, depths)
+    state_info.status = StateInfoStatus.SUCCEED
+    return state_info, values
+
+
+def check_depths(depths):
+    """
+    Returns:
+        (ndarray): depth intervals as a (interval, 2) array (cm)
+    Raises:
+        ValueError: if an interval is not (top, bottom) with 0 <= top < bottom
+    """
+    depths = np.asarray(depths, dtype=np.float64)
+    if depths.ndim != 2 or depths.shape[1] != 2 or len(depths) == 0:
+        raise ValueError("depths should be a list of (top, bottom) intervals in cm, e.g. [(0, 30), (30, 100)]")
+    if np.any(depths[:, 0] < 0) or np.any(depths[:, 0] >= depths[:, 1]):
+        raise ValueError("each depth interval should be (top, bottom) with 0 <= top < bottom")
+    return depths
+
+
+def parse_depths(depths_text):
+    """
+    Parse depth intervals written as "top-bottom" separated by comma (e.g. "0-30,30-100", cm)
+    Returns:
+        (ndarray): depth intervals as a (interval, 2) array (cm)
+    """
+    try:
+        depths = [[float(depth) for depth in interval.split('-')] for interval in depths_text.split(',')]
+    except (AttributeError, ValueError):
+        raise ValueError(f"unable to read depths {depths_text}, use top-bottom intervals in cm e.g. 0-30,30-100")
+    return check_depths(depths)
+
+
+def soil_properties_to_dict_list(values, depths):
+    """
+    Convert the soil properties of aggregate_soil_properties to one dict by location
+    Args:
+        values (dict): ndarray (location, depth interval) by property
+        depths (list(tuple)): (top, bottom) of each depth interval (cm)
+
+    Returns:
+        (list(dict)): {property: {"top-bottom": value (None if unknown)}} for each location
+    """
+    depth_labels = [f"{top:g}-{bottom:g}" for top, bottom in check_depths(depths).tolist()]
+    property_lists = {soil_property: property_values.tolist() for soil_property, property_values in values.items()}
+    location_nb = len(next(iter(values.values()))) if len(values) > 0 else 0
+    return [{soil_property: {label: None if isnan(value) else value
+                             for label, value in zip(depth_labels, property_list[location_idx])}
+             for soil_property, property_list in property_lists.items()} for location_idx in range(location_nb)]
+
+
+def retrieve_mu_key_by_zones(feature_collection, states_gdf=None, state_code=None, lookup_mode=LOOKUP_MODE_VECTOR,
+                             all_touched=False, disable_file_error=True):
+    """
+        Retrieve the mu_key percentage of many zones (field boundaries, ...) at once
+        Zones are grouped by state (state of a point inside the zone) and each state gdb is read once for all its zones
+    Args:
+        feature_collection (dict): geojson FeatureCollection of Polygon / MultiPolygon, coordinates as (long, lat)
+        states_gdf (GeoDataFrame/OpenMap/None): see retrieve_state_code
+        state_code (str/None): state code of every zone, found from the state map if None
+        lookup_mode (str): LOOKUP_MODE_VECTOR (exact) or LOOKUP_MODE_RASTER, see retrieve_mu_key_from_raster_by_zone
+        all_touched (bool): raster mode only, see retrieve_mu_key_from_raster_by_zone
+        disable_file_error (bool): if True disable throw exception when data file is not found for a state
+
+    Returns:
+        (list(dict)): for each feature in the same order: id, state_code, status and mu_key (dict of mu_key inside
+                      the zone with their area percentage, None if the zone is not processed)
+    """
+    features = feature_collection['features']
+    zones = [geojson_to_zone(feature['geometry']) for feature in features]
+    points = [Point(zone_point.y, zone_point.x) for zone_point in [zone.representative_point() for zone in zones]]
+    if state_code is None:
+        states_info_list = route_points(points, states_gdf, disable_file_error=disable_file_error)
+    else:
+        states_info_list = [StateInfo(state_code=state_code, points=point, status=StateInfoStatus.IN_PROGRESS)
+                            for point in points]
+        states_info_list = find_ssurgo_state_folder_path(states_info_list, disable_file_error)
+    zones = project_zones_to_albers(zones)
+
+    sort_by_state = {}
+    for position, state_info in enumerate(states_info_list):
+        if state_info.status == StateInfoStatus.IN_PROGRESS:
+            sort_by_state.setdefault(state_info.state_code, []).append(position)
+    mu_key_list = [None] * len(features)
+    for positions in sort_by_state.values():
+        responses = retrieve_zones_mu_keys(zones[positions], states_info_list[positions[0]].state_folder_pth,
+                                           lookup_mode, all_touched)
+        for position, response in zip(positions, responses):
+            mu_key_list[position] = response
+            states_info_list[position].status = StateInfoStatus.SUCCEED
+
+    return [{'id': feature.get('id'), 'state_code': state_info.state_code, 'status': state_info.status.value,
+             'mu_key': mu_key} for feature, state_info, mu_key in zip(features, states_info_list, mu_key_list)]
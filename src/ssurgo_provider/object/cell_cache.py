@@ -0,0 +1,232 @@
+import os
+import sqlite3
+import threading
+
+import numpy as np
+
+from ssurgo_provider.instrumentation import count
+
+# side of the grid cells (meter, USA_Contiguous_Albers), every location of a cell gets the map unit of the first one
+CELL_SIZE = 10.
+# cell indices are packed in one integer key: (column + CELL_OFFSET) * CELL_SHIFT + (row + CELL_OFFSET)
+CELL_OFFSET = 2 ** 28
+CELL_SHIFT = 2 ** 30
+# number of keys by IN (...) query, below the sqlite variable limit
+QUERY_CHUNK_SIZE = 500
+# seconds a writer waits for the lock held by another writer
+BUSY_TIMEOUT = 30.
+CELL_COLUMNS = ['county_id', 'mu_sym', 'mu_key', 'spatial_ver', 'area_symbol']
+# version of the database schema (PRAGMA user_version), a database of another version is emptied
+SCHEMA_VERSION = 2
+
+_CELL_CACHE = {}
+_CELL_CACHE_LOCK = threading.Lock()
+
+
+class CellCache:
+    def __init__(self, db_pth, cell_size=CELL_SIZE):
+        """
+            Persistent cache of the vector lookup (county_id mu_sym mu_key spatial_ver area_symbol) by grid cell of
+            the Albers coordinates, in a sqlite database shared by the threads and processes (WAL mode, readers never
+            wait for a writer). The cells of a gdb are namespaced by its release (see gdb_release): a modified gdb
+            gets a new namespace and the cells of its older releases are deleted.
+        Args:
+            db_pth (path): path to the sqlite database, created if it does not exist
+            cell_size (float): side of the grid cells (meter)
+        """
+        self.db_pth = str(db_pth)
+        self.cell_size = float(cell_size)
+        self.__connections = threading.local()
+        self.__release_ids = {}
+        self.__lock = threading.Lock()
+        connection = self.connection()
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            if connection.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+                connection.execute("DROP TABLE IF EXISTS cell")
+                connection.execute("DROP TABLE IF EXISTS release")
+                connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            connection.execute("CREATE TABLE IF NOT EXISTS release (release_id INTEGER PRIMARY KEY, "
+                               "gdb_pth TEXT NOT NULL, modification_time REAL, spatial_ver INTEGER, "
+                               "cell_size REAL NOT NULL, UNIQUE (gdb_pth, modification_time, spatial_ver, cell_size))")
+            connection.execute("CREATE TABLE IF NOT EXISTS cell (release_id INTEGER NOT NULL, "
+                               "cell_key INTEGER NOT NULL, county_id TEXT, mu_sym TEXT, mu_key INTEGER, spatial_ver, "
+                               "area_symbol TEXT, PRIMARY KEY (release_id, cell_key)) WITHOUT ROWID")
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+    @classmethod
+    def open(cls, db_pth=None):
+        """
+            Return the cache of the database, opened once by process
+        Args:
+            db_pth (path/None): path to the sqlite database, SSURGO_CELL_CACHE if None
+
+        Returns:
+            (CellCache/None): the cache, None if no database is set (the cache is disabled)
+        """
+        db_pth = os.environ.get('SSURGO_CELL_CACHE') if db_pth is None else db_pth
+        if not db_pth:
+            return None
+        with _CELL_CACHE_LOCK:
+            cell_cache = _CELL_CACHE.get(str(db_pth))
+            if cell_cache is None:
+                cell_cache = cls(db_pth)
+                _CELL_CACHE[str(db_pth)] = cell_cache
+        return cell_cache
+
+    def connection(self):
+        """
+            Connection of the current thread, a forked process opens its own connections
+        """
+        if getattr(self.__connections, 'pid', None) != os.getpid():
+            self.__connections.connection = sqlite3.connect(self.db_pth, timeout=BUSY_TIMEOUT, isolation_level=None)
+            self.__connections.connection.execute("PRAGMA synchronous=NORMAL")
+            self.__connections.pid = os.getpid()
+        return self.__connections.connection
+
+    def cell_keys(self, x, y):
+        """
+        Args:
+            x (ndarray): x coordinate of each location (USA_Contiguous_Albers)
+            y (ndarray): y coordinate of each location (USA_Contiguous_Albers)
+
+        Returns:
+            (ndarray): key of the grid cell of each location
+        """
+        column = np.floor(np.asarray(x, dtype=np.float64) / self.cell_size).astype(np.int64)
+        row = np.floor(np.asarray(y, dtype=np.float64) / self.cell_size).astype(np.int64)
+        return (column + CELL_OFFSET) * CELL_SHIFT + (row + CELL_OFFSET)
+
+    def release_id(self, gdb_release):
+        """
+            Namespace of a gdb release, created on first use. The cells of the strictly older releases of the gdb
+            (an older modification time or SPATIALVER, neither newer) are deleted: a process still reading the
+            previous gdb during a rolling update never deletes the cells of the new one
+        Args:
+            gdb_release (tuple): (gdb path, modification time, SPATIALVER), see gdb_release
+
+        Returns:
+            (int): id of the release in the database
+        """
+        gdb_pth = str(gdb_release[0])
+        release = (gdb_pth, gdb_release[1], gdb_release[2], self.cell_size)
+        with self.__lock:
+            release_id = self.__release_ids.get(release)
+        if release_id is not None:
+            return release_id
+
+        # NULL is not equal to itself in a UNIQUE constraint nor in a WHERE clause
+        where_release = "gdb_pth = ? AND modification_time IS ? AND spatial_ver IS ? AND cell_size = ?"
+        connection = self.connection()
+        row = connection.execute(f"SELECT release_id FROM release WHERE {where_release}", release).fetchone()
+        if row is None:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = connection.execute(f"SELECT release_id FROM release WHERE {where_release}", release).fetchone()
+                if row is None:
+                    row = (connection.execute("INSERT INTO release (gdb_pth, modification_time, spatial_ver, "
+                                              "cell_size) VALUES (?, ?, ?, ?)", release).lastrowid,)
+                    # comparisons with an unknown modification time or SPATIALVER are NULL: nothing is deleted
+                    older = ("gdb_pth = ? AND modification_time <= ? AND spatial_ver <= ? "
+                             "AND (modification_time < ? OR spatial_ver < ?)")
+                    older_args = (gdb_pth, gdb_release[1], gdb_release[2], gdb_release[1], gdb_release[2])
+                    connection.execute(f"DELETE FROM cell WHERE release_id IN (SELECT release_id FROM release "
+                                       f"WHERE {older})", older_args)
+                    connection.execute(f"DELETE FROM release WHERE {older}", older_args)
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+        with self.__lock:
+            self.__release_ids[release] = row[0]
+        return row[0]
+
+    def lookup(self, gdb_release, point_batch):
+        """
+            Bulk lookup of the cells of a batch, the columns of the locations found are filled in place
+        Args:
+            gdb_release (tuple): (gdb path, modification time, SPATIALVER), see gdb_release
+            point_batch (PointBatch): locations with x and y (USA_Contiguous_Albers)
+
+        Returns:
+            (ndarray): positions of the locations whose cell is not in the cache
+        """
+        release_id = self.release_id(gdb_release)
+        cell_keys = self.cell_keys(point_batch.x, point_batch.y)
+        unique_keys = np.unique(cell_keys)
+        rows = []
+        connection = self.connection()
+        for start in range(0, len(unique_keys), QUERY_CHUNK_SIZE):
+            keys = unique_keys[start:start + QUERY_CHUNK_SIZE].tolist()
+            rows += connection.execute(f"SELECT cell_key, {', '.join(CELL_COLUMNS)} FROM cell WHERE release_id = ? "
+                                       f"AND cell_key IN ({', '.join('?' * len(keys))})", [release_id] + keys)
+        columns = list(zip(*rows)) if len(rows) > 0 else [()] * (len(CELL_COLUMNS) + 1)
+        found_keys = np.array(columns[0], dtype=np.int64)
+        order = np.argsort(found_keys)
+        found_keys = found_keys[order]
+        found = np.isin(cell_keys, found_keys)
+        positions = np.flatnonzero(found)
+        cell_position = np.searchsorted(found_keys, cell_keys[positions])
+        for column, values in zip(CELL_COLUMNS, columns[1:]):
+            values = np.array(values, dtype=object)[order]
+            if column == 'mu_key':
+                values = np.array([np.nan if value is None else value for value in values], dtype=np.float64)
+            getattr(point_batch, column)[positions] = values[cell_position]
+        missing = np.flatnonzero(~found)
+        count('cell_cache_hits', len(point_batch) - len(missing))
+        count('cell_cache_misses', len(missing))
+        return missing
+
+    def store(self, gdb_release, point_batch):
+        """
+            Add the cells of a batch, the first location of a cell gives its value
+        Args:
+            gdb_release (tuple): (gdb path, modification time, SPATIALVER), see gdb_release
+            point_batch (PointBatch): locations with the columns of the vector lookup filled, see find_soil_id_ref
+        """
+        release_id = self.release_id(gdb_release)
+        cell_keys = self.cell_keys(point_batch.x, point_batch.y)
+        mu_keys = [None if np.isnan(mu_key) else int(mu_key) for mu_key in point_batch.mu_key]
+        rows = zip([release_id] * len(cell_keys), cell_keys.tolist(), point_batch.county_id, point_batch.mu_sym,
+                   mu_keys, point_batch.spatial_ver, point_batch.area_symbol)
+        connection = self.connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.executemany(f"INSERT OR IGNORE INTO cell (release_id, cell_key, {', '.join(CELL_COLUMNS)}) "
+                                   f"VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+    def clear(self):
+        """
+            Delete every cell and release
+        """
+        connection = self.connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.execute("DELETE FROM cell")
+            connection.execute("DELETE FROM release")
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        with self.__lock:
+            self.__release_ids.clear()
+
+
+def configure_cell_cache(db_pth):
+    """
+    Enable (or disable) the cell cache of this process and of the worker processes it starts
+    Args:
+        db_pth (path/None): path to the sqlite database, None to disable the cache
+    """
+    if db_pth is None:
+        os.environ.pop('SSURGO_CELL_CACHE', None)
+    else:
+        os.environ['SSURGO_CELL_CACHE'] = str(db_pth)
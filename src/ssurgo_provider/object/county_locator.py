@@ -0,0 +1,80 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from ssurgo_provider.instrumentation import count
+from ssurgo_provider.object.gbd_connect import gdb_modification_time
+from ssurgo_provider.object.polygon_index import PolygonIndex, ogr_geometry_to_shapely
+
+# number of state gdb SAPOLYGON index kept in memory
+COUNTY_LOCATOR_CACHE_SIZE = 8
+
+_COUNTY_LOCATOR_CACHE = OrderedDict()
+_COUNTY_LOCATOR_LOCK = threading.Lock()
+
+
+class CountyLocator:
+    def __init__(self, area_symbols, geometries):
+        """
+            Locate the survey area (county) of many points at once
+        Args:
+            area_symbols (list(str)): AREASYMBOL of each geometry
+            geometries (list(Polygon)): shapely survey area geometries (USA_Contiguous_Albers)
+        """
+        self.area_symbols = np.array(area_symbols, dtype=object)
+        self.polygon_index = PolygonIndex(geometries)
+
+    @classmethod
+    def from_gdb(cls, gdb):
+        """
+            Read SAPOLYGON once and index it, the locator is cached by gdb path and modification time
+        Args:
+            gdb (DataSource): ssurgo state datasource
+
+        Returns:
+            (CountyLocator): locator over all survey areas of the gdb
+        """
+        gdb_pth = gdb.GetName()
+        cache_key = (gdb_pth, gdb_modification_time(gdb_pth))
+        with _COUNTY_LOCATOR_LOCK:
+            county_locator = _COUNTY_LOCATOR_CACHE.get(cache_key)
+            if county_locator is not None:
+                _COUNTY_LOCATOR_CACHE.move_to_end(cache_key)
+                return county_locator
+
+        layer_sa_polygon = gdb.GetLayer("SAPOLYGON")
+        layer_sa_polygon.SetAttributeFilter(None)
+        layer_sa_polygon.ResetReading()
+        area_symbols = []
+        geometries = []
+        for feature in layer_sa_polygon:
+            count('features_scanned')
+            geometry = feature.GetGeometryRef()
+            if geometry is None:
+                continue
+            area_symbols.append(feature.GetField("AREASYMBOL"))
+            geometries.append(ogr_geometry_to_shapely(geometry))
+        county_locator = cls(area_symbols, geometries)
+
+        with _COUNTY_LOCATOR_LOCK:
+            _COUNTY_LOCATOR_CACHE[cache_key] = county_locator
+            while len(_COUNTY_LOCATOR_CACHE) > COUNTY_LOCATOR_CACHE_SIZE:
+                _COUNTY_LOCATOR_CACHE.popitem(last=False)
+        return county_locator
+
+    def locate(self, x, y):
+        """
+            Find the survey area of each point in one bulk query
+        Args:
+            x (ndarray): x coordinate of each point (USA_Contiguous_Albers)
+            y (ndarray): y coordinate of each point (USA_Contiguous_Albers)
+
+        Returns:
+            (ndarray): AREASYMBOL of each point, None when the point is in no survey area
+        """
+        polygon_id = self.polygon_index.locate_xy(x, y)
+        area_symbols = np.full(len(polygon_id), None, dtype=object)
+        found = polygon_id >= 0
+        area_symbols[found] = self.area_symbols[polygon_id[found]]
+        return area_symbols
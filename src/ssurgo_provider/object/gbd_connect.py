@@ -1,5 +1,18 @@
+import os
+import threading
+import time
+from pathlib import Path
+
 from osgeo import ogr
 
+# files of the gdb tables, the other files (*.lock, ...) do not date a release
+GDB_TABLE_SUFFIXES = ('.gdbtable', '.gdbtablx')
+# seconds a gdb modification time is reused before its table files are scanned again (a gdb updated in place)
+GDB_MTIME_CHECK_INTERVAL = 60.
+# modification time of a gdb by path, with the time of the scan
+_GDB_MTIME_CACHE = {}
+_GDB_MTIME_LOCK = threading.Lock()
+
 
 class GbdConnect:
     def __init__(self, ssurgo_folder_path):
@@ -12,6 +25,13 @@ class GbdConnect:
             This function is usefull to open the ssurgo geo data base containing all soil information
         """
 
+        # other ogr sources with the same layers (GeoPackage stand-in, ...) are opened with their own driver
+        if Path(ssurgo_folder_path).suffix.lower() != '.gdb':
+            gdb = ogr.Open(str(ssurgo_folder_path), 0)
+            if gdb is None:
+                raise ValueError(f"Unable to open ssurgo data source at {str(ssurgo_folder_path)} ")
+            return gdb
+
         # get the driver
         driver = ogr.GetDriverByName("OpenFileGDB")
         if driver is None:
@@ -26,8 +46,58 @@ class GbdConnect:
             raise ValueError(f"Unable to open ssurgo gdb file at {str(ssurgo_folder_path)} ")
         return gdb
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close_connection()
+
     def close_connection(self):
         """
-            Usefully method to close connection to the geoDatabase
+            Usefully method to close connection to the geoDatabase (ogr datasources are closed when released)
         """
-        self.gdb.close()
+        self.gdb = None
+
+
+def gdb_modification_time(ssurgo_folder_path, refresh=False):
+    """
+    Latest modification time of the table files of a gdb (*.gdbtable, *.gdbtablx: a table rewritten in place does
+    not change the modification time of the folder, the lock files change on every read), None if the gdb does not
+    exist or has no table. The table files are scanned again every GDB_MTIME_CHECK_INTERVAL seconds or with refresh
+    Args:
+        ssurgo_folder_path (path): path to the ssurgo database at the state level
+        refresh (bool): if True scan the table files even if the modification time was read recently
+
+    Returns:
+        (float/None): modification time
+    """
+    with _GDB_MTIME_LOCK:
+        cached = _GDB_MTIME_CACHE.get(str(ssurgo_folder_path))
+    if not refresh and cached is not None and time.monotonic() - cached[0] < GDB_MTIME_CHECK_INTERVAL:
+        return cached[1]
+    read_time = time.monotonic()
+    modification_time = scan_modification_time(ssurgo_folder_path)
+    with _GDB_MTIME_LOCK:
+        _GDB_MTIME_CACHE[str(ssurgo_folder_path)] = (read_time, modification_time)
+    return modification_time
+
+
+def scan_modification_time(ssurgo_folder_path):
+    """
+    Latest modification time of the table files of a gdb, read from the file system, see gdb_modification_time
+    """
+    if not os.path.exists(ssurgo_folder_path):
+        return None
+    if not os.path.isdir(ssurgo_folder_path):
+        return os.path.getmtime(ssurgo_folder_path)
+    modification_times = []
+    with os.scandir(ssurgo_folder_path) as entries:
+        for entry in entries:
+            if os.path.splitext(entry.name)[1].lower() not in GDB_TABLE_SUFFIXES:
+                continue
+            try:
+                modification_times.append(entry.stat().st_mtime)
+            except FileNotFoundError:
+                # table replaced while scanning, its new file is dated by the next scan
+                continue
+    return max(modification_times, default=None)
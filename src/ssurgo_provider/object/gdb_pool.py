@@ -0,0 +1,157 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from ssurgo_provider.instrumentation import count
+from ssurgo_provider.object.gbd_connect import GbdConnect
+
+DEFAULT_MAX_OPEN = 16
+DEFAULT_IDLE_TIMEOUT = 600
+
+
+class GdbPool:
+    def __init__(self, max_open=DEFAULT_MAX_OPEN, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+        """
+            Pool of opened gdb handles keyed by gdb path
+            A handle is checked out by one thread at a time (ogr datasources must not be shared concurrently) and
+            goes back to the pool when released, idle handles are closed after idle_timeout seconds (by a timer, also
+            when the pool is no longer used)
+        Args:
+            max_open (int): maximum number of opened handles (checked out and idle)
+            idle_timeout (float): seconds after which an idle handle is closed
+        """
+        self.max_open = max_open
+        self.idle_timeout = idle_timeout
+        self.opened = 0
+        self.reused = 0
+        self.__idle = {}
+        self.__open_nb = 0
+        self.__pid = os.getpid()
+        self.__condition = threading.Condition()
+        self.__timer = None
+
+    @contextmanager
+    def connection(self, ssurgo_folder_path):
+        """
+            Context manager giving a GbdConnect for the gdb, released to the pool at exit
+        Args:
+            ssurgo_folder_path (path): path to the ssurgo database at the state level
+        """
+        gdb_connection = self.checkout(ssurgo_folder_path)
+        try:
+            yield gdb_connection
+        finally:
+            self.checkin(gdb_connection)
+
+    def checkout(self, ssurgo_folder_path):
+        """
+            Take a handle of the gdb from the pool, open it if no idle handle is available
+            Wait for a handle to be released when max_open handles are already checked out
+        Args:
+            ssurgo_folder_path (path): path to the ssurgo database at the state level
+
+        Returns:
+            (GbdConnect): handle owned by the caller until checkin
+        """
+        key = str(ssurgo_folder_path)
+        with self.__condition:
+            self.__reset_after_fork()
+            self.__close_expired()
+            while True:
+                idle_connections = self.__idle.get(key)
+                if idle_connections:
+                    self.reused += 1
+                    count('gdb_reused')
+                    return idle_connections.pop()[0]
+                if self.__open_nb < self.max_open:
+                    self.__open_nb += 1
+                    break
+                if not self.__close_least_recently_used():
+                    self.__condition.wait()
+        try:
+            gdb_connection = GbdConnect(ssurgo_folder_path)
+        except Exception:
+            with self.__condition:
+                self.__open_nb -= 1
+                self.__condition.notify()
+            raise
+        self.opened += 1
+        count('gdb_opened')
+        return gdb_connection
+
+    def checkin(self, gdb_connection):
+        """
+            Give back a handle taken with checkout
+        """
+        with self.__condition:
+            if gdb_connection.gdb is None:
+                self.__open_nb -= 1
+            else:
+                self.__idle.setdefault(str(gdb_connection.ssurgo_folder_path), []).append(
+                    (gdb_connection, time.monotonic()))
+            self.__close_expired()
+            self.__schedule_expiry()
+            self.__condition.notify()
+
+    def close_idle(self):
+        """
+            Close every idle handle
+        """
+        with self.__condition:
+            for idle_connections in self.__idle.values():
+                for gdb_connection, _ in idle_connections:
+                    gdb_connection.close_connection()
+                    self.__open_nb -= 1
+            self.__idle.clear()
+            self.__condition.notify_all()
+
+    def __close_expired(self):
+        limit = time.monotonic() - self.idle_timeout
+        for key, idle_connections in self.__idle.items():
+            expired = [gdb_connection for gdb_connection, last_use in idle_connections if last_use < limit]
+            for gdb_connection in expired:
+                gdb_connection.close_connection()
+                self.__open_nb -= 1
+            self.__idle[key] = [(gdb_connection, last_use) for gdb_connection, last_use in idle_connections
+                                if last_use >= limit]
+
+    def __schedule_expiry(self):
+        # one timer at a time, due when the oldest idle handle expires
+        last_uses = [last_use for idle_connections in self.__idle.values() for _, last_use in idle_connections]
+        if self.__timer is not None or len(last_uses) == 0:
+            return
+        self.__timer = threading.Timer(max(0., min(last_uses) + self.idle_timeout - time.monotonic()),
+                                       self.__expire)
+        self.__timer.daemon = True
+        self.__timer.start()
+
+    def __expire(self):
+        with self.__condition:
+            self.__timer = None
+            if self.__pid != os.getpid():
+                return
+            self.__close_expired()
+            self.__schedule_expiry()
+            self.__condition.notify_all()
+
+    def __close_least_recently_used(self):
+        candidates = [(idle_connections[0][1], key) for key, idle_connections in self.__idle.items()
+                      if idle_connections]
+        if len(candidates) == 0:
+            return False
+        _, key = min(candidates)
+        self.__idle[key].pop(0)[0].close_connection()
+        self.__open_nb -= 1
+        return True
+
+    def __reset_after_fork(self):
+        # handles opened by the parent process are not reused in a forked child
+        if self.__pid != os.getpid():
+            self.__pid = os.getpid()
+            self.__idle = {}
+            self.__open_nb = 0
+            self.__timer = None
+
+
+gdb_pool = GdbPool()
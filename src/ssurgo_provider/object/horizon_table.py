@@ -0,0 +1,235 @@
+import numpy as np
+
+from ssurgo_provider.object.soil_pack import SoilPack, field_kind
+from ssurgo_provider.object.ssurgo_soil_dto import HORIZON_FIELDS, SoilHorizon
+
+
+class HorizonTable:
+    def __init__(self, columns, kinds, index_keys, offsets, soil_pack_pth=None):
+        """
+            All horizons of a set of components, stored by column. The horizons of a component (co_key) are the
+            contiguous rows offsets[i]:offsets[i + 1] of index_keys[i], sorted by hzdept_r
+        Args:
+            columns (dict): ndarray by chorizon field, float64 (nan for null) for numeric fields, str or object
+                            ('' or None for null) otherwise
+            kinds (dict): 'int', 'float' or 'str' by chorizon field
+            index_keys (ndarray): sorted co_key (int64)
+            offsets (ndarray): first row of each co_key, plus the number of rows
+            soil_pack_pth (path/None): path of the soil pack when the columns are the memory mapped pack columns
+        """
+        self.columns = columns
+        self.kinds = kinds
+        self.index_keys = index_keys
+        self.offsets = offsets
+        self.soil_pack_pth = soil_pack_pth
+
+    def __len__(self):
+        return int(self.offsets[-1]) if len(self.offsets) > 0 else 0
+
+    def __reduce__(self):
+        # a table over a soil pack is sent as the pack path, not as the whole memory mapped columns
+        if self.soil_pack_pth is not None:
+            return HorizonTable.load_soil_pack, (self.soil_pack_pth,)
+        return HorizonTable, (self.columns, self.kinds, self.index_keys, self.offsets)
+
+    @classmethod
+    def from_features(cls, horizons):
+        """
+            Build the table from gdb features
+        Args:
+            horizons (iterable): (co_key, chorizon feature) for each horizon
+
+        Returns:
+            (HorizonTable): table with every horizon of every component
+        """
+        co_keys = []
+        kinds = None
+        values = {field: [] for _, field in HORIZON_FIELDS}
+        for co_key, feature in horizons:
+            if kinds is None:
+                kinds = {field: field_kind(feature.GetFieldDefnRef(field).GetType()) for field in values}
+            co_keys.append(co_key)
+            for _, field in HORIZON_FIELDS:
+                values[field].append(feature.GetField(field))
+        if kinds is None:
+            kinds = {field: 'float' for field in values}
+
+        columns = {}
+        for field, field_values in values.items():
+            if kinds[field] == 'str':
+                columns[field] = np.array(field_values, dtype=object)
+            else:
+                columns[field] = np.array([np.nan if value is None else value for value in field_values],
+                                          dtype=np.float64)
+        return cls.from_columns(np.array(co_keys, dtype=np.int64), columns, kinds)
+
+    @classmethod
+    def from_columns(cls, co_keys, columns, kinds):
+        """
+            Build the table from unsorted columns
+        Args:
+            co_keys (ndarray): co_key of each horizon
+            columns (dict): ndarray by chorizon field
+            kinds (dict): 'int', 'float' or 'str' by chorizon field
+
+        Returns:
+            (HorizonTable): table sorted by co_key and hzdept_r
+        """
+        order = np.lexsort((columns['hzdept_r'], co_keys)) if len(co_keys) > 0 else np.zeros(0, dtype=np.int64)
+        co_keys = co_keys[order]
+        index_keys, starts = np.unique(co_keys, return_index=True)
+        return cls({field: column[order] for field, column in columns.items()}, kinds, index_keys,
+                   np.append(starts, len(co_keys)).astype(np.int64))
+
+    @classmethod
+    def from_soil_pack(cls, soil_pack):
+        """
+            Table over the memory mapped chorizon columns of a soil pack, nothing is copied
+        Args:
+            soil_pack (SoilPack): columnar pack of the gdb
+
+        Returns:
+            (HorizonTable): table with every horizon of the gdb
+        """
+        kinds = soil_pack.meta['tables']['chorizon']['fields']
+        return cls({field: soil_pack.column('chorizon', field) for field in kinds}, kinds,
+                   soil_pack.column('chorizon', '_index_keys'), soil_pack.column('chorizon', '_index_offsets'),
+                   soil_pack.pack_pth)
+
+    @classmethod
+    def concat(cls, horizon_tables):
+        """
+            Merge tables holding different components
+        Args:
+            horizon_tables (list(HorizonTable)): tables to merge
+
+        Returns:
+            (HorizonTable): table with every horizon of all tables
+        """
+        horizon_tables = [horizon_table for horizon_table in horizon_tables if len(horizon_table) > 0]
+        if len(horizon_tables) == 0:
+            return cls.from_columns(np.zeros(0, dtype=np.int64), {field: np.zeros(0) for _, field in HORIZON_FIELDS},
+                                    {field: 'float' for _, field in HORIZON_FIELDS})
+        if len(horizon_tables) == 1:
+            return horizon_tables[0]
+        kinds = horizon_tables[0].kinds
+        co_keys = np.concatenate([horizon_table.row_keys() for horizon_table in horizon_tables])
+        columns = {field: np.concatenate([np.asarray(horizon_table.columns[field]) for horizon_table in horizon_tables])
+                   for field in kinds}
+        return cls.from_columns(co_keys, columns, kinds)
+
+    @classmethod
+    def load_soil_pack(cls, soil_pack_pth):
+        return cls.from_soil_pack(SoilPack(soil_pack_pth))
+
+    def rows(self, co_key):
+        """
+            Rows of the horizons of a component
+        Args:
+            co_key (int): component key
+
+        Returns:
+            (int, int): first and last + 1 row, (0, 0) if the component has no horizon
+        """
+        idx = int(np.searchsorted(self.index_keys, co_key))
+        if idx >= len(self.index_keys) or self.index_keys[idx] != co_key:
+            return 0, 0
+        return int(self.offsets[idx]), int(self.offsets[idx + 1])
+
+    def row_keys(self):
+        """
+            co_key of each row
+        """
+        return np.repeat(np.asarray(self.index_keys), np.diff(self.offsets))
+
+    def split(self):
+        """
+            Split the table by component
+        Returns:
+            (dict): one HorizonTable by co_key (columns are copied, so they do not keep the whole table alive)
+        """
+        return {int(co_key): HorizonTable({field: np.array(column[start:stop])
+                                           for field, column in self.columns.items()},
+                                          self.kinds, np.array([co_key], dtype=np.int64),
+                                          np.array([0, stop - start], dtype=np.int64))
+                for co_key, start, stop in zip(self.index_keys, self.offsets[:-1], self.offsets[1:])}
+
+    def nbytes(self):
+        """
+            Estimated size of the table in bytes
+        """
+        size = 0
+        for field, column in self.columns.items():
+            size += column.nbytes if self.kinds[field] != 'str' else 64 * len(column)
+        return size + self.index_keys.nbytes + self.offsets.nbytes
+
+    def value(self, field, row):
+        """
+            Value of one field of one horizon, null values are None
+        """
+        value = self.columns[field][row]
+        kind = self.kinds[field]
+        if kind == 'str':
+            return None if value is None or value == '' else str(value)
+        if np.isnan(value):
+            return None
+        return int(value) if kind == 'int' else float(value)
+
+    def profile(self, co_key, comppct_r):
+        """
+            Horizons of a component from the surface to the bottom
+        Args:
+            co_key (int): component key
+            comppct_r (float): percentage of the component for the location
+
+        Returns:
+            (tuple(SoilHorizon)): immutable view on each horizon of the component
+        """
+        start, stop = self.rows(co_key)
+        return tuple(SoilHorizon(self, row, comppct_r) for row in range(start, stop))
+
+    def depth_weighted(self, co_keys, fields, depths):
+        """
+            Thickness weighted mean of numeric fields over depth intervals for a set of components, computed on the
+            horizons of all components at once. Each horizon is weighted by its thickness inside the interval, null
+            values and horizons outside the interval are ignored
+        Args:
+            co_keys (ndarray): component keys
+            fields (list(str)): numeric chorizon fields
+            depths (ndarray): (top, bottom) of each depth interval (cm)
+
+        Returns:
+            (ndarray): value of each component, field and depth interval (nan when no horizon has a value)
+        """
+        co_keys = np.asarray(co_keys, dtype=np.int64)
+        depths = np.asarray(depths, dtype=np.float64).reshape(-1, 2)
+        for field in fields:
+            if self.kinds.get(field, 'str') == 'str':
+                raise ValueError(f"{field} is not a numeric chorizon field")
+
+        # rows of the horizons of each component, component_idx is the position in co_keys of each row
+        idx = np.minimum(np.searchsorted(self.index_keys, co_keys), max(len(self.index_keys) - 1, 0))
+        found = (np.asarray(self.index_keys)[idx] == co_keys) if len(self.index_keys) > 0 else \
+            np.zeros(len(co_keys), dtype=bool)
+        starts = np.where(found, np.asarray(self.offsets)[idx], 0)
+        lengths = np.where(found, np.asarray(self.offsets)[np.minimum(idx + 1, len(self.offsets) - 1)] - starts, 0)
+        component_idx = np.repeat(np.arange(len(co_keys)), lengths)
+        rows = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+
+        top = np.asarray(self.columns['hzdept_r'][rows], dtype=np.float64)
+        bottom = np.asarray(self.columns['hzdepb_r'][rows], dtype=np.float64)
+        # thickness of each horizon inside each depth interval, (row, depth)
+        overlap = np.minimum(bottom[:, None], depths[:, 1]) - np.maximum(top[:, None], depths[:, 0])
+        overlap = np.where(np.isnan(overlap), 0., np.maximum(overlap, 0.))
+
+        values = np.full((len(co_keys), len(fields), len(depths)), np.nan)
+        for field_idx, field in enumerate(fields):
+            field_values = np.asarray(self.columns[field][rows], dtype=np.float64)
+            weights = np.where(np.isnan(field_values)[:, None], 0., overlap)
+            weighted_values = weights * np.nan_to_num(field_values)[:, None]
+            for depth_idx in range(len(depths)):
+                thickness = np.bincount(component_idx, weights[:, depth_idx], minlength=len(co_keys))
+                total = np.bincount(component_idx, weighted_values[:, depth_idx], minlength=len(co_keys))
+                values[:, field_idx, depth_idx] = np.divide(total, thickness, out=np.full(len(co_keys), np.nan),
+                                                            where=thickness > 0)
+        return values
@@ -1,16 +1,173 @@
+import json
+import os
+import threading
 from pathlib import Path
 
 import geopandas
+import numpy as np
+import shapely
+
+from ssurgo_provider.instrumentation import stage
+from ssurgo_provider.object.polygon_index import save_geometries, load_geometries
+from ssurgo_provider.object.state_locator import StateLocator, dissolve_states
+
+SHAPEFILE_RELATIVE_PATH = Path('gadm36_USA_shp') / 'gadm36_USA_1.shp'
+ARTIFACT_FOLDER_NAME = 'gadm36_USA_1_states'
+# simplification tolerance in degree (~10 m), far below the precision needed to route a point to a state
+SIMPLIFY_TOLERANCE = 0.0001
+
+# process wide cache of the loaded state map, keyed by map folder
+_STATE_MAP_CACHE = {}
+_STATE_MAP_LOCK = threading.Lock()
 
 
 class OpenMap:
     def __init__(self, is_permanent=False):
-        self.states_gdf = self.__open()
+        self.map_folder_pth = find_map_folder_path()
+        self.__state_map = self.__open(self.map_folder_pth)
         self.is_permanent = is_permanent
 
+    @property
+    def state_names(self):
+        return self.__state_map['names']
+
+    @property
+    def state_geometries(self):
+        return self.__state_map['geometries']
+
+    @property
+    def states_gdf(self):
+        """
+            GeoDataFrame with one row by state (NAME_1, geometry), built on first use
+        """
+        with _STATE_MAP_LOCK:
+            if self.__state_map['gdf'] is None:
+                self.__state_map['gdf'] = geopandas.GeoDataFrame({'NAME_1': self.state_names},
+                                                                 geometry=list(self.state_geometries),
+                                                                 crs="EPSG:4326")
+        return self.__state_map['gdf']
+
+    @property
+    def state_locator(self):
+        """
+            StateLocator built on first use and shared by the whole process
+        """
+        with _STATE_MAP_LOCK:
+            if self.__state_map['locator'] is None:
+                self.__state_map['locator'] = StateLocator(self.state_names, self.state_geometries)
+        return self.__state_map['locator']
+
+    @classmethod
+    def __open(cls, map_folder_pth):
+        with _STATE_MAP_LOCK:
+            state_map = _STATE_MAP_CACHE.get(map_folder_pth)
+            if state_map is None:
+                artifact_pth = map_folder_pth / ARTIFACT_FOLDER_NAME
+                with stage('state_map_load'):
+                    if is_state_map_up_to_date(artifact_pth, map_folder_pth / SHAPEFILE_RELATIVE_PATH):
+                        state_names, state_geometries = load_state_map(artifact_pth)
+                    else:
+                        state_names, state_geometries = cls.__read_shapefile(map_folder_pth / SHAPEFILE_RELATIVE_PATH)
+                state_map = {'names': state_names, 'geometries': state_geometries, 'gdf': None, 'locator': None}
+                _STATE_MAP_CACHE[map_folder_pth] = state_map
+        return state_map
+
     @classmethod
-    def __open(cls):
-        map_path = Path().absolute().parent / 'resources' / 'MAP' / 'gadm36_USA_shp' / 'gadm36_USA_1.shp'
+    def __read_shapefile(cls, map_path):
         if not map_path.exists():
             raise FileNotFoundError(f"no gadm36_USA_1.shp find in {str(map_path.parent)}")
-        return geopandas.read_file(map_path)
+        states_gdf = geopandas.read_file(map_path)
+        if states_gdf.crs is not None:
+            states_gdf = states_gdf.to_crs("EPSG:4326")
+        state_names, state_geometries = dissolve_states(states_gdf)
+        return np.array(state_names), np.array(state_geometries, dtype=object)
+
+
+def find_map_folder_path():
+    """
+    Find the folder with the US state map (resources/MAP)
+    The SSURGO_MAP_DATA environment variable has priority, then the resources folder of the repository and finally
+    the resources folder next to the current working directory
+    Returns:
+        (path): path to the map folder
+    """
+    if 'SSURGO_MAP_DATA' in os.environ:
+        return Path(os.environ['SSURGO_MAP_DATA'])
+    candidates = [Path(__file__).resolve().parents[3] / 'resources' / 'MAP',
+                  Path().absolute().parent / 'resources' / 'MAP',
+                  Path().absolute() / 'resources' / 'MAP']
+    for candidate in candidates:
+        if (candidate / ARTIFACT_FOLDER_NAME).exists() or (candidate / SHAPEFILE_RELATIVE_PATH).exists():
+            return candidate
+    return candidates[0]
+
+
+def build_state_map(map_folder_pth=None, tolerance=SIMPLIFY_TOLERANCE):
+    """
+    One time conversion of the GADM shapefile to the fast loading state map artifact
+    The artifact hold one simplified geometry by state in espg 4326 (long, lat) as WKB, every array is a .npy file
+    which can be memory mapped. It is ignored once the shapefile is modified, until it is built again
+    Args:
+        map_folder_pth (path/None): folder with gadm36_USA_shp, see find_map_folder_path if None
+        tolerance (float): simplification tolerance in degree
+
+    Returns:
+        (path): path to the artifact folder
+    """
+    map_folder_pth = find_map_folder_path() if map_folder_pth is None else Path(map_folder_pth)
+    shapefile_pth = map_folder_pth / SHAPEFILE_RELATIVE_PATH
+    if not shapefile_pth.exists():
+        raise FileNotFoundError(f"no gadm36_USA_1.shp find in {str(shapefile_pth.parent)}")
+    states_gdf = geopandas.read_file(shapefile_pth)
+    if states_gdf.crs is not None:
+        states_gdf = states_gdf.to_crs("EPSG:4326")
+    state_names, state_geometries = dissolve_states(states_gdf)
+    state_geometries = shapely.simplify(np.array(state_geometries, dtype=object), tolerance, preserve_topology=True)
+
+    artifact_pth = map_folder_pth / ARTIFACT_FOLDER_NAME
+    artifact_pth.mkdir(parents=True, exist_ok=True)
+    np.save(artifact_pth / 'names.npy', np.array(state_names))
+    save_geometries(artifact_pth, state_geometries)
+    with open(artifact_pth / 'meta.json', 'w') as meta_file:
+        json.dump({'source': str(shapefile_pth), 'source_mtime': shapefile_modification_time(shapefile_pth),
+                   'crs': "EPSG:4326", 'tolerance': tolerance, 'state_nb': len(state_names)}, meta_file)
+
+    with _STATE_MAP_LOCK:
+        _STATE_MAP_CACHE.pop(map_folder_pth, None)
+    return artifact_pth
+
+
+def load_state_map(artifact_pth):
+    """
+    Load the state map artifact build by build_state_map
+    Args:
+        artifact_pth (path): path to the artifact folder
+
+    Returns:
+        (ndarray, ndarray): state names and state geometries
+    """
+    return np.load(artifact_pth / 'names.npy'), load_geometries(artifact_pth)
+
+
+def shapefile_modification_time(shapefile_pth):
+    """
+    Latest modification time of the files of a shapefile (.shp, .dbf, .shx, ...), None if it does not exist
+    """
+    shapefile_pth = Path(shapefile_pth)
+    if not shapefile_pth.exists():
+        return None
+    return max(os.path.getmtime(file_pth) for file_pth in shapefile_pth.parent.glob(f'{shapefile_pth.stem}.*'))
+
+
+def is_state_map_up_to_date(artifact_pth, shapefile_pth):
+    """
+    Returns:
+        (bool): True if the artifact is built from the current shapefile (or if only the artifact is available)
+    """
+    if not (artifact_pth / 'meta.json').exists():
+        return False
+    source_mtime = shapefile_modification_time(shapefile_pth)
+    if source_mtime is None:
+        return True
+    with open(artifact_pth / 'meta.json') as meta_file:
+        return json.load(meta_file).get('source_mtime') == source_mtime
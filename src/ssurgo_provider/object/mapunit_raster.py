@@ -0,0 +1,176 @@
+import os
+import threading
+from pathlib import Path
+
+import numpy as np
+from osgeo import gdal, ogr
+
+MAPUNIT_RASTER_NAME = 'MapunitRaster_10m'
+# size of the square block (pixel) read at once, points are grouped by block
+READ_BLOCK_SIZE = 1024
+
+_MAPUNIT_RASTER_CACHE = threading.local()
+
+
+def _reset_after_fork():
+    # datasets opened by the parent process are not reused in a forked child
+    global _MAPUNIT_RASTER_CACHE
+    _MAPUNIT_RASTER_CACHE = threading.local()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def find_sibling_raster_path(ssurgo_folder_path, raster_name=MAPUNIT_RASTER_NAME):
+    """
+    Path of the map unit raster of a data source which is not a gdb: XX_MapunitRaster_10m.tif next to XX.gpkg
+    """
+    ssurgo_folder_path = Path(ssurgo_folder_path)
+    return ssurgo_folder_path.parent / f'{ssurgo_folder_path.stem}_{raster_name}.tif'
+
+
+class MapunitRaster:
+    def __init__(self, ssurgo_folder_path, raster_name=MAPUNIT_RASTER_NAME):
+        """
+            gSSURGO map unit raster, the value of each pixel is the MUKEY of the map unit
+        Args:
+            ssurgo_folder_path (path): path to the ssurgo database at the state level
+            raster_name (str): name of the raster inside the gdb
+        """
+        self.ssurgo_folder_path = ssurgo_folder_path
+        self.dataset = self.open_raster(ssurgo_folder_path, raster_name)
+        self.band = self.dataset.GetRasterBand(1)
+        self.geo_transform = self.dataset.GetGeoTransform()
+        self.nodata = self.band.GetNoDataValue()
+        self.width = self.dataset.RasterXSize
+        self.height = self.dataset.RasterYSize
+
+    @classmethod
+    def get(cls, ssurgo_folder_path):
+        """
+            Return the raster of the gdb, opened once by thread and by process (gdal datasets must not be shared)
+        Args:
+            ssurgo_folder_path (path): path to the ssurgo database at the state level
+
+        Returns:
+            (MapunitRaster): the opened raster
+        """
+        if not hasattr(_MAPUNIT_RASTER_CACHE, 'rasters'):
+            _MAPUNIT_RASTER_CACHE.rasters = {}
+        key = str(ssurgo_folder_path)
+        if key not in _MAPUNIT_RASTER_CACHE.rasters:
+            _MAPUNIT_RASTER_CACHE.rasters[key] = cls(ssurgo_folder_path)
+        return _MAPUNIT_RASTER_CACHE.rasters[key]
+
+    @classmethod
+    def open_raster(cls, ssurgo_folder_path, raster_name):
+        """
+            This function is useful to open the map unit raster stored in the ssurgo gdb
+        """
+        if Path(ssurgo_folder_path).suffix.lower() != '.gdb':
+            # other ogr sources (GeoPackage stand-in, ...) have the raster next to them, see find_sibling_raster_path
+            dataset = gdal.Open(str(find_sibling_raster_path(ssurgo_folder_path, raster_name)))
+        else:
+            dataset = gdal.Open(f'OpenFileGDB:"{str(ssurgo_folder_path)}":{raster_name}')
+        if dataset is None:
+            raise ValueError(f"Unable to open {raster_name} in ssurgo gdb {str(ssurgo_folder_path)}")
+        return dataset
+
+    def to_pixel(self, x, y):
+        """
+            Convert projected coordinates to pixel indices with the geotransform (north up raster)
+        Args:
+            x (ndarray): x coordinate of each point (USA_Contiguous_Albers)
+            y (ndarray): y coordinate of each point (USA_Contiguous_Albers)
+
+        Returns:
+            (ndarray, ndarray): column and row of each point
+        """
+        col = np.floor((np.asarray(x, dtype=np.float64) - self.geo_transform[0]) / self.geo_transform[1])
+        row = np.floor((np.asarray(y, dtype=np.float64) - self.geo_transform[3]) / self.geo_transform[5])
+        return col.astype(np.int64), row.astype(np.int64)
+
+    def read_mu_keys(self, x, y):
+        """
+            Read the MUKEY under each point, pixels are read by block with one windowed read by block
+        Args:
+            x (ndarray): x coordinate of each point (USA_Contiguous_Albers)
+            y (ndarray): y coordinate of each point (USA_Contiguous_Albers)
+
+        Returns:
+            (ndarray): MUKEY of each point, 0 when the point is outside the raster or on a nodata pixel
+        """
+        col, row = self.to_pixel(x, y)
+        mu_keys = np.zeros(len(col), dtype=np.int64)
+        inside = np.flatnonzero((col >= 0) & (col < self.width) & (row >= 0) & (row < self.height))
+        if len(inside) == 0:
+            return mu_keys
+
+        blocks = (row[inside] // READ_BLOCK_SIZE) * (self.width // READ_BLOCK_SIZE + 1) + col[inside] // READ_BLOCK_SIZE
+        order = np.argsort(blocks, kind='stable')
+        inside = inside[order]
+        blocks = blocks[order]
+        starts = np.flatnonzero(np.r_[True, blocks[1:] != blocks[:-1]])
+        for positions in np.split(inside, starts[1:]):
+            x_off = int(col[positions].min())
+            y_off = int(row[positions].min())
+            x_size = int(col[positions].max()) - x_off + 1
+            y_size = int(row[positions].max()) - y_off + 1
+            window = self.band.ReadAsArray(x_off, y_off, x_size, y_size)
+            mu_keys[positions] = window[row[positions] - y_off, col[positions] - x_off]
+
+        if self.nodata is not None:
+            mu_keys[mu_keys == int(self.nodata)] = 0
+        mu_keys[mu_keys < 0] = 0
+        return mu_keys
+
+    def read_zone_mu_keys(self, polygon, all_touched=False):
+        """
+            Count the pixels of each MUKEY inside a zone, only the window of the zone envelope is read and the zone is
+            rasterized on the same grid
+        Args:
+            polygon (Geometry): ogr polygon of the zone (USA_Contiguous_Albers)
+            all_touched (bool): if True count every pixel touched by the zone, otherwise only the pixels whose center
+                                is inside the zone
+
+        Returns:
+            (ndarray, ndarray): MUKEY and area (square meter) of each map unit inside the zone
+        """
+        min_x, max_x, min_y, max_y = polygon.GetEnvelope()
+        col, row = self.to_pixel([min_x, max_x], [max_y, min_y])
+        x_off = int(np.clip(col[0], 0, self.width))
+        y_off = int(np.clip(row[0], 0, self.height))
+        x_size = int(np.clip(col[1] + 1, 0, self.width)) - x_off
+        y_size = int(np.clip(row[1] + 1, 0, self.height)) - y_off
+        if x_size <= 0 or y_size <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+
+        window = self.band.ReadAsArray(x_off, y_off, x_size, y_size).astype(np.int64)
+        inside = self.rasterize_zone(polygon, x_off, y_off, x_size, y_size, all_touched)
+        mu_keys = window[inside]
+        if self.nodata is not None:
+            mu_keys = mu_keys[mu_keys != int(self.nodata)]
+        mu_keys, pixel_nb = np.unique(mu_keys[mu_keys > 0], return_counts=True)
+        return mu_keys, pixel_nb * abs(self.geo_transform[1] * self.geo_transform[5])
+
+    def rasterize_zone(self, polygon, x_off, y_off, x_size, y_size, all_touched=False):
+        """
+            Rasterize a zone on a window of the raster grid
+        Returns:
+            (ndarray): boolean mask of the window pixels inside the zone
+        """
+        window_transform = (self.geo_transform[0] + x_off * self.geo_transform[1], self.geo_transform[1], 0.,
+                            self.geo_transform[3] + y_off * self.geo_transform[5], 0., self.geo_transform[5])
+        mask_dataset = gdal.GetDriverByName('MEM').Create('', x_size, y_size, 1, gdal.GDT_Byte)
+        mask_dataset.SetGeoTransform(window_transform)
+        mask_dataset.SetProjection(self.dataset.GetProjection())
+
+        zone_dataset = ogr.GetDriverByName('Memory').CreateDataSource('')
+        zone_layer = zone_dataset.CreateLayer('zone', srs=self.dataset.GetSpatialRef(), geom_type=ogr.wkbPolygon)
+        zone_feature = ogr.Feature(zone_layer.GetLayerDefn())
+        zone_feature.SetGeometry(polygon)
+        zone_layer.CreateFeature(zone_feature)
+
+        options = ['ALL_TOUCHED=TRUE'] if all_touched else []
+        gdal.RasterizeLayer(mask_dataset, [1], zone_layer, burn_values=[1], options=options)
+        return mask_dataset.GetRasterBand(1).ReadAsArray() == 1
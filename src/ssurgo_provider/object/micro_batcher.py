@@ -0,0 +1,105 @@
+import asyncio
+import time
+
+DEFAULT_MAX_BATCH_SIZE = 256
+DEFAULT_MAX_WAIT = 0.005
+
+
+class MicroBatcher:
+    def __init__(self, batch_function, max_batch_size=DEFAULT_MAX_BATCH_SIZE, max_wait=DEFAULT_MAX_WAIT):
+        """
+            Coalesce concurrent single item requests in batches: items with the same key are collected during max_wait
+            seconds (from the first item) or until max_batch_size items, then processed with one batch_function call
+            and the result of each item is sent back to its caller
+        Args:
+            batch_function (coroutine function): batch_function(key, items) return the list of results, in the same
+                                                 order as items
+            max_batch_size (int): maximum number of items in one batch
+            max_wait (float): maximum time (second) an item waits for other items before the batch is processed
+        """
+        self.batch_function = batch_function
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.batch_nb = 0
+        self.item_nb = 0
+        self.full_batch_nb = 0
+        self.total_wait = 0.
+        self.max_item_wait = 0.
+        self.__pending = {}
+        self.__timers = {}
+        self.__tasks = set()
+
+    async def submit(self, item, key=None):
+        """
+            Add an item to the next batch of its key and wait for its result
+        Args:
+            item (object): item given to batch_function
+            key (hashable): only items with the same key are processed in the same batch
+
+        Returns:
+            (object): result of the item, the exception raised by batch_function is raised for every item of the batch
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        pending = self.__pending.setdefault(key, [])
+        pending.append((item, future, time.perf_counter()))
+        if len(pending) >= self.max_batch_size:
+            self.__flush(key)
+        elif len(pending) == 1:
+            self.__timers[key] = loop.call_later(self.max_wait, self.__flush, key)
+        return await future
+
+    def stats(self):
+        """
+            Batch metrics: number of batches and items, mean batch fill (between 0 and 1), share of full batches and
+            latency added by the batching window (millisecond)
+        """
+        return {'batch_nb': self.batch_nb,
+                'item_nb': self.item_nb,
+                'mean_batch_fill': self.item_nb / (self.batch_nb * self.max_batch_size) if self.batch_nb > 0 else 0.,
+                'full_batch_rate': self.full_batch_nb / self.batch_nb if self.batch_nb > 0 else 0.,
+                'mean_added_latency_ms': 1000 * self.total_wait / self.item_nb if self.item_nb > 0 else 0.,
+                'max_added_latency_ms': 1000 * self.max_item_wait}
+
+    def __flush(self, key):
+        timer = self.__timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self.__pending.pop(key, [])
+        if len(batch) == 0:
+            return
+        start_time = time.perf_counter()
+        waits = [start_time - enqueue_time for _, _, enqueue_time in batch]
+        self.batch_nb += 1
+        self.item_nb += len(batch)
+        self.full_batch_nb += len(batch) >= self.max_batch_size
+        self.total_wait += sum(waits)
+        self.max_item_wait = max(self.max_item_wait, max(waits))
+        # keep a reference on the task until it is done (the event loop only keeps a weak one)
+        task = asyncio.ensure_future(self.__run(key, batch))
+        self.__tasks.add(task)
+        task.add_done_callback(self.__tasks.discard)
+
+    async def __run(self, key, batch):
+        try:
+            results = list(await self.batch_function(key, [item for item, _, _ in batch]))
+            if len(results) != len(batch):
+                raise ValueError(f"batch_function returned {len(results)} results for {len(batch)} items")
+            for (_, future, _), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+        except Exception as err:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(err)
+        except BaseException:
+            # cancelled (shutdown) or interrupted, the callers are cancelled too
+            for _, future, _ in batch:
+                if not future.done():
+                    future.cancel()
+            raise
+        finally:
+            # no caller waits forever
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(RuntimeError("the batch ended without a result for this item"))
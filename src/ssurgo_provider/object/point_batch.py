@@ -0,0 +1,104 @@
+import numpy as np
+import pandas as pd
+
+# number of main components kept by location
+COMPONENT_NB = 3
+# columns filled by the stages, after the coordinates
+STAGE_COLUMNS = ['county_id', 'mu_sym', 'mu_key', 'spatial_ver', 'area_symbol', 'co_keys', 'co_keys_pct']
+
+
+class PointBatch:
+    def __init__(self, latitude, longitude, x, y):
+        """
+            Locations processed together by the soil lookup stages, stored as one array by column. Each stage fills
+            its columns in place (county_id, then mu_sym mu_key spatial_ver area_symbol, then co_keys co_keys_pct)
+        Args:
+            latitude (ndarray): latitude of each location (espg 4326)
+            longitude (ndarray): longitude of each location (espg 4326)
+            x (ndarray): x coordinate of each location (USA_Contiguous_Albers)
+            y (ndarray): y coordinate of each location (USA_Contiguous_Albers)
+        """
+        pts_nb = len(x)
+        self.latitude = np.asarray(latitude, dtype=np.float64)
+        self.longitude = np.asarray(longitude, dtype=np.float64)
+        self.x = np.asarray(x, dtype=np.float64)
+        self.y = np.asarray(y, dtype=np.float64)
+        self.county_id = np.full(pts_nb, None, dtype=object)
+        self.mu_sym = np.full(pts_nb, None, dtype=object)
+        self.mu_key = np.full(pts_nb, np.nan)
+        self.spatial_ver = np.full(pts_nb, None, dtype=object)
+        self.area_symbol = np.full(pts_nb, None, dtype=object)
+        # co_key and percentage of the three main components, nan when missing
+        self.co_keys = np.full((pts_nb, COMPONENT_NB), np.nan)
+        self.co_keys_pct = np.full((pts_nb, COMPONENT_NB), np.nan)
+
+    def __len__(self):
+        return len(self.x)
+
+    @classmethod
+    def from_dataframe(cls, pts_info_df):
+        """
+            Build the batch from a dataframe of locations, every known column is copied (see to_dataframe)
+        Args:
+            pts_info_df (DataFrame): dataframe with x and y, and optionally latitude longitude county_id mu_sym mu_key
+                                     spatial_ver area_symbol co_key_0/1/2 co_key_0/1/2_pct
+
+        Returns:
+            (PointBatch): batch of the locations in the same order
+        """
+        pts_nb = len(pts_info_df)
+        point_batch = cls(pts_info_df.latitude if 'latitude' in pts_info_df else np.full(pts_nb, np.nan),
+                          pts_info_df.longitude if 'longitude' in pts_info_df else np.full(pts_nb, np.nan),
+                          pts_info_df.x if 'x' in pts_info_df else np.full(pts_nb, np.nan),
+                          pts_info_df.y if 'y' in pts_info_df else np.full(pts_nb, np.nan))
+        for column in ['county_id', 'mu_sym', 'spatial_ver', 'area_symbol']:
+            if column in pts_info_df:
+                getattr(point_batch, column)[:] = pts_info_df[column].to_numpy(dtype=object)
+        if 'mu_key' in pts_info_df:
+            point_batch.mu_key[:] = pts_info_df.mu_key.to_numpy(dtype=np.float64)
+        for component_nb in range(COMPONENT_NB):
+            if f"co_key_{component_nb}" in pts_info_df:
+                point_batch.co_keys[:, component_nb] = pts_info_df[f"co_key_{component_nb}"].to_numpy(np.float64)
+            if f"co_key_{component_nb}_pct" in pts_info_df:
+                point_batch.co_keys_pct[:, component_nb] = \
+                    pts_info_df[f"co_key_{component_nb}_pct"].to_numpy(np.float64)
+        return point_batch
+
+    def take(self, positions):
+        """
+            Args:
+                positions (ndarray): positions of the locations to copy
+
+            Returns:
+                (PointBatch): new batch with a copy of every column of the locations at positions
+        """
+        point_batch = PointBatch(self.latitude[positions], self.longitude[positions], self.x[positions],
+                                 self.y[positions])
+        for column in STAGE_COLUMNS:
+            getattr(point_batch, column)[:] = getattr(self, column)[positions]
+        return point_batch
+
+    def put(self, positions, point_batch):
+        """
+            Copy the stage columns of a batch (see take) back to the locations at positions
+        Args:
+            positions (ndarray): positions of the locations of point_batch in this batch
+            point_batch (PointBatch): batch with one location by position
+        """
+        for column in STAGE_COLUMNS:
+            getattr(self, column)[positions] = getattr(point_batch, column)
+
+    def to_dataframe(self):
+        """
+            Returns:
+                (DataFrame): one row by location with latitude longitude x y county_id mu_sym mu_key spatial_ver
+                             area_symbol co_key_0/1/2 co_key_0/1/2_pct
+        """
+        columns = {'latitude': self.latitude, 'longitude': self.longitude, 'x': self.x, 'y': self.y,
+                   'county_id': self.county_id, 'mu_sym': self.mu_sym, 'mu_key': self.mu_key,
+                   'spatial_ver': self.spatial_ver, 'area_symbol': self.area_symbol}
+        columns.update({f"co_key_{component_nb}": self.co_keys[:, component_nb]
+                        for component_nb in range(COMPONENT_NB)})
+        columns.update({f"co_key_{component_nb}_pct": self.co_keys_pct[:, component_nb]
+                        for component_nb in range(COMPONENT_NB)})
+        return pd.DataFrame(columns)
@@ -0,0 +1,123 @@
+import numpy as np
+import shapely
+from shapely import STRtree
+
+from ssurgo_provider.instrumentation import count
+
+
+class PolygonIndex:
+    def __init__(self, geometries):
+        """
+            Spatial index over a fixed set of polygons, built once and queried with whole arrays of points
+        Args:
+            geometries (list/ndarray): shapely polygons, the position in the list is the polygon id
+        """
+        self.geometries = np.asarray(geometries, dtype=object)
+        shapely.prepare(self.geometries)
+        self.tree = STRtree(self.geometries)
+
+    def __len__(self):
+        return len(self.geometries)
+
+    def locate_xy(self, x, y):
+        """
+            Find the polygon containing each point
+        Args:
+            x (ndarray): x coordinate of each point (same projection as the polygons)
+            y (ndarray): y coordinate of each point (same projection as the polygons)
+
+        Returns:
+            (ndarray): id of the polygon containing each point, -1 when the point is in no polygon.
+                       When polygons overlap the lowest id wins.
+        """
+        polygon_id = np.full(len(x), -1, dtype=np.int64)
+        point_idx, tree_idx = self.query_xy(x, y)
+        first = np.unique(point_idx, return_index=True)[1]
+        polygon_id[point_idx[first]] = tree_idx[first]
+        return polygon_id
+
+    def query_xy(self, x, y):
+        """
+            Find every polygon containing each point
+        Args:
+            x (ndarray): x coordinate of each point (same projection as the polygons)
+            y (ndarray): y coordinate of each point (same projection as the polygons)
+
+        Returns:
+            (ndarray, ndarray): point index and polygon id of each (point, polygon containing it) pair, sorted by
+                                point then polygon id
+        """
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        if len(x) == 0 or len(self.geometries) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+        # bounding box candidates from the tree, then exact test against the prepared polygons
+        point_idx, tree_idx = self.tree.query(shapely.points(x, y))
+        inside = shapely.contains_xy(self.geometries[tree_idx], x[point_idx], y[point_idx])
+        count('geometry_predicates', len(tree_idx))
+        point_idx = point_idx[inside]
+        tree_idx = tree_idx[inside]
+        order = np.lexsort((tree_idx, point_idx))
+        return point_idx[order], tree_idx[order]
+
+    def intersection_areas(self, geometry):
+        """
+            Area of the intersection of a geometry with each polygon it intersects
+        Args:
+            geometry (Geometry): shapely geometry (same projection as the polygons)
+
+        Returns:
+            (ndarray, ndarray): id of each intersected polygon and area of the intersection
+        """
+        tree_idx = self.tree.query(geometry, predicate='intersects')
+        if len(tree_idx) == 0:
+            return tree_idx, np.zeros(0)
+
+        # a geometry inside a prepared polygon does not need the (costly) intersection
+        polygons = self.geometries[tree_idx]
+        inside = shapely.contains_properly(polygons, geometry)
+        areas = np.full(len(tree_idx), shapely.area(geometry))
+        areas[~inside] = shapely.area(shapely.intersection(polygons[~inside], geometry))
+        count('geometry_predicates', 2 * len(tree_idx))
+        found = areas > 0
+        return tree_idx[found], areas[found]
+
+
+def ogr_geometry_to_shapely(geometry):
+    """
+        Convert an ogr geometry to a shapely geometry (curve geometries are linearized)
+    Args:
+        geometry (ogr.Geometry): geometry to convert
+
+    Returns:
+        (BaseGeometry): shapely geometry
+    """
+    if geometry.HasCurveGeometry():
+        geometry = geometry.GetLinearGeometry()
+    return shapely.from_wkb(bytes(geometry.ExportToWkb()))
+
+
+def save_geometries(artifact_pth, geometries):
+    """
+    Write geometries as WKB in two .npy files (wkb.npy and wkb_offsets.npy, memory mapped at load)
+    Args:
+        artifact_pth (path): folder of the files
+        geometries (ndarray): shapely geometries
+    """
+    wkb_list = shapely.to_wkb(geometries)
+    wkb_offsets = np.zeros(len(wkb_list) + 1, dtype=np.int64)
+    wkb_offsets[1:] = np.cumsum([len(wkb) for wkb in wkb_list])
+    np.save(artifact_pth / 'wkb_offsets.npy', wkb_offsets)
+    np.save(artifact_pth / 'wkb.npy', np.frombuffer(b''.join(wkb_list), dtype=np.uint8))
+
+
+def load_geometries(artifact_pth):
+    """
+    Read the geometries written by save_geometries
+    Returns:
+        (ndarray): shapely geometries
+    """
+    wkb_offsets = np.load(artifact_pth / 'wkb_offsets.npy')
+    wkb = np.load(artifact_pth / 'wkb.npy', mmap_mode='r')
+    return shapely.from_wkb([wkb[start:stop].tobytes() for start, stop in zip(wkb_offsets[:-1], wkb_offsets[1:])])
@@ -0,0 +1,159 @@
+import threading
+from collections import OrderedDict
+
+from ssurgo_provider.instrumentation import count
+from ssurgo_provider.object.gbd_connect import gdb_modification_time
+
+DEFAULT_MAX_ENTRIES = 200000
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+_RELEASE_CACHE = {}
+_RELEASE_LOCK = threading.Lock()
+
+
+class SoilCache:
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, max_bytes=DEFAULT_MAX_BYTES):
+        """
+            Process wide LRU cache of mu_key / co_key results, keyed by (state gdb, kind, key)
+            All the entries of a gdb are dropped when its release (modification time, SPATIALVER) changes
+        Args:
+            max_entries (int/None): maximum number of entries, None for no limit
+            max_bytes (int/None): maximum estimated size of all entries, None for no limit
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.size = 0
+        self.__entries = OrderedDict()
+        self.__releases = {}
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def get_many(self, gdb_release, kind, keys):
+        """
+            Look up many keys at once
+        Args:
+            gdb_release (tuple): (gdb path, modification time, SPATIALVER), see gdb_release
+            kind (str): kind of value (component, horizon, ...)
+            keys (iterable): keys to find
+
+        Returns:
+            (dict, list): value of the keys found in the cache and list of missing keys
+        """
+        found = {}
+        missing = []
+        with self.__lock:
+            self.__check_release(gdb_release)
+            for key in keys:
+                cache_key = (gdb_release[0], kind, key)
+                entry = self.__entries.get(cache_key)
+                if entry is None:
+                    missing.append(key)
+                else:
+                    self.__entries.move_to_end(cache_key)
+                    found[key] = entry[0]
+            self.hits += len(found)
+            self.misses += len(missing)
+        count('soil_cache_hits', len(found))
+        count('soil_cache_misses', len(missing))
+        return found, missing
+
+    def put_many(self, gdb_release, kind, values, size_function):
+        """
+            Add many values at once, the least recently used entries are evicted to respect the budget
+        Args:
+            gdb_release (tuple): (gdb path, modification time, SPATIALVER), see gdb_release
+            kind (str): kind of value (component, horizon, ...)
+            values (dict): value by key
+            size_function (function): estimated size in bytes of a value
+        """
+        with self.__lock:
+            self.__check_release(gdb_release)
+            for key, value in values.items():
+                cache_key = (gdb_release[0], kind, key)
+                if cache_key in self.__entries:
+                    self.size -= self.__entries.pop(cache_key)[1]
+                size = size_function(value)
+                self.__entries[cache_key] = (value, size)
+                self.size += size
+            self.__evict()
+
+    def resize(self, max_entries=DEFAULT_MAX_ENTRIES, max_bytes=DEFAULT_MAX_BYTES):
+        """
+            Change the budget, entries over the new budget are evicted
+        """
+        with self.__lock:
+            self.max_entries = max_entries
+            self.max_bytes = max_bytes
+            self.__evict()
+
+    def clear(self, gdb_path=None):
+        """
+            Drop all entries, or only the entries of one gdb
+        """
+        with self.__lock:
+            for cache_key in [cache_key for cache_key in self.__entries
+                              if gdb_path is None or cache_key[0] == str(gdb_path)]:
+                self.size -= self.__entries.pop(cache_key)[1]
+            if gdb_path is None:
+                self.__releases.clear()
+            else:
+                self.__releases.pop(str(gdb_path), None)
+
+    def stats(self):
+        return {'entries': len(self.__entries), 'size': self.size, 'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions}
+
+    def __check_release(self, gdb_release):
+        if self.__releases.get(gdb_release[0], gdb_release) != gdb_release:
+            for cache_key in [cache_key for cache_key in self.__entries if cache_key[0] == gdb_release[0]]:
+                self.size -= self.__entries.pop(cache_key)[1]
+        self.__releases[gdb_release[0]] = gdb_release
+
+    def __evict(self):
+        while len(self.__entries) > 0 and \
+                ((self.max_entries is not None and len(self.__entries) > self.max_entries) or
+                 (self.max_bytes is not None and self.size > self.max_bytes)):
+            self.size -= self.__entries.popitem(last=False)[1][1]
+            self.evictions += 1
+
+
+soil_cache = SoilCache()
+
+
+def configure_soil_cache(max_entries=DEFAULT_MAX_ENTRIES, max_bytes=DEFAULT_MAX_BYTES):
+    """
+    Change the budget of the process wide soil cache, entries over the new budget are evicted
+    Args:
+        max_entries (int/None): maximum number of entries, None for no limit, 0 to disable the cache
+        max_bytes (int/None): maximum estimated size of all entries, None for no limit
+    """
+    soil_cache.resize(max_entries, max_bytes)
+
+
+def gdb_release(gdb):
+    """
+    Release of a state gdb: its path, modification time (latest of its files, see gdb_modification_time) and the
+    latest SPATIALVER of its survey areas. SPATIALVER is read once by modification time
+    Args:
+        gdb (DataSource): ssurgo state datasource
+
+    Returns:
+        (tuple): (gdb path, modification time, SPATIALVER)
+    """
+    gdb_pth = gdb.GetName()
+    modification_time = gdb_modification_time(gdb_pth)
+    with _RELEASE_LOCK:
+        spatial_ver = _RELEASE_CACHE.get((gdb_pth, modification_time))
+    if spatial_ver is None:
+        layer_sa_polygon = gdb.GetLayer("SAPOLYGON")
+        layer_sa_polygon.SetAttributeFilter(None)
+        layer_sa_polygon.ResetReading()
+        spatial_ver = max([int(feature.GetField("SPATIALVER") or 0) for feature in layer_sa_polygon], default=0)
+        with _RELEASE_LOCK:
+            _RELEASE_CACHE[(gdb_pth, modification_time)] = spatial_ver
+    return gdb_pth, modification_time, spatial_ver
@@ -0,0 +1,183 @@
+import json
+import sys
+import threading
+from pathlib import Path
+
+import numpy as np
+from osgeo import ogr
+
+from ssurgo_provider.object.gbd_connect import GbdConnect, gdb_modification_time
+from ssurgo_provider.object.ssurgo_soil_dto import HORIZON_FIELDS
+
+# tabular layers exported in the pack: key used to index the rows, optional sort field inside a key and fields
+PACK_TABLES = {
+    'mapunit': {'key': 'mukey', 'key_kind': 'int', 'sort': None, 'fields': ['mukey', 'musym', 'lkey']},
+    'legend': {'key': 'lkey', 'key_kind': 'str', 'sort': None, 'fields': ['lkey', 'areasymbol']},
+    'component': {'key': 'mukey', 'key_kind': 'int', 'sort': None, 'fields': ['mukey', 'cokey', 'comppct_r']},
+    'chorizon': {'key': 'cokey', 'key_kind': 'int', 'sort': 'hzdept_r',
+                 'fields': [field for _, field in HORIZON_FIELDS]},
+}
+INDEX_KEYS_FILE = '_index_keys.npy'
+INDEX_OFFSETS_FILE = '_index_offsets.npy'
+
+_SOIL_PACK_CACHE = {}
+_SOIL_PACK_LOCK = threading.Lock()
+
+
+class SoilPack:
+    def __init__(self, pack_pth):
+        """
+            Columnar copy of the tabular layers of a state gdb, every column is a memory mapped .npy file and the rows
+            of each table are sorted by key (mukey, cokey, ...) so the rows of a key are a contiguous slice
+        Args:
+            pack_pth (path): path to the pack folder (see build_soil_pack)
+        """
+        self.pack_pth = Path(pack_pth)
+        with open(self.pack_pth / 'meta.json') as meta_file:
+            self.meta = json.load(meta_file)
+        self.__columns = {}
+
+    @classmethod
+    def open(cls, ssurgo_folder_path):
+        """
+            Return the pack of a state gdb, opened once by process
+        Args:
+            ssurgo_folder_path (path): path to the ssurgo database at the state level
+
+        Returns:
+            (SoilPack/None): the pack, None if it is not built or older than the gdb
+        """
+        pack_pth = find_soil_pack_path(ssurgo_folder_path)
+        if not (pack_pth / 'meta.json').exists():
+            return None
+        with _SOIL_PACK_LOCK:
+            soil_pack = _SOIL_PACK_CACHE.get(str(pack_pth))
+            if soil_pack is None:
+                soil_pack = cls(pack_pth)
+                _SOIL_PACK_CACHE[str(pack_pth)] = soil_pack
+        if soil_pack.meta['source_mtime'] != gdb_modification_time(ssurgo_folder_path):
+            return None
+        return soil_pack
+
+    def column(self, table, field):
+        """
+            Memory mapped column of a table
+        Args:
+            table (str): table name (see PACK_TABLES)
+            field (str): field name
+
+        Returns:
+            (ndarray): column values, float64 (nan for null) for numeric fields, str ('' for null) otherwise
+        """
+        key = (table, field)
+        if key not in self.__columns:
+            self.__columns[key] = np.load(self.pack_pth / table / f'{field}.npy', mmap_mode='r')
+        return self.__columns[key]
+
+    def rows(self, table, keys):
+        """
+            Find the rows of all keys
+        Args:
+            table (str): table name (see PACK_TABLES)
+            keys (iterable): unique keys to find
+
+        Returns:
+            (ndarray, ndarray): row positions in the table and key of each row
+        """
+        index_keys = self.column(table, INDEX_KEYS_FILE[:-4])
+        offsets = self.column(table, INDEX_OFFSETS_FILE[:-4])
+        keys = np.asarray(list(keys))
+        if len(keys) == 0 or len(index_keys) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=index_keys.dtype)
+        keys = keys.astype(index_keys.dtype)
+        idx = np.clip(np.searchsorted(index_keys, keys), 0, len(index_keys) - 1)
+        idx = idx[index_keys[idx] == keys]
+        starts = offsets[idx]
+        lengths = offsets[idx + 1] - starts
+        row_nb = int(lengths.sum())
+        positions = np.arange(row_nb, dtype=np.int64) - np.repeat(np.cumsum(lengths) - lengths, lengths) + \
+            np.repeat(starts, lengths)
+        return positions, np.repeat(index_keys[idx], lengths)
+
+
+def field_kind(field_type):
+    """
+    Kind of column used to store an ogr field type: 'int', 'float' (both stored as float64) or 'str'
+    """
+    if field_type in (ogr.OFTInteger, ogr.OFTInteger64):
+        return 'int'
+    if field_type == ogr.OFTReal:
+        return 'float'
+    return 'str'
+
+
+def find_soil_pack_path(ssurgo_folder_path):
+    """
+    Path of the pack of a state gdb: gSSURGO_XX.pack next to gSSURGO_XX.gdb
+    """
+    ssurgo_folder_path = Path(ssurgo_folder_path)
+    return ssurgo_folder_path.parent / f'{ssurgo_folder_path.stem}.pack'
+
+
+def build_soil_pack(ssurgo_folder_path, pack_pth=None):
+    """
+    Export the tabular layers of a state gdb (see PACK_TABLES) to a columnar pack
+    Args:
+        ssurgo_folder_path (path): path to the ssurgo database at the state level
+        pack_pth (path/None): path to the pack folder, see find_soil_pack_path if None
+
+    Returns:
+        (path): path to the pack folder
+    """
+    pack_pth = find_soil_pack_path(ssurgo_folder_path) if pack_pth is None else Path(pack_pth)
+    gdb = GbdConnect(ssurgo_folder_path).gdb
+    meta = {'source': str(ssurgo_folder_path), 'source_mtime': gdb_modification_time(ssurgo_folder_path, refresh=True),
+            'tables': {}}
+
+    for table, table_spec in PACK_TABLES.items():
+        layer = gdb.GetLayer(table)
+        layer_defn = layer.GetLayerDefn()
+        field_kinds = {field: field_kind(layer_defn.GetFieldDefn(layer_defn.GetFieldIndex(field)).GetType())
+                       for field in table_spec['fields']}
+
+        values = {field: [] for field in table_spec['fields']}
+        for feature in layer:
+            if feature.GetField(table_spec['key']) is None:
+                continue
+            for field in table_spec['fields']:
+                values[field].append(feature.GetField(field))
+
+        columns = {}
+        for field, kind in field_kinds.items():
+            if kind == 'str':
+                columns[field] = np.array(['' if value is None else str(value) for value in values[field]])
+            else:
+                columns[field] = np.array([np.nan if value is None else value for value in values[field]],
+                                          dtype=np.float64)
+        keys = np.array(values[table_spec['key']]).astype(np.int64 if table_spec['key_kind'] == 'int' else str)
+        if table_spec['sort'] is None:
+            order = np.argsort(keys, kind='stable')
+        else:
+            order = np.lexsort((columns[table_spec['sort']], keys))
+        keys = keys[order]
+        index_keys, index_starts = np.unique(keys, return_index=True)
+
+        table_pth = pack_pth / table
+        table_pth.mkdir(parents=True, exist_ok=True)
+        for field, column in columns.items():
+            np.save(table_pth / f'{field}.npy', column[order])
+        np.save(table_pth / INDEX_KEYS_FILE, index_keys)
+        np.save(table_pth / INDEX_OFFSETS_FILE, np.append(index_starts, len(keys)).astype(np.int64))
+        meta['tables'][table] = {'key': table_spec['key'], 'row_nb': len(keys), 'fields': field_kinds}
+    del gdb
+
+    with open(pack_pth / 'meta.json', 'w') as meta_file:
+        json.dump(meta, meta_file)
+    with _SOIL_PACK_LOCK:
+        _SOIL_PACK_CACHE.pop(str(pack_pth), None)
+    return pack_pth
+
+
+if __name__ == '__main__':
+    for gdb_path in sys.argv[1:]:
+        print(build_soil_pack(gdb_path))
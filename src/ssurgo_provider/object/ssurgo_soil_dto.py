@@ -1,3 +1,26 @@
+# (attribute, chorizon field) of each SoilHorizon attribute
+HORIZON_FIELDS = [
+    ('hzname', 'hzname'), ('desgndisc', 'desgndisc'), ('desgnmaster', 'desgnmaster'),
+    ('desgnmasterprime', 'desgnmasterprime'), ('desgnvert', 'desgnvert'), ('hzdept_r', 'hzdept_r'),
+    ('hzdepb_r', 'hzdepb_r'), ('hzthk_r', 'hzthk_r'), ('fraggt10_r', 'fraggt10_r'), ('frag3to10_r', 'frag3to10_r'),
+    ('sieveno4_r', 'sieveno4_r'), ('sieveno10_r', 'sieveno10_r'), ('sieveno40_r', 'sieveno40_r'),
+    ('sieveno200_r', 'sieveno200_r'), ('sandtotal_r', 'sandtotal_r'), ('sandvc_r', 'sandvc_r'),
+    ('sandco_r', 'sandco_r'), ('sandmed_r', 'sandmed_r'), ('sandfine_r', 'sandfine_r'), ('sandvf_r', 'sandvf_r'),
+    ('silttotal_r', 'silttotal_r'), ('siltco_r', 'siltco_r'), ('siltfine_r', 'siltfine_r'),
+    ('claytotal_r', 'claytotal_r'), ('claysizedcarb_r', 'claysizedcarb_r'), ('om_r', 'om_r'),
+    ('dbtenthbar_r', 'dbtenthbar_r'), ('dbthirdbar_r', 'dbthirdbar_r'), ('dbfifteenbar_r', 'dbfifteenbar_r'),
+    ('dbovendry_r', 'dbovendry_r'), ('partdensity', 'partdensity'), ('ksat_r', 'ksat_r'), ('awc_r', 'awc_r'),
+    ('wtenthbar_r', 'wtenthbar_r'), ('wthirdbar_r', 'wthirdbar_r'), ('wfifteenbar_r', 'wfifteenbar_r'),
+    ('wsatiated_r', 'wsatiated_r'), ('lep_r', 'lep_r'), ('ll_r', 'll_r'), ('pi_r', 'pi_r'), ('aashind_r', 'aashind_r'),
+    ('kwfact', 'kwfact'), ('kffact', 'kffact'), ('caco3_r', 'caco3_r'), ('gypsum_r', 'gypsum_r'), ('sar_r', 'sar_r'),
+    ('ec_r', 'ec_r'), ('cec7_r', 'cec7_r'), ('ecec_r', 'ecec_r'), ('sumbases_r', 'sumbases_r'),
+    ('ph1to1h2o_r', 'ph1to1h2o_r'), ('ph01mcacl2_r', 'ph01mcacl2_r'), ('freeiron_r', 'freeiron_r'),
+    ('feoxalate_r', 'feoxalate_r'), ('extracid_r', 'extracid_r'), ('extral_r', 'extral_r'), ('pbray1_r', 'pbray1_r'),
+    ('poxalate_r', 'poxalate_r'), ('ph2o_soluble_r', 'ph2osoluble_r'), ('ptotal_r', 'ptotal_r'),
+    ('excavdifcl', 'excavdifcl'), ('excavdifms', 'excavdifms'), ('chkey', 'chkey'), ('cokey', 'cokey')]
+HORIZON_ATTRIBUTES = dict(HORIZON_FIELDS)
+
+
 class SsurgoSoilDto:
     def __init__(self, latitude, longitude):
         self.latitude = latitude
@@ -5,88 +28,75 @@ class SsurgoSoilDto:
         self.horizon_0 = None
         self.horizon_1 = None
         self.horizon_2 = None
+        self.profile_0 = []
+        self.profile_1 = []
+        self.profile_2 = []
 
     def to_dict(self):
         horizon_0_dict = None
         horizon_1_dict = None
         horizon_2_dict = None
         if self.horizon_0 is not None:
-            horizon_0_dict = self.horizon_0.__dict__
+            horizon_0_dict = self.horizon_0.to_dict()
         if self.horizon_1 is not None:
-            horizon_1_dict = self.horizon_1.__dict__
+            horizon_1_dict = self.horizon_1.to_dict()
         if self.horizon_2 is not None:
-            horizon_2_dict = self.horizon_2.__dict__
+            horizon_2_dict = self.horizon_2.to_dict()
         return {'latitude': self.latitude,
                 'longitude': self.longitude,
                 'horizon_0': horizon_0_dict,
                 'horizon_1': horizon_1_dict,
-                'horizon_2': horizon_2_dict}
+                'horizon_2': horizon_2_dict,
+                'profile_0': [soil_horizon.to_dict() for soil_horizon in self.profile_0],
+                'profile_1': [soil_horizon.to_dict() for soil_horizon in self.profile_1],
+                'profile_2': [soil_horizon.to_dict() for soil_horizon in self.profile_2]}
+
+    def to_flat_dict(self):
+        """
+            One level dict for tabular outputs: latitude, longitude, every field of the surface horizon of each
+            component prefixed with horizon_N_ (None if the component does not exist) and the horizon number of each
+            component profile
+        """
+        flat_dict = {'latitude': self.latitude, 'longitude': self.longitude}
+        for horizon_idx, (horizon, profile) in enumerate([(self.horizon_0, self.profile_0),
+                                                          (self.horizon_1, self.profile_1),
+                                                          (self.horizon_2, self.profile_2)]):
+            horizon_dict = horizon.to_dict() if horizon is not None else \
+                dict.fromkeys(['comppct_r'] + [attribute for attribute, _ in HORIZON_FIELDS])
+            for attribute, value in horizon_dict.items():
+                flat_dict[f'horizon_{horizon_idx}_{attribute}'] = value
+            flat_dict[f'profile_{horizon_idx}_horizon_nb'] = len(profile)
+        return flat_dict
 
 
 class SoilHorizon(object):
-    def __init__(self, comppct_r, feature):
-        self.comppct_r = comppct_r
-        self.hzname = feature.GetField("hzname")
-        self.desgndisc = feature.GetField("desgndisc")
-        self.desgnmaster = feature.GetField("desgnmaster")
-        self.desgnmasterprime = feature.GetField("desgnmasterprime")
-        self.desgnvert = feature.GetField("desgnvert")
-        self.hzdept_r = feature.GetField("hzdept_r")
-        self.hzdepb_r = feature.GetField("hzdepb_r")
-        self.hzthk_r = feature.GetField("hzthk_r")
-        self.fraggt10_r = feature.GetField("fraggt10_r")
-        self.frag3to10_r = feature.GetField("frag3to10_r")
-        self.sieveno4_r = feature.GetField("sieveno4_r")
-        self.sieveno10_r = feature.GetField("sieveno10_r")
-        self.sieveno40_r = feature.GetField("sieveno40_r")
-        self.sieveno200_r = feature.GetField("sieveno200_r")
-        self.sandtotal_r = feature.GetField("sandtotal_r")
-        self.sandvc_r = feature.GetField("sandvc_r")
-        self.sandco_r = feature.GetField("sandco_r")
-        self.sandmed_r = feature.GetField("sandmed_r")
-        self.sandfine_r = feature.GetField("sandfine_r")
-        self.sandvf_r = feature.GetField("sandvf_r")
-        self.silttotal_r = feature.GetField("silttotal_r")
-        self.siltco_r = feature.GetField("siltco_r")
-        self.siltfine_r = feature.GetField("siltfine_r")
-        self.claytotal_r = feature.GetField("claytotal_r")
-        self.claysizedcarb_r = feature.GetField("claysizedcarb_r")
-        self.om_r = feature.GetField("om_r")
-        self.dbtenthbar_r = feature.GetField("dbtenthbar_r")
-        self.dbthirdbar_r = feature.GetField("dbthirdbar_r")
-        self.dbfifteenbar_r = feature.GetField("dbfifteenbar_r")
-        self.dbovendry_r = feature.GetField("dbovendry_r")
-        self.partdensity = feature.GetField("partdensity")
-        self.ksat_r = feature.GetField("ksat_r")
-        self.awc_r = feature.GetField("awc_r")
-        self.wtenthbar_r = feature.GetField("wtenthbar_r")
-        self.wthirdbar_r = feature.GetField("wthirdbar_r")
-        self.wfifteenbar_r = feature.GetField("wfifteenbar_r")
-        self.wsatiated_r = feature.GetField("wsatiated_r")
-        self.lep_r = feature.GetField("lep_r")
-        self.ll_r = feature.GetField("ll_r")
-        self.pi_r = feature.GetField("pi_r")
-        self.aashind_r = feature.GetField("aashind_r")
-        self.kwfact = feature.GetField("kwfact")
-        self.kffact = feature.GetField("kffact")
-        self.caco3_r = feature.GetField("caco3_r")
-        self.gypsum_r = feature.GetField("gypsum_r")
-        self.sar_r = feature.GetField("sar_r")
-        self.ec_r = feature.GetField("ec_r")
-        self.cec7_r = feature.GetField("cec7_r")
-        self.ecec_r = feature.GetField("ecec_r")
-        self.sumbases_r = feature.GetField("sumbases_r")
-        self.ph1to1h2o_r = feature.GetField("ph1to1h2o_r")
-        self.ph01mcacl2_r = feature.GetField("ph01mcacl2_r")
-        self.freeiron_r = feature.GetField("freeiron_r")
-        self.feoxalate_r = feature.GetField("feoxalate_r")
-        self.extracid_r = feature.GetField("extracid_r")
-        self.extral_r = feature.GetField("extral_r")
-        self.pbray1_r = feature.GetField("pbray1_r")
-        self.poxalate_r = feature.GetField("poxalate_r")
-        self.ph2o_soluble_r = feature.GetField("ph2osoluble_r")
-        self.ptotal_r = feature.GetField("ptotal_r")
-        self.excavdifcl = feature.GetField("excavdifcl")
-        self.excavdifms = feature.GetField("excavdifms")
-        self.chkey = feature.GetField("chkey")
-        self.cokey = feature.GetField("cokey")
+    __slots__ = ('horizon_table', 'row', 'comppct_r')
+
+    def __init__(self, horizon_table, row, comppct_r):
+        """
+            Immutable view on one horizon of a HorizonTable with the component percentage of one location
+        Args:
+            horizon_table (HorizonTable): table holding the horizon
+            row (int): row of the horizon in the table
+            comppct_r (float): percentage of the component for the location
+        """
+        object.__setattr__(self, 'horizon_table', horizon_table)
+        object.__setattr__(self, 'row', row)
+        object.__setattr__(self, 'comppct_r', comppct_r)
+
+    def __getattr__(self, attribute):
+        if attribute not in HORIZON_ATTRIBUTES:
+            raise AttributeError(f"SoilHorizon has no attribute {attribute}")
+        return self.horizon_table.value(HORIZON_ATTRIBUTES[attribute], self.row)
+
+    def __setattr__(self, attribute, value):
+        raise AttributeError("SoilHorizon is immutable")
+
+    def __reduce__(self):
+        return SoilHorizon, (self.horizon_table, self.row, self.comppct_r)
+
+    def to_dict(self):
+        horizon_dict = {'comppct_r': self.comppct_r}
+        for attribute, field in HORIZON_FIELDS:
+            horizon_dict[attribute] = self.horizon_table.value(field, self.row)
+        return horizon_dict
@@ -7,6 +7,8 @@ class StateInfo:
         self.state_code = state_code
         self.points = points
         self.state_folder_pth = None
+        # survey area (AREASYMBOL) of the point, known when routed with the national survey area index
+        self.area_symbol = None
         self.soil_data = None
 
     def set_soil(self, soil_data):
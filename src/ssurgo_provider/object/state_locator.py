@@ -0,0 +1,98 @@
+import numpy as np
+
+from ssurgo_provider.object.polygon_index import PolygonIndex
+from ssurgo_provider.param import states_code
+
+# number of points tested at once against all state bounding boxes (bound the (points x states) mask size)
+BBOX_CHUNK_SIZE = 100000
+
+
+class StateLocator:
+    def __init__(self, state_names, state_geometries):
+        """
+            Locate the US state of many points at once, build it once and reuse it
+        Args:
+            state_names (list(str)): GADM state name (NAME_1) of each geometry
+            state_geometries (list(Polygon)): shapely state geometries in (long, lat) coordinates
+        """
+        state_keys = [state_name.lower().replace(" ", "_") for state_name in state_names]
+        self.state_codes = np.array([states_code[state_key]['code'] for state_key in state_keys], dtype=object)
+        # bounding box of each state from param.states_code: [lat_min, lat_max, long_min, long_max]
+        self.bbox = np.array([states_code[state_key]['lat_lim'] + states_code[state_key]['long_lim']
+                              for state_key in state_keys], dtype=np.float64).reshape(-1, 4)
+        self.polygon_index = PolygonIndex(state_geometries)
+
+    @classmethod
+    def from_gdf(cls, states_gdf):
+        """
+            Build the locator from the GADM GeoDataFrame, geometries are merged by state name
+        Args:
+            states_gdf (GeoDataFrame): GeoDataFrame with all US state shapefile
+
+        Returns:
+            (StateLocator): locator over all states in states_gdf
+        """
+        return cls(*dissolve_states(states_gdf))
+
+    def in_bbox(self, latitude, longitude):
+        """
+            Vectorized bounding box prefilter
+        Args:
+            latitude (ndarray): latitude of each point
+            longitude (ndarray): longitude of each point
+
+        Returns:
+            (ndarray): boolean mask, True when the point is inside the bounding box of at least one state
+        """
+        mask = np.zeros(len(latitude), dtype=bool)
+        for start in range(0, len(latitude), BBOX_CHUNK_SIZE):
+            lat = latitude[start:start + BBOX_CHUNK_SIZE, None]
+            long = longitude[start:start + BBOX_CHUNK_SIZE, None]
+            mask[start:start + BBOX_CHUNK_SIZE] = ((self.bbox[:, 0] <= lat) & (lat <= self.bbox[:, 1]) &
+                                                   (self.bbox[:, 2] <= long) & (long <= self.bbox[:, 3])).any(axis=1)
+        return mask
+
+    def locate(self, latitude, longitude):
+        """
+            Find the state code of each point in one bulk query
+        Args:
+            latitude (ndarray): latitude of each point (espg 4326)
+            longitude (ndarray): longitude of each point (espg 4326)
+
+        Returns:
+            (ndarray): state code of each point, None when the point is not in USA
+        """
+        latitude = np.asarray(latitude, dtype=np.float64)
+        longitude = np.asarray(longitude, dtype=np.float64)
+        codes = np.full(len(latitude), None, dtype=object)
+
+        candidates = np.flatnonzero(self.in_bbox(latitude, longitude))
+        point_idx, state_id = self.polygon_index.query_xy(longitude[candidates], latitude[candidates])
+        candidates = candidates[point_idx]
+
+        # the state bounding box from param.states_code must also contain the point, the first state (lowest id)
+        # passing both tests is kept (border points and overlapping state geometries have several candidates)
+        bbox = self.bbox[state_id]
+        lat = latitude[candidates]
+        long = longitude[candidates]
+        in_state_bbox = (bbox[:, 0] <= lat) & (lat <= bbox[:, 1]) & (bbox[:, 2] <= long) & (long <= bbox[:, 3])
+        candidates = candidates[in_state_bbox]
+        state_id = state_id[in_state_bbox]
+        first = np.unique(candidates, return_index=True)[1]
+        codes[candidates[first]] = self.state_codes[state_id[first]]
+        return codes
+
+
+def dissolve_states(states_gdf):
+    """
+        Merge the GADM geometries by state name
+    Args:
+        states_gdf (GeoDataFrame): GeoDataFrame with all US state shapefile
+
+    Returns:
+        (list(str), list(Polygon)): state names (NAME_1) and one geometry for each state
+    """
+    state_names = list(dict.fromkeys(states_gdf.NAME_1))
+    state_geometries = [states_gdf[states_gdf.NAME_1 == state_name].geometry.unary_union
+                        for state_name in state_names]
+    return state_names, state_geometries
@@ -0,0 +1,206 @@
+import json
+import os
+import re
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+from ssurgo_provider.instrumentation import count, stage
+from ssurgo_provider.object.gbd_connect import GbdConnect, GDB_MTIME_CHECK_INTERVAL, gdb_modification_time
+from ssurgo_provider.object.polygon_index import PolygonIndex, ogr_geometry_to_shapely, save_geometries, \
+    load_geometries
+
+# folder of the national survey area index, inside SSURGO_DATA
+INDEX_FOLDER_NAME = 'ssurgo_survey_areas'
+STATE_GDB_PATTERN = re.compile(r'^gSSURGO_([A-Za-z]{2})\.gdb$')
+
+_SURVEY_AREA_INDEX_CACHE = {}
+_SURVEY_AREA_INDEX_LOCK = threading.Lock()
+# modification times of the state gdb by folder, with the modification time of the folder and the time of the read
+_GDB_MTIME_CACHE = {}
+
+
+class SurveyAreaIndex:
+    def __init__(self, area_symbols, gdb_names, geometries, ssurgo_data_pth, meta=None):
+        """
+            National index of the survey areas (SAPOLYGON) of every state gdb, routing many points at once to the gdb
+            and the AREASYMBOL that contain them
+        Args:
+            area_symbols (list(str)): AREASYMBOL of each geometry
+            gdb_names (list(str)): name of the gdb folder (gSSURGO_XX.gdb) of each geometry
+            geometries (list(Polygon)): shapely survey area geometries (USA_Contiguous_Albers)
+            ssurgo_data_pth (path): folder holding the state gdb
+            meta (dict/None): content of meta.json (modification time of each gdb), see build_survey_area_index
+        """
+        self.area_symbols = np.array(area_symbols, dtype=object)
+        self.gdb_names = np.array(gdb_names, dtype=object)
+        self.ssurgo_data_pth = Path(ssurgo_data_pth)
+        self.meta = meta
+        self.polygon_index = PolygonIndex(geometries)
+
+    def __len__(self):
+        return len(self.area_symbols)
+
+    @classmethod
+    def open(cls, ssurgo_data_pth=None):
+        """
+            Return the index of the gdb folder, loaded once by process
+        Args:
+            ssurgo_data_pth (path/None): folder holding the state gdb, SSURGO_DATA if None
+
+        Returns:
+            (SurveyAreaIndex/None): the index, None if the folder is not set or does not exist, if the index is not
+                                    built or if a gdb was added, removed or modified since it was built
+        """
+        ssurgo_data_pth = os.environ.get('SSURGO_DATA') if ssurgo_data_pth is None else ssurgo_data_pth
+        if not ssurgo_data_pth or not os.path.isdir(ssurgo_data_pth):
+            return None
+        ssurgo_data_pth = Path(ssurgo_data_pth)
+        index_pth = ssurgo_data_pth / INDEX_FOLDER_NAME
+        if not (index_pth / 'meta.json').exists():
+            return None
+        with _SURVEY_AREA_INDEX_LOCK:
+            survey_area_index = _SURVEY_AREA_INDEX_CACHE.get(str(index_pth))
+            if survey_area_index is None:
+                with stage('survey_area_index_load'):
+                    survey_area_index = load_survey_area_index(index_pth, ssurgo_data_pth)
+                _SURVEY_AREA_INDEX_CACHE[str(index_pth)] = survey_area_index
+        if survey_area_index.meta['gdb_mtime'] != state_gdb_modification_times(ssurgo_data_pth):
+            return None
+        return survey_area_index
+
+    @classmethod
+    def from_gdb_folder(cls, ssurgo_data_pth):
+        """
+            Read SAPOLYGON of every state gdb of the folder, a survey area stored in several gdb is kept once
+        Args:
+            ssurgo_data_pth (path): folder holding the state gdb
+
+        Returns:
+            (SurveyAreaIndex): index over all survey areas
+        """
+        ssurgo_data_pth = Path(ssurgo_data_pth)
+        area_symbols = []
+        gdb_names = []
+        geometries = []
+        gdb_mtime = state_gdb_modification_times(ssurgo_data_pth, refresh=True)
+        for gdb_name in gdb_mtime:
+            gdb = GbdConnect(ssurgo_data_pth / gdb_name).gdb
+            layer_sa_polygon = gdb.GetLayer("SAPOLYGON")
+            for feature in layer_sa_polygon:
+                count('features_scanned')
+                geometry = feature.GetGeometryRef()
+                if geometry is None:
+                    continue
+                area_symbols.append(feature.GetField("AREASYMBOL"))
+                gdb_names.append(gdb_name)
+                geometries.append(ogr_geometry_to_shapely(geometry))
+            del gdb
+        # same survey area in several gdb (border survey areas): the gdb of the state of the AREASYMBOL is kept,
+        # otherwise the first one (alphabetical order)
+        kept = {}
+        for position, (area_symbol, gdb_name) in enumerate(zip(area_symbols, gdb_names)):
+            if area_symbol not in kept or (gdb_state_code(gdb_name) == area_symbol[:2].lower() and
+                                           gdb_state_code(gdb_names[kept[area_symbol]]) != area_symbol[:2].lower()):
+                kept[area_symbol] = position
+        keep = np.array(sorted(kept.values()), dtype=np.int64)
+        return cls(np.array(area_symbols, dtype=object)[keep], np.array(gdb_names, dtype=object)[keep],
+                   np.array(geometries, dtype=object)[keep], ssurgo_data_pth, {'gdb_mtime': gdb_mtime})
+
+    def locate(self, x, y):
+        """
+            Find the gdb and the survey area of each point in one bulk query
+        Args:
+            x (ndarray): x coordinate of each point (USA_Contiguous_Albers)
+            y (ndarray): y coordinate of each point (USA_Contiguous_Albers)
+
+        Returns:
+            (ndarray, ndarray, ndarray): state code (lower case), gdb path and AREASYMBOL of each point, None when
+                                         the point is in no survey area
+        """
+        polygon_id = self.polygon_index.locate_xy(x, y)
+        state_codes = np.full(len(polygon_id), None, dtype=object)
+        gdb_paths = np.full(len(polygon_id), None, dtype=object)
+        area_symbols = np.full(len(polygon_id), None, dtype=object)
+        found = polygon_id >= 0
+        gdb_names = self.gdb_names[polygon_id[found]]
+        state_codes[found] = [gdb_state_code(gdb_name) for gdb_name in gdb_names]
+        gdb_paths[found] = [self.ssurgo_data_pth / gdb_name for gdb_name in gdb_names]
+        area_symbols[found] = self.area_symbols[polygon_id[found]]
+        return state_codes, gdb_paths, area_symbols
+
+
+def gdb_state_code(gdb_name):
+    """
+    State code (lower case) of a state gdb folder name (gSSURGO_XX.gdb)
+    """
+    return STATE_GDB_PATTERN.match(gdb_name).group(1).lower()
+
+
+def state_gdb_modification_times(ssurgo_data_pth, refresh=False):
+    """
+    Modification time of the state gdb of a folder, read again when the folder is modified (a gdb added, removed or
+    replaced), every GDB_MTIME_CHECK_INTERVAL seconds (a gdb updated in place) or with refresh
+    Args:
+        ssurgo_data_pth (path): folder holding the state gdb
+        refresh (bool): if True list the folder and read the modification times even if the folder is not modified
+
+    Returns:
+        (dict): modification time by state gdb folder name (gSSURGO_XX.gdb) of the folder, sorted by name
+    """
+    folder_mtime = os.path.getmtime(ssurgo_data_pth)
+    with _SURVEY_AREA_INDEX_LOCK:
+        cached = _GDB_MTIME_CACHE.get(str(ssurgo_data_pth))
+    if not refresh and cached is not None and cached[0] == folder_mtime and \
+            time.monotonic() - cached[1] < GDB_MTIME_CHECK_INTERVAL:
+        return cached[2]
+    read_time = time.monotonic()
+    gdb_mtime = {gdb_name: gdb_modification_time(Path(ssurgo_data_pth) / gdb_name, refresh=True)
+                 for gdb_name in sorted(os.listdir(ssurgo_data_pth)) if STATE_GDB_PATTERN.match(gdb_name)}
+    with _SURVEY_AREA_INDEX_LOCK:
+        _GDB_MTIME_CACHE[str(ssurgo_data_pth)] = (folder_mtime, read_time, gdb_mtime)
+    return gdb_mtime
+
+
+def build_survey_area_index(ssurgo_data_pth=None):
+    """
+    One time indexing of the survey areas of every state gdb under SSURGO_DATA, to route the points without the
+    state map. To run again when a gdb is added or updated (the index is ignored until then)
+    Args:
+        ssurgo_data_pth (path/None): folder holding the state gdb, SSURGO_DATA if None
+
+    Returns:
+        (path): path to the index folder
+    """
+    ssurgo_data_pth = Path(os.environ['SSURGO_DATA'] if ssurgo_data_pth is None else ssurgo_data_pth)
+    survey_area_index = SurveyAreaIndex.from_gdb_folder(ssurgo_data_pth)
+    index_pth = ssurgo_data_pth / INDEX_FOLDER_NAME
+    index_pth.mkdir(parents=True, exist_ok=True)
+    np.save(index_pth / 'area_symbols.npy', survey_area_index.area_symbols.astype(str))
+    np.save(index_pth / 'gdb_names.npy', survey_area_index.gdb_names.astype(str))
+    save_geometries(index_pth, survey_area_index.polygon_index.geometries)
+    with open(index_pth / 'meta.json', 'w') as meta_file:
+        json.dump({'crs': "ESRI:102039", 'survey_area_nb': len(survey_area_index),
+                   'gdb_mtime': survey_area_index.meta['gdb_mtime']}, meta_file)
+
+    with _SURVEY_AREA_INDEX_LOCK:
+        _SURVEY_AREA_INDEX_CACHE.pop(str(index_pth), None)
+    return index_pth
+
+
+def load_survey_area_index(index_pth, ssurgo_data_pth):
+    """
+    Load the index written by build_survey_area_index
+    Args:
+        index_pth (path): path to the index folder
+        ssurgo_data_pth (path): folder holding the state gdb
+
+    Returns:
+        (SurveyAreaIndex): index over all survey areas
+    """
+    with open(index_pth / 'meta.json') as meta_file:
+        meta = json.load(meta_file)
+    return SurveyAreaIndex(np.load(index_pth / 'area_symbols.npy'), np.load(index_pth / 'gdb_names.npy'),
+                           load_geometries(index_pth), ssurgo_data_pth, meta)
@@ -1,3 +1,7 @@
+# point to map unit lookup: point in MUPOLYGON (exact) or pixel read in MapunitRaster_10m
+LOOKUP_MODE_VECTOR = 'vector'
+LOOKUP_MODE_RASTER = 'raster'
+
 states_code = {
     'alabama': {'code': 'al', 'lat_lim': [30.21724701, 35.00888062], 'long_lim': [-88.47203064, -84.89348602]},
     'alaska': {'code': 'ak', 'lat_lim': [51.20972061, 72.6875], 'long_lim': [-179.15055847, 179.77340698]},
@@ -0,0 +1,329 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from pathlib import Path
+
+import numpy as np
+import shapely
+from osgeo import gdal
+
+from ssurgo_provider.instrumentation import count, stage, timed_stage
+from ssurgo_provider.main import retrieve_soil_properties_from_mukey, check_depths
+from ssurgo_provider.object.mapunit_raster import MapunitRaster
+from ssurgo_provider.spatial_tools import project_zones_to_albers, geojson_to_zone
+
+# output pixel size by default (meter), rounded to a multiple of the map unit raster pixel (10 m)
+RESOLUTION = 30
+# side (output pixel) of the square tiles processed by a worker, a multiple of the GeoTIFF block size
+TILE_SIZE = 1024
+GTIFF_BLOCK_SIZE = 256
+GTIFF_OPTIONS = ['TILED=YES', f'BLOCKXSIZE={GTIFF_BLOCK_SIZE}', f'BLOCKYSIZE={GTIFF_BLOCK_SIZE}', 'COMPRESS=DEFLATE',
+                 'PREDICTOR=3', 'BIGTIFF=IF_SAFER']
+NODATA = -9999.
+# temporary GeoTIFF of the resampled MUKEY of the area (first pass), next to the output
+MU_KEY_SUFFIX = '.mukey.tif'
+MU_KEY_GTIFF_OPTIONS = [option if option != 'PREDICTOR=3' else 'PREDICTOR=2' for option in GTIFF_OPTIONS]
+# maximum number of map unit raster pixels read at once by a worker
+MAX_READ_PIXELS = 2 ** 24
+# tiles submitted and not yet written by worker, bounds the memory held by the finished tiles
+PENDING_TILES_BY_WORKER = 2
+# the bbox edges are densified before projection (the parallels are curved in USA_Contiguous_Albers)
+BBOX_SEGMENT_NB = 64
+
+# grid of the export (and mukey lookup) of the current process, set by init_tile_grid
+_TILE_GRID = {}
+
+
+@timed_stage('export_soil_property_raster')
+def export_soil_property_raster(output_pth, ssurgo_folder_path, properties, depth, bbox=None, zone=None,
+                                resolution=RESOLUTION, max_workers=None):
+    """
+    Write a GeoTIFF of depth weighted soil properties (one band by property) over a bbox or a zone of a state
+    A first pass reads the map unit raster once by tile, resampled to the output resolution (dominant map unit of each
+    output pixel), writes the tiles to a temporary mukey GeoTIFF and collects the map units of the area. Their
+    properties are computed once (see retrieve_soil_properties_from_mukey) in a mukey -> value lookup, and a second
+    pass maps each tile of the temporary GeoTIFF through it. Tiles are processed in worker processes and written as
+    soon as they are finished.
+    Args:
+        output_pth (path): GeoTIFF written (tiled, deflate compressed, float32, nodata NODATA)
+        ssurgo_folder_path (path): path to the ssurgo database at the state level
+        properties (list(str)): numeric chorizon fields, one band by field
+        depth (tuple): (top, bottom) of the depth interval (cm)
+        bbox (tuple/None): (min_lat, min_long, max_lat, max_long) of the area
+        zone (BaseGeometry/None): shapely polygon (long, lat) of the area if no bbox, pixels outside are nodata
+        resolution (float): output pixel size (meter), rounded to a multiple of the map unit raster pixel
+        max_workers (int/None): number of worker processes, 1 to process in the current process, None for one by cpu
+
+    Returns:
+        (path): path to the GeoTIFF
+    """
+    if (bbox is None) == (zone is None):
+        raise ValueError("export_soil_property_raster needs either a bbox or a zone")
+    depths = check_depths([depth])
+    if bbox is not None:
+        zone = bbox_to_zone(bbox)
+    grid = build_tile_grid(ssurgo_folder_path, project_zones_to_albers([zone])[0], resolution, bbox is None)
+    tiles = [(x_off, y_off, min(TILE_SIZE, grid['width'] - x_off), min(TILE_SIZE, grid['height'] - y_off))
+             for y_off in range(0, grid['height'], TILE_SIZE) for x_off in range(0, grid['width'], TILE_SIZE)]
+
+    grid['mu_key_pth'] = str(output_pth) + MU_KEY_SUFFIX
+    try:
+        grid['lookup_mu_keys'] = write_tile_mu_keys(grid, tiles, max_workers)
+        grid['lookup_values'] = build_mu_key_lookup(grid['lookup_mu_keys'], ssurgo_folder_path, properties, depths)
+        write_tile_values(output_pth, grid, tiles, properties, depths, max_workers)
+    finally:
+        # the dataset of the current process (max_workers 1) is closed before the temporary GeoTIFF is removed
+        _TILE_GRID.clear()
+        if os.path.exists(grid['mu_key_pth']):
+            gdal.GetDriverByName('GTiff').Delete(grid['mu_key_pth'])
+    return Path(output_pth)
+
+
+def write_tile_mu_keys(grid, tiles, max_workers=None):
+    """
+    First pass: read the map unit raster of every tile to the temporary mukey GeoTIFF of the export
+    Returns:
+        (ndarray): sorted MUKEY of the map units of the area
+    """
+    dataset = gdal.GetDriverByName('GTiff').Create(grid['mu_key_pth'], grid['width'], grid['height'], 1,
+                                                   gdal.GDT_Int32, options=MU_KEY_GTIFF_OPTIONS)
+    if dataset is None:
+        raise ValueError(f"Unable to create {grid['mu_key_pth']}")
+    band = dataset.GetRasterBand(1)
+    band.SetNoDataValue(0)
+    mu_keys = np.zeros(0, dtype=np.int64)
+    for tile, tile_mu_keys, tile_unique_mu_keys in map_tiles(collect_tile_mu_keys, tiles, grid, max_workers):
+        with stage('raster_export_write'):
+            band.WriteArray(tile_mu_keys, tile[0], tile[1])
+        mu_keys = np.union1d(mu_keys, tile_unique_mu_keys)
+    dataset.FlushCache()
+    del band, dataset
+    return mu_keys
+
+
+def write_tile_values(output_pth, grid, tiles, properties, depths, max_workers=None):
+    """
+    Second pass: map every tile of the temporary mukey GeoTIFF through the lookup and write it to the output GeoTIFF
+    """
+    dataset = gdal.GetDriverByName('GTiff').Create(str(output_pth), grid['width'], grid['height'], len(properties),
+                                                   gdal.GDT_Float32, options=GTIFF_OPTIONS)
+    if dataset is None:
+        raise ValueError(f"Unable to create {str(output_pth)}")
+    dataset.SetGeoTransform(grid['geo_transform'])
+    dataset.SetProjection(grid['projection'])
+    bands = [dataset.GetRasterBand(band_nb + 1) for band_nb in range(len(properties))]
+    for band, soil_property in zip(bands, properties):
+        band.SetNoDataValue(NODATA)
+        band.SetDescription(f'{soil_property} {depths[0, 0]:g}-{depths[0, 1]:g} cm')
+    for tile, tile_values in map_tiles(render_tile, tiles, grid, max_workers):
+        with stage('raster_export_write'):
+            for band, band_values in zip(bands, tile_values):
+                band.WriteArray(band_values, tile[0], tile[1])
+    dataset.FlushCache()
+    del bands, dataset
+
+
+def bbox_to_zone(bbox):
+    """
+    Args:
+        bbox (tuple): (min_lat, min_long, max_lat, max_long)
+
+    Returns:
+        (Polygon): shapely polygon (long, lat) of the bbox, with densified edges
+    """
+    min_lat, min_long, max_lat, max_long = bbox
+    if min_lat >= max_lat or min_long >= max_long:
+        raise ValueError("bbox should be (min_lat, min_long, max_lat, max_long)")
+    return shapely.segmentize(shapely.box(min_long, min_lat, max_long, max_lat),
+                              max(max_lat - min_lat, max_long - min_long) / BBOX_SEGMENT_NB)
+
+
+def geojson_to_export_zone(geojson):
+    """
+    Args:
+        geojson (dict): geojson Polygon or MultiPolygon, Feature or FeatureCollection (long, lat)
+
+    Returns:
+        (BaseGeometry): shapely zone (long, lat), the union of the features of a FeatureCollection
+    """
+    if geojson['type'] == 'FeatureCollection':
+        return shapely.union_all([geojson_to_zone(feature['geometry']) for feature in geojson['features']])
+    if geojson['type'] == 'Feature':
+        return geojson_to_zone(geojson['geometry'])
+    return geojson_to_zone(geojson)
+
+
+def build_tile_grid(ssurgo_folder_path, zone, resolution, mask_zone=True):
+    """
+        Output grid of the export, aligned on the map unit raster grid, each output pixel covers factor x factor
+        pixels of the map unit raster
+    Args:
+        ssurgo_folder_path (path): path to the ssurgo database at the state level
+        zone (BaseGeometry): shapely zone to cover (USA_Contiguous_Albers)
+        resolution (float): output pixel size (meter)
+        mask_zone (bool): if True the pixels whose center is outside the zone are nodata, otherwise the whole
+                          envelope of the zone is exported
+
+    Returns:
+        (dict): grid passed to the workers, see init_tile_grid
+    """
+    # opened only to read the grid, the cached raster of the main process would be inherited by the forked workers
+    raster = MapunitRaster(ssurgo_folder_path)
+    factor = max(1, int(round(resolution / abs(raster.geo_transform[1]))))
+    min_x, min_y, max_x, max_y = zone.bounds
+    col, row = raster.to_pixel([min_x, max_x], [max_y, min_y])
+    col_off = int(col[0] // factor * factor)
+    row_off = int(row[0] // factor * factor)
+    width = int((col[1] - col_off) // factor + 1)
+    height = int((row[1] - row_off) // factor + 1)
+    if col_off + width * factor <= 0 or col_off >= raster.width or row_off + height * factor <= 0 or \
+            row_off >= raster.height:
+        raise ValueError(f"the area is outside the map unit raster of {str(ssurgo_folder_path)}")
+    geo_transform = (raster.geo_transform[0] + col_off * raster.geo_transform[1], raster.geo_transform[1] * factor, 0.,
+                     raster.geo_transform[3] + row_off * raster.geo_transform[5], 0., raster.geo_transform[5] * factor)
+    return {'ssurgo_folder_path': ssurgo_folder_path, 'factor': factor, 'col_off': col_off, 'row_off': row_off,
+            'width': width, 'height': height, 'geo_transform': geo_transform,
+            'projection': raster.dataset.GetProjection(), 'zone_wkb': shapely.to_wkb(zone) if mask_zone else None}
+
+
+def build_mu_key_lookup(mu_keys, ssurgo_folder_path, properties, depths):
+    """
+    Returns:
+        (ndarray): (map unit, property) float32 values of the sorted mu_keys, NODATA when unknown
+    """
+    if len(mu_keys) == 0:
+        return np.zeros((0, len(properties)), dtype=np.float32)
+    with stage('raster_export_lookup'):
+        values = retrieve_soil_properties_from_mukey(mu_keys, ssurgo_folder_path, properties, depths)
+    lookup_values = np.column_stack([values[soil_property][:, 0] for soil_property in properties]).astype(np.float32)
+    lookup_values[np.isnan(lookup_values)] = NODATA
+    return lookup_values
+
+
+def init_tile_grid(grid):
+    """
+    Set the grid of the export in the current process (initializer of the worker processes)
+    """
+    _TILE_GRID.clear()
+    _TILE_GRID.update(grid)
+    _TILE_GRID['zone'] = None if grid['zone_wkb'] is None else shapely.from_wkb(grid['zone_wkb'])
+    if _TILE_GRID['zone'] is not None:
+        shapely.prepare(_TILE_GRID['zone'])
+
+
+def map_tiles(function, tiles, grid, max_workers=None):
+    """
+    Apply a tile function to every tile in worker processes, at most PENDING_TILES_BY_WORKER tiles by worker are
+    submitted and not yet consumed
+    Args:
+        function (function): collect_tile_mu_keys or render_tile
+        tiles (list(tuple)): (x_off, y_off, x_size, y_size) of each tile (output pixel)
+        grid (dict): grid of the export, see build_tile_grid
+        max_workers (int/None): number of worker processes, 1 to process in the current process, None for one by cpu
+
+    Returns:
+        (generator): result of each tile, in completion order
+    """
+    if max_workers == 1 or len(tiles) == 1:
+        init_tile_grid(grid)
+        yield from map(function, tiles)
+        return
+    max_workers = os.cpu_count() if max_workers is None else max_workers
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=init_tile_grid, initargs=(grid,)) as executor:
+        pending = set()
+        for tile in tiles:
+            if len(pending) >= max_workers * PENDING_TILES_BY_WORKER:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                yield from (future.result() for future in done)
+            pending.add(executor.submit(function, tile))
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            yield from (future.result() for future in done)
+
+
+def read_tile_mu_keys(tile):
+    """
+        Read the map unit raster under a tile, resampled to the output grid (most frequent MUKEY of the
+        factor x factor pixels of each output pixel), by strips of at most MAX_READ_PIXELS pixels
+    Args:
+        tile (tuple): (x_off, y_off, x_size, y_size) of the tile (output pixel)
+
+    Returns:
+        (ndarray): (row, column) MUKEY of each output pixel, 0 outside the raster or the zone and on nodata
+    """
+    x_off, y_off, x_size, y_size = tile
+    factor = _TILE_GRID['factor']
+    col_off = _TILE_GRID['col_off']
+    row_off = _TILE_GRID['row_off']
+    mu_keys = np.zeros((y_size, x_size), dtype=np.int64)
+    inside = None
+    if _TILE_GRID['zone'] is not None:
+        geo_transform = _TILE_GRID['geo_transform']
+        x = geo_transform[0] + (x_off + np.arange(x_size) + 0.5) * geo_transform[1]
+        y = geo_transform[3] + (y_off + np.arange(y_size) + 0.5) * geo_transform[5]
+        inside = shapely.contains_xy(_TILE_GRID['zone'], x[np.newaxis, :], y[:, np.newaxis])
+        if not inside.any():
+            return mu_keys
+
+    raster = MapunitRaster.get(_TILE_GRID['ssurgo_folder_path'])
+    # output pixels fully covered by the raster
+    first_col = max(x_off, -(col_off // factor))
+    last_col = min(x_off + x_size, (raster.width - col_off) // factor)
+    first_row = max(y_off, -(row_off // factor))
+    last_row = min(y_off + y_size, (raster.height - row_off) // factor)
+    if first_col >= last_col or first_row >= last_row:
+        return mu_keys
+
+    col_nb = last_col - first_col
+    rows_by_read = max(1, MAX_READ_PIXELS // (col_nb * factor * factor))
+    resample_alg = gdal.GRIORA_Mode if factor > 1 else gdal.GRIORA_NearestNeighbour
+    for row in range(first_row, last_row, rows_by_read):
+        row_nb = min(rows_by_read, last_row - row)
+        window = raster.band.ReadAsArray(col_off + first_col * factor, row_off + row * factor, col_nb * factor,
+                                         row_nb * factor, buf_xsize=col_nb, buf_ysize=row_nb,
+                                         resample_alg=resample_alg)
+        mu_keys[row - y_off:row - y_off + row_nb, first_col - x_off:last_col - x_off] = window
+        count('raster_export_pixels_read', col_nb * row_nb * factor * factor)
+
+    if raster.nodata is not None:
+        mu_keys[mu_keys == int(raster.nodata)] = 0
+    mu_keys[mu_keys < 0] = 0
+    if inside is not None:
+        mu_keys[~inside] = 0
+    return mu_keys
+
+
+def collect_tile_mu_keys(tile):
+    """
+        Read the map unit raster of a tile (first pass of the export)
+    Args:
+        tile (tuple): (x_off, y_off, x_size, y_size) of the tile (output pixel)
+
+    Returns:
+        (tuple, ndarray, ndarray): the tile, its (row, column) int32 MUKEY and the sorted MUKEY of its map units
+    """
+    mu_keys = read_tile_mu_keys(tile)
+    return tile, mu_keys.astype(np.int32), np.unique(mu_keys[mu_keys > 0])
+
+
+def render_tile(tile):
+    """
+        Map the MUKEY of each output pixel of a tile, read in the temporary mukey GeoTIFF, through the lookup of
+        the export (second pass)
+    Args:
+        tile (tuple): (x_off, y_off, x_size, y_size) of the tile (output pixel)
+
+    Returns:
+        (tuple, ndarray): the tile and its (property, row, column) float32 values, NODATA when unknown
+    """
+    if _TILE_GRID.get('mu_key_dataset') is None:
+        _TILE_GRID['mu_key_dataset'] = gdal.Open(_TILE_GRID['mu_key_pth'])
+    mu_keys = _TILE_GRID['mu_key_dataset'].GetRasterBand(1).ReadAsArray(*tile).astype(np.int64)
+    lookup_mu_keys = _TILE_GRID['lookup_mu_keys']
+    lookup_values = _TILE_GRID['lookup_values']
+    tile_values = np.full((lookup_values.shape[1],) + mu_keys.shape, NODATA, dtype=np.float32)
+    if len(lookup_mu_keys) == 0:
+        return tile, tile_values
+    position = np.minimum(np.searchsorted(lookup_mu_keys, mu_keys), len(lookup_mu_keys) - 1)
+    found = (lookup_mu_keys[position] == mu_keys) & (mu_keys > 0)
+    tile_values[:, found] = lookup_values[position[found]].T
+    return tile, tile_values
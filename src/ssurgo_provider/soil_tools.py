@@ -1,173 +1,408 @@
 from math import isnan
 
+import numpy as np
 import pandas as pd
 
-from ssurgo_provider.object.ssurgo_soil_dto import SoilHorizon, SsurgoSoilDto
+from ssurgo_provider.instrumentation import timed_stage, count
+from ssurgo_provider.object.horizon_table import HorizonTable
+from ssurgo_provider.object.point_batch import COMPONENT_NB
+from ssurgo_provider.object.polygon_index import PolygonIndex, ogr_geometry_to_shapely
+from ssurgo_provider.object.soil_cache import soil_cache, gdb_release
+from ssurgo_provider.object.ssurgo_soil_dto import SsurgoSoilDto
+from ssurgo_provider.spatial_tools import cluster_envelopes
 
+# size of the grid used to group points before reading MUPOLYGON with a spatial filter (meter)
+MU_POLYGON_CLUSTER_SIZE = 2000
+# maximum number of keys in one "IN (...)" attribute filter
+ATTRIBUTE_FILTER_CHUNK_SIZE = 500
 
-def find_soil_id_ref(pts_info_df, gdb):
+
+@timed_stage('find_soil_id_ref')
+def find_soil_id_ref(point_batch, gdb):
     """
     Find soil references related to the soil ID and the location
+    Only MUPOLYGON features whose bounding box intersects a cluster of points are read (spatial index of the layer),
+    then all points of a county are tested at once against the prepared polygons
     Args:
-        pts_info_df(DataFrame): see. find_county_id
+        point_batch (PointBatch): locations with their county_id, see. find_county_id
         gdb (DataSource): ssurgo state datasource
 
     Returns:
-        pts_info_df (DataFrame): dataframe with mu_sym mu_key spatial_ver area_symbol for each location
+        point_batch (PointBatch): the same batch with mu_sym mu_key spatial_ver area_symbol filled for each location
     """
     layer_mu_polygon = gdb.GetLayer("MUPOLYGON")
-    new_pts_info = {'mu_sym': [], 'mu_key': [], 'spatial_ver': [], 'area_symbol': []}
-    pts_info_df = pd.concat(
-        [pts_info_df, pd.DataFrame(new_pts_info, columns=['mu_sym', 'mu_key', 'spatial_ver', 'area_symbol'])])
-    unique_county_id = pts_info_df.county_id.unique()
-    for county_id in unique_county_id:
-        layer_mu_polygon.SetAttributeFilter(f"AREASYMBOL = '{county_id}'")
-        reduce_pts_info_df = pts_info_df[pts_info_df['county_id'] == county_id]
-        index_list = list(reduce_pts_info_df.index)
-        points_list = list(reduce_pts_info_df.points)
+    county_ids = point_batch.county_id
+    for county_id in pd.unique(county_ids):
+        if pd.isna(county_id):
+            continue
+        positions = np.flatnonzero(county_ids == county_id)
+        x = point_batch.x[positions]
+        y = point_batch.y[positions]
+        mu_polygons = read_mu_polygons(layer_mu_polygon, county_id, x, y)
+        if len(mu_polygons['geometries']) == 0:
+            continue
+        polygon_id = PolygonIndex(mu_polygons['geometries']).locate_xy(x, y)
+        found = polygon_id >= 0
+        positions = positions[found]
+        polygon_id = polygon_id[found]
+        point_batch.mu_sym[positions] = mu_polygons['mu_sym'][polygon_id]
+        point_batch.mu_key[positions] = mu_polygons['mu_key'][polygon_id]
+        point_batch.spatial_ver[positions] = mu_polygons['spatial_ver'][polygon_id]
+        point_batch.area_symbol[positions] = mu_polygons['area_symbol'][polygon_id]
+    return point_batch
+
+
+def read_mu_polygons(layer_mu_polygon, county_id, x, y):
+    """
+    Read the MUPOLYGON features of a county around a set of points
+    Args:
+        layer_mu_polygon (Layer): MUPOLYGON layer
+        county_id (str): AREASYMBOL of the county
+        x (ndarray): x coordinate of each point (USA_Contiguous_Albers)
+        y (ndarray): y coordinate of each point (USA_Contiguous_Albers)
 
+    Returns:
+        (dict): geometries (shapely) with their mu_sym mu_key spatial_ver area_symbol as arrays
+    """
+    features = {}
+    layer_mu_polygon.SetAttributeFilter(f"AREASYMBOL = '{county_id}'")
+    count('attribute_filter_queries')
+    for envelope in cluster_envelopes(x, y, MU_POLYGON_CLUSTER_SIZE):
+        layer_mu_polygon.SetSpatialFilterRect(*envelope)
+        count('spatial_filter_queries')
         for feature in layer_mu_polygon:
+            count('features_scanned')
+            fid = feature.GetFID()
             geometry = feature.GetGeometryRef()
-            if len(index_list) == 0:
-                break
-            for index, point in zip(index_list, points_list):
-                if point.Within(geometry):
-                    pts_info_df.mu_sym[index] = feature.GetField("MUSYM")
-                    pts_info_df.mu_key[index] = int(feature.GetField("MUKEY"))
-                    pts_info_df.spatial_ver[index] = feature.GetField("SPATIALVER")
-                    pts_info_df.area_symbol[index] = feature.GetField("AREASYMBOL")
-                    index_list.remove(index)
-                    points_list.remove(point)
+            if fid in features or geometry is None:
+                continue
+            features[fid] = (ogr_geometry_to_shapely(geometry), feature.GetField("MUSYM"),
+                             int(feature.GetField("MUKEY")), feature.GetField("SPATIALVER"),
+                             feature.GetField("AREASYMBOL"))
+    layer_mu_polygon.SetSpatialFilter(None)
+    layer_mu_polygon.SetAttributeFilter(None)
 
-    return pts_info_df
+    columns = list(zip(*features.values())) if len(features) > 0 else [()] * 5
+    return {'geometries': np.array(columns[0], dtype=object),
+            'mu_sym': np.array(columns[1], dtype=object),
+            'mu_key': np.array(columns[2], dtype=np.float64),
+            'spatial_ver': np.array(columns[3], dtype=object),
+            'area_symbol': np.array(columns[4], dtype=object)}
 
 
-def find_soil_horizon_distribution(pts_info_df, gdb):
+@timed_stage('find_soil_id_ref_from_raster')
+def find_soil_id_ref_from_raster(point_batch, gdb, mapunit_raster, soil_pack=None):
     """
-        This function is useful to determine the soil horizon distribution by percentage for each location
+    Find soil references related to the soil ID and the location with the map unit raster (one pixel read by point)
+    instead of the MUPOLYGON point in polygon search, see find_soil_id_ref
     Args:
-        pts_info_df (dataframe): with mu_sym mu_key spatial_ver area_symbol for each location (see find_soil_id_ref)
+        point_batch (PointBatch): locations with x and y (USA_Contiguous_Albers), see points_batch
         gdb (DataSource): ssurgo state datasource
+        mapunit_raster (MapunitRaster): map unit raster of the same gdb
+        soil_pack (SoilPack/None): columnar pack of the gdb, read instead of the gdb tables if not None
 
     Returns:
-            (dataframe) dataframe with co_key_1/2/3 co_key_1/2/3 for each location
+        point_batch (PointBatch): the same batch with mu_sym mu_key area_symbol filled for each location, county_id
+                                  is the area_symbol of the map unit and spatial_ver is not available (None)
+    """
+    unique_mu_keys, inverse = np.unique(mapunit_raster.read_mu_keys(point_batch.x, point_batch.y),
+                                        return_inverse=True)
+    inverse = inverse.reshape(-1)
+
+    # join the map unit table (musym, lkey) then the legend table (areasymbol)
+    mapunit_info, legend_info = read_mapunits(gdb, unique_mu_keys[unique_mu_keys > 0], soil_pack)
 
+    unique_mu_sym = np.full(len(unique_mu_keys), None, dtype=object)
+    unique_area_symbol = np.full(len(unique_mu_keys), None, dtype=object)
+    unique_mu_key = np.full(len(unique_mu_keys), np.nan)
+    for idx, mu_key in enumerate(unique_mu_keys):
+        if int(mu_key) in mapunit_info:
+            mu_sym, lkey = mapunit_info[int(mu_key)]
+            unique_mu_sym[idx] = mu_sym
+            unique_area_symbol[idx] = legend_info.get(lkey)
+            unique_mu_key[idx] = mu_key
+
+    point_batch.area_symbol[:] = unique_area_symbol[inverse]
+    point_batch.county_id[:] = point_batch.area_symbol
+    point_batch.mu_sym[:] = unique_mu_sym[inverse]
+    point_batch.mu_key[:] = unique_mu_key[inverse]
+    point_batch.spatial_ver[:] = None
+    return point_batch
+
+
+def read_mapunits(gdb, mu_keys, soil_pack=None):
     """
-    component = gdb.GetLayer("component")
+    Read the map unit (musym, lkey) and legend (areasymbol) of a set of mu_key
+    Args:
+        gdb (DataSource): ssurgo state datasource
+        mu_keys (iterable): unique mu_key
+        soil_pack (SoilPack/None): columnar pack of the gdb, read instead of the gdb tables if not None
+
+    Returns:
+        (dict, dict): (musym, lkey) by mu_key and areasymbol by lkey
+    """
+    mapunit_info = {}
+    legend_info = {}
+    if soil_pack is None:
+        for feature in iter_features_by_keys(gdb.GetLayer("mapunit"), "mukey", mu_keys):
+            mapunit_info[int(feature.GetField("mukey"))] = (feature.GetField("musym"), feature.GetField("lkey"))
+        for feature in iter_features_by_keys(gdb.GetLayer("legend"), "lkey",
+                                             set(lkey for _, lkey in mapunit_info.values())):
+            legend_info[feature.GetField("lkey")] = feature.GetField("areasymbol")
+        return mapunit_info, legend_info
+
+    positions, row_mu_keys = soil_pack.rows("mapunit", mu_keys)
+    mapunit_info = dict(zip(row_mu_keys.tolist(), zip(soil_pack.column("mapunit", "musym")[positions].tolist(),
+                                                      soil_pack.column("mapunit", "lkey")[positions].tolist())))
+    positions, row_lkeys = soil_pack.rows("legend", set(lkey for _, lkey in mapunit_info.values()))
+    legend_info = dict(zip(row_lkeys.tolist(), soil_pack.column("legend", "areasymbol")[positions].tolist()))
+    return mapunit_info, legend_info
 
-    new_pts_info = {'co_key_0': [], 'co_key_1': [], 'co_key_2': [], 'co_key_0_pct': [], 'co_key_1_pct': [],
-                    'co_key_2_pct': []}
-    pts_info_df = pd.concat([pts_info_df, pd.DataFrame(new_pts_info,
-                                                       columns=['co_key_0', 'co_key_1', 'co_key_2', 'co_key_0_pct',
-                                                                'co_key_1_pct', 'co_key_2_pct'])])
-    for mu_key in pts_info_df.mu_key.unique():
-        co_key_info = []
-        component.SetAttributeFilter(f"mukey = '{int(mu_key)}'")
-        for feature_component in component:
+
+def read_components(gdb, mu_keys, soil_pack=None, release=None):
+    """
+    Read the components (comppct_r, cokey) of a set of mu_key with one set based query for the mu_key missing in
+    the soil cache
+    Args:
+        gdb (DataSource): ssurgo state datasource
+        mu_keys (iterable): unique mu_key
+        soil_pack (SoilPack/None): columnar pack of the gdb, read instead of the gdb tables if not None
+        release (tuple/None): release of the gdb read once by the caller, see gdb_release, read here if None
+
+    Returns:
+        (dict): list of (comppct_r, co_key) by mu_key, comppct_r is -1 when unknown
+    """
+    components_by_mu_key = {}
+    if soil_pack is None:
+        release = gdb_release(gdb) if release is None else release
+        components_by_mu_key, missing_mu_keys = soil_cache.get_many(release, "component",
+                                                                    [int(mu_key) for mu_key in mu_keys])
+        missing_components = {mu_key: [] for mu_key in missing_mu_keys}
+        for feature_component in iter_features_by_keys(gdb.GetLayer("component"), "mukey", missing_mu_keys):
             comp_pct = feature_component.GetField("comppct_r")
-            co_key_info.append((comp_pct if comp_pct is not None else -1, feature_component.GetField("cokey")))
-        co_key_info.sort(reverse=True)
-        for idx in pts_info_df[pts_info_df.mu_key == mu_key].index:
-            for component_nb in range(0, 3):
-                try:
-                    if co_key_info[component_nb][0] > -1:
-                        pts_info_df[f"co_key_{component_nb}"][idx] = co_key_info[component_nb][1]
-                        pts_info_df[f"co_key_{component_nb}_pct"][idx] = co_key_info[component_nb][0]
-                    else:
-                        pts_info_df[f"co_key_{component_nb}"][idx] = None
-                        pts_info_df[f"co_key_{component_nb}_pct"][idx] = None
-                except:
-                    pts_info_df[f"co_key_{component_nb}"][idx] = None
-                    pts_info_df[f"co_key_{component_nb}_pct"][idx] = None
-    return pts_info_df
-
-
-def extract_soil_horizon_data(pts_info_df, gdb):
-    """
-        This function is useful to extract all
+            missing_components[int(feature_component.GetField("mukey"))].append(
+                (comp_pct if comp_pct is not None else -1, int(feature_component.GetField("cokey"))))
+        soil_cache.put_many(release, "component", missing_components,
+                            lambda components: 64 + 72 * len(components))
+        components_by_mu_key.update(missing_components)
+        return components_by_mu_key
+
+    positions, row_mu_keys = soil_pack.rows("component", mu_keys)
+    comp_pct = np.asarray(soil_pack.column("component", "comppct_r")[positions])
+    co_keys = soil_pack.column("component", "cokey")[positions].astype(np.int64)
+    for mu_key, comp_pct, co_key in zip(row_mu_keys.tolist(), np.where(np.isnan(comp_pct), -1, comp_pct).tolist(),
+                                        co_keys.tolist()):
+        components_by_mu_key.setdefault(mu_key, []).append((comp_pct, co_key))
+    return components_by_mu_key
+
+
+def read_horizons(gdb, co_keys):
+    """
+    Read the horizons of a set of co_key with one set based query
     Args:
-        pts_info_df (dataframe): see find_soil_horizon_distribution
         gdb (DataSource): ssurgo state datasource
+        co_keys (iterable): unique co_key
 
     Returns:
-        soil_data_dict (dict): dict with SoilHorizon for each co_key in pts_info_df
+        (generator): (co_key, horizon feature) for each horizon
     """
-    co_key_list = list(pts_info_df.co_key_0) + list(pts_info_df.co_key_1) + list(pts_info_df.co_key_2)
-    co_key_list_filtered = set([int(co_key) for co_key in co_key_list if not isnan(co_key)])
-    c_horizon_polygon = gdb.GetLayer("chorizon")
-    soil_data_dict = dict()
-    for co_key in co_key_list_filtered:
-        feature_nb = c_horizon_polygon.SetAttributeFilter(f"cokey = '{co_key}'")
-        if feature_nb == 0:
-            soil_data_dict[str(co_key)] = None
-        for feature_horizon in c_horizon_polygon:
-            soil_data_dict[str(co_key)] = SoilHorizon(None, feature_horizon)
+    for feature_horizon in iter_features_by_keys(gdb.GetLayer("chorizon"), "cokey", co_keys):
+        yield int(feature_horizon.GetField("cokey")), feature_horizon
 
-    return soil_data_dict
 
+def iter_features_by_keys(layer, key_field, keys, chunk_size=ATTRIBUTE_FILTER_CHUNK_SIZE):
+    """
+    Iterate over the features of a table whose key is in keys, with one "IN (...)" attribute filter by chunk of keys
+    Args:
+        layer (Layer): gdb table
+        key_field (str): name of the key field
+        keys (iterable): keys to find
+        chunk_size (int): maximum number of keys by attribute filter
 
-def build_soil_composition(pts_info_df, soil_data_dict):
+    Returns:
+        (generator): features of the table with their key in keys
+    """
+    keys = sorted(set(str(int(key)) if isinstance(key, (float, np.floating, np.integer)) else str(key)
+                      for key in keys))
+    for start in range(0, len(keys), chunk_size):
+        key_list = ", ".join(f"'{key}'" for key in keys[start:start + chunk_size])
+        layer.SetAttributeFilter(f"{key_field} IN ({key_list})")
+        count('attribute_filter_queries')
+        for feature in layer:
+            count('features_scanned')
+            yield feature
+    layer.SetAttributeFilter(None)
+
+
+@timed_stage('find_soil_horizon_distribution')
+def find_soil_horizon_distribution(point_batch, gdb, soil_pack=None, release=None):
+    """
+        This function is useful to determine the soil horizon distribution by percentage for each location
+        The component table is read with one set based query for all the mu_key of point_batch
+    Args:
+        point_batch (PointBatch): locations with their mu_key (see find_soil_id_ref)
+        gdb (DataSource): ssurgo state datasource
+        soil_pack (SoilPack/None): columnar pack of the gdb, read instead of the gdb tables if not None
+        release (tuple/None): release of the gdb read once by the caller, see gdb_release, read here if None
+
+    Returns:
+            point_batch (PointBatch): the same batch with co_keys and co_keys_pct (three main components) filled for
+                                      each location
+
+    """
+    unique_mu_keys, inverse = np.unique(point_batch.mu_key, return_inverse=True)
+    inverse = inverse.reshape(-1)
+
+    components_by_mu_key = read_components(gdb, unique_mu_keys[~np.isnan(unique_mu_keys)].astype(np.int64), soil_pack,
+                                           release)
+
+    # three main components of each unique mu_key, then broadcast to the locations
+    unique_co_keys = np.full((len(unique_mu_keys), COMPONENT_NB), np.nan)
+    unique_co_keys_pct = np.full((len(unique_mu_keys), COMPONENT_NB), np.nan)
+    for idx, mu_key in enumerate(unique_mu_keys):
+        if np.isnan(mu_key):
+            continue
+        co_key_info = sorted(components_by_mu_key.get(int(mu_key), []), reverse=True)[:COMPONENT_NB]
+        for component_nb, (comp_pct, co_key) in enumerate(co_key_info):
+            if comp_pct > -1:
+                unique_co_keys[idx, component_nb] = co_key
+                unique_co_keys_pct[idx, component_nb] = comp_pct
+
+    point_batch.co_keys[:] = unique_co_keys[inverse]
+    point_batch.co_keys_pct[:] = unique_co_keys_pct[inverse]
+    return point_batch
+
+
+@timed_stage('extract_soil_horizon_data')
+def extract_soil_horizon_data(point_batch, gdb, soil_pack=None, release=None):
+    """
+        This function is useful to extract all horizon data of the co_key in point_batch
+        The chorizon table is read with one set based query for all the co_key missing in the soil cache
+    Args:
+        point_batch (PointBatch): see find_soil_horizon_distribution
+        gdb (DataSource): ssurgo state datasource
+        soil_pack (SoilPack/None): columnar pack of the gdb, read instead of the gdb tables if not None
+        release (tuple/None): release of the gdb read once by the caller, see gdb_release, read here if None
+
+    Returns:
+        horizon_table (HorizonTable): every horizon of each co_key in point_batch
+    """
+    if soil_pack is not None:
+        return HorizonTable.from_soil_pack(soil_pack)
+    co_keys = np.unique(point_batch.co_keys)
+    co_key_list_filtered = set(co_keys[~np.isnan(co_keys)].astype(np.int64).tolist())
+
+    release = gdb_release(gdb) if release is None else release
+    cached_tables, missing_co_keys = soil_cache.get_many(release, "horizon", co_key_list_filtered)
+    missing_table = HorizonTable.from_features(read_horizons(gdb, missing_co_keys))
+    missing_tables = missing_table.split()
+    # components without horizon are cached too, as empty tables
+    missing_tables.update({co_key: HorizonTable.concat([]) for co_key in missing_co_keys
+                           if co_key not in missing_tables})
+    soil_cache.put_many(release, "horizon", missing_tables, HorizonTable.nbytes)
+    return HorizonTable.concat(list(cached_tables.values()) + [missing_table])
+
+
+@timed_stage('build_soil_composition')
+def build_soil_composition(point_batch, horizon_table):
     """
         This function is useful to build list of SsurgoSoilDto for each location
     Args:
-        pts_info_df (dataframe): see extract_soil_horizon_data
-        soil_data_dict (dict): dict with SoilHorizon for each co_key in pts_info_df
+        point_batch (PointBatch): see extract_soil_horizon_data
+        horizon_table (HorizonTable): every horizon of each co_key in point_batch
 
     Returns:
-        soil_composition_list (list): list of SsurgoSoilDto, one for each location in pts_info_df
+        soil_composition_list (list): list of SsurgoSoilDto, one for each location in point_batch
     """
     soil_composition_list = []
-    for _, pt_info in pts_info_df.iterrows():
-        ssurgo_soil_dto = SsurgoSoilDto(pt_info.points.GetX(), pt_info.points.GetY())
-        if not isnan(pt_info.co_key_0):
-            soil_horizon = soil_data_dict[str(int(pt_info.co_key_0))]
-            if soil_horizon is not None:
-                soil_horizon.comppct_r = pt_info.co_key_0_pct
-            ssurgo_soil_dto.horizon_0 = soil_horizon
-        if not isnan(pt_info.co_key_1):
-            soil_horizon = soil_data_dict[str(int(pt_info.co_key_1))]
-            if soil_horizon is not None:
-                soil_horizon.comppct_r = pt_info.co_key_1_pct
-            ssurgo_soil_dto.horizon_1 = soil_horizon
-        if not isnan(pt_info.co_key_2):
-            soil_horizon = soil_data_dict[str(int(pt_info.co_key_2))]
-            if soil_horizon is not None:
-                soil_horizon.comppct_r = pt_info.co_key_2_pct
-            ssurgo_soil_dto.horizon_2 = soil_horizon
+    for latitude, longitude, profiles in zip(point_batch.latitude.tolist(), point_batch.longitude.tolist(),
+                                             iter_profiles(point_batch, horizon_table)):
+        ssurgo_soil_dto = SsurgoSoilDto(latitude, longitude)
+        for component_nb, profile in profiles:
+            setattr(ssurgo_soil_dto, f"horizon_{component_nb}", profile[0] if len(profile) > 0 else None)
+            setattr(ssurgo_soil_dto, f"profile_{component_nb}", list(profile))
         soil_composition_list.append(ssurgo_soil_dto)
     return soil_composition_list
 
 
-def build_soil_composition_without_point(pts_info_df, soil_data_dict):
+@timed_stage('build_soil_composition_without_point')
+def build_soil_composition_without_point(point_batch, horizon_table):
     """
         This function is useful to build list of SsurgoSoilDto for each location
     Args:
-        pts_info_df (dataframe): see extract_soil_horizon_data
-        soil_data_dict (dict): dict with SoilHorizon for each co_key in pts_info_df
+        point_batch (PointBatch): see extract_soil_horizon_data
+        horizon_table (HorizonTable): every horizon of each co_key in point_batch
 
     Returns:
-        soil_composition_list (list): list of SsurgoSoilDto, one for each location in pts_info_df
+        soil_composition_list (list): list of SsurgoSoilDto, one for each location in point_batch
     """
     soil_composition_list = []
-    for _, pt_info in pts_info_df.iterrows():
-        ssurgo_soil_dto = {'mu_key': pt_info.mu_key,
+    for mu_key, profiles in zip(point_batch.mu_key.tolist(), iter_profiles(point_batch, horizon_table)):
+        ssurgo_soil_dto = {'mu_key': mu_key,
                            'horizon_0': None,
                            'horizon_1': None,
-                           'horizon_2': None}
-        if not isnan(pt_info.co_key_0):
-            soil_horizon = soil_data_dict[str(int(pt_info.co_key_0))]
-            if soil_horizon is not None:
-                soil_horizon.comppct_r = pt_info.co_key_0_pct
-            ssurgo_soil_dto['horizon_0'] = soil_horizon
-        if not isnan(pt_info.co_key_1):
-            soil_horizon = soil_data_dict[str(int(pt_info.co_key_1))]
-            if soil_horizon is not None:
-                soil_horizon.comppct_r = pt_info.co_key_1_pct
-            ssurgo_soil_dto['horizon_1'] = soil_horizon
-        if not isnan(pt_info.co_key_2):
-            soil_horizon = soil_data_dict[str(int(pt_info.co_key_2))]
-            if soil_horizon is not None:
-                soil_horizon.comppct_r = pt_info.co_key_2_pct
-            ssurgo_soil_dto['horizon_2'] = soil_horizon
+                           'horizon_2': None,
+                           'profile_0': [],
+                           'profile_1': [],
+                           'profile_2': []}
+        for component_nb, profile in profiles:
+            ssurgo_soil_dto[f"horizon_{component_nb}"] = profile[0] if len(profile) > 0 else None
+            ssurgo_soil_dto[f"profile_{component_nb}"] = list(profile)
         soil_composition_list.append(ssurgo_soil_dto)
     return soil_composition_list
+
+
+def iter_profiles(point_batch, horizon_table):
+    """
+        Horizon profiles of the main components of each location, the co_key columns are read as python lists once
+        and the profile of a (co_key, percentage) shared by many locations is built once
+    Args:
+        point_batch (PointBatch): see extract_soil_horizon_data
+        horizon_table (HorizonTable): every horizon of each co_key in point_batch
+
+    Returns:
+        (generator): for each location, the list of (component_nb, profile) of its known components
+    """
+    profiles = {}
+    for co_keys, co_keys_pct in zip(point_batch.co_keys.tolist(), point_batch.co_keys_pct.tolist()):
+        location_profiles = []
+        for component_nb, (co_key, co_key_pct) in enumerate(zip(co_keys, co_keys_pct)):
+            if isnan(co_key):
+                continue
+            if (co_key, co_key_pct) not in profiles:
+                profiles[(co_key, co_key_pct)] = horizon_table.profile(int(co_key), co_key_pct)
+            location_profiles.append((component_nb, profiles[(co_key, co_key_pct)]))
+        yield location_profiles
+
+
+@timed_stage('aggregate_soil_properties')
+def aggregate_soil_properties(point_batch, horizon_table, properties, depths):
+    """
+        Depth weighted soil properties of each location: horizons are weighted by their thickness inside each depth
+        interval (see HorizonTable.depth_weighted), then the main components by their comppct_r. Every location,
+        property and depth is computed with array operations, once by unique component
+    Args:
+        point_batch (PointBatch): see find_soil_horizon_distribution
+        horizon_table (HorizonTable): every horizon of each co_key in point_batch
+        properties (list(str)): numeric chorizon fields (claytotal_r, om_r, awc_r, ksat_r, ...)
+        depths (list(tuple)): (top, bottom) of each depth interval (cm), e.g. [(0, 30), (30, 100)]
+
+    Returns:
+        (dict): ndarray (location, depth interval) by property, nan when no component of the location has a value
+    """
+    co_keys = point_batch.co_keys
+    known = ~np.isnan(co_keys)
+    unique_co_keys, inverse = np.unique(co_keys[known].astype(np.int64), return_inverse=True)
+    # position of each component in unique_co_keys, the last row (nan values) for missing components
+    component_idx = np.full(co_keys.shape, len(unique_co_keys), dtype=np.int64)
+    component_idx[known] = inverse.reshape(-1)
+
+    component_values = horizon_table.depth_weighted(unique_co_keys, properties, depths)
+    component_values = np.concatenate([component_values, np.full((1,) + component_values.shape[1:], np.nan)])
+    # (location, component, property, depth)
+    values = component_values[component_idx]
+    weights = np.where(np.isnan(values), 0., np.nan_to_num(point_batch.co_keys_pct)[:, :, None, None])
+    comp_pct_total = weights.sum(axis=1)
+    location_values = np.divide((weights * np.nan_to_num(values)).sum(axis=1), comp_pct_total,
+                                out=np.full(comp_pct_total.shape, np.nan), where=comp_pct_total > 0)
+    return {soil_property: location_values[:, property_idx, :] for property_idx, soil_property in enumerate(properties)}
@@ -1,35 +1,75 @@
+import threading
+
+import numpy as np
 import osgeo
-import pandas as pd
+import shapely
 from osgeo import osr, ogr
-from shapely.geometry import Polygon, Point
+from shapely.geometry import Polygon, shape
 
-from ssurgo_provider.object.gbd_connect import GbdConnect
+from ssurgo_provider.instrumentation import timed_stage, count
+from ssurgo_provider.object.county_locator import CountyLocator
+from ssurgo_provider.object.gdb_pool import gdb_pool
 from ssurgo_provider.object.map_load import OpenMap
+from ssurgo_provider.object.mapunit_raster import MapunitRaster
+from ssurgo_provider.object.point_batch import PointBatch
+from ssurgo_provider.object.polygon_index import PolygonIndex, ogr_geometry_to_shapely
 from ssurgo_provider.object.state_info import StateInfo, StateInfoStatus
-from ssurgo_provider.param import states_code
+from ssurgo_provider.object.state_locator import StateLocator
+from ssurgo_provider.param import LOOKUP_MODE_VECTOR, LOOKUP_MODE_RASTER
+
+# projection of the ssurgo gdb (USA_Contiguous_Albers)
+ALBERS_WKT = 'PROJCS["USA_Contiguous_Albers_Equal_Area_Conic_USGS_version",' \
+             'GEOGCS["GCS_North_American_1983",DATUM["D_North_American_1983",' \
+             'SPHEROID["GRS_1980",6378137.0,298.257222101]],PRIMEM["Greenwich",0.0],' \
+             'UNIT["Degree",0.0174532925199433]],PROJECTION["Albers"],' \
+             'PARAMETER["False_Easting",0.0],PARAMETER["False_Northing",0.0],' \
+             'PARAMETER["Central_Meridian",-96.0],PARAMETER["Standard_Parallel_1",29.5],' \
+             'PARAMETER["Standard_Parallel_2",45.5],PARAMETER["Latitude_Of_Origin",23.0],' \
+             'UNIT["Meter",1.0],AUTHORITY["ESRI","102039"]]'
+# size of the grid used to group zones before reading MUPOLYGON with a spatial filter (meter)
+ZONE_CLUSTER_SIZE = 20000
+
+_TRANSFORM_CACHE = threading.local()
 
 
 def transform_wgs84_to_albers():
     """
     Function return object able to transform py-gdalogr object from wgs84 projection to USA_Contiguous_Albers
+    The transformation is built once by thread (osr transformations must not be shared between threads)
     Returns:
         (ogr): object able to transform py-gdalogr object from wgs84 projection to USA_Contiguous_Albers
 
     """
+    if not hasattr(_TRANSFORM_CACHE, 'transform'):
+        _TRANSFORM_CACHE.transform = create_transform_wgs84_to_albers()
+    return _TRANSFORM_CACHE.transform
+
+
+def create_transform_wgs84_to_albers():
     target = osr.SpatialReference()
-    target.ImportFromWkt('PROJCS["USA_Contiguous_Albers_Equal_Area_Conic_USGS_version",'
-                         'GEOGCS["GCS_North_American_1983",DATUM["D_North_American_1983",'
-                         'SPHEROID["GRS_1980",6378137.0,298.257222101]],PRIMEM["Greenwich",0.0],'
-                         'UNIT["Degree",0.0174532925199433]],PROJECTION["Albers"],'
-                         'PARAMETER["False_Easting",0.0],PARAMETER["False_Northing",0.0],'
-                         'PARAMETER["Central_Meridian",-96.0],PARAMETER["Standard_Parallel_1",29.5],'
-                         'PARAMETER["Standard_Parallel_2",45.5],PARAMETER["Latitude_Of_Origin",23.0],'
-                         'UNIT["Meter",1.0],AUTHORITY["ESRI","102039"]]')
+    target.ImportFromWkt(ALBERS_WKT)
     source = osr.SpatialReference()
     source.ImportFromEPSG(4326)
     return osr.CoordinateTransformation(source, target)
 
 
+def project_to_albers(latitude, longitude):
+    """
+    Project arrays of wgs84 coordinates to USA_Contiguous_Albers in one call
+    Args:
+        latitude (ndarray): latitude of each point
+        longitude (ndarray): longitude of each point
+
+    Returns:
+        (ndarray, ndarray): x and y coordinate of each point (USA_Contiguous_Albers)
+    """
+    coordinates = np.column_stack((np.asarray(latitude, dtype=np.float64), np.asarray(longitude, dtype=np.float64)))
+    if len(coordinates) == 0:
+        return np.zeros(0), np.zeros(0)
+    projected = np.asarray(transform_wgs84_to_albers().TransformPoints(coordinates), dtype=np.float64)
+    return projected[:, 0], projected[:, 1]
+
+
 def convert_geojson_to_polygon(geojson):
     """
     Convert geoJson to an ogr Polygon
@@ -47,12 +87,17 @@ def convert_geojson_to_polygon(geojson):
     return polygon
 
 
-def retrieve_mu_key_from_raster_by_zone(polygon, ssurgo_folder_path):
+@timed_stage('retrieve_mu_key_from_raster_by_zone')
+def retrieve_mu_key_from_raster_by_zone(polygon, ssurgo_folder_path, lookup_mode=LOOKUP_MODE_VECTOR, all_touched=False):
     """
     This function retrieve all mukey in the geojson
     Args:
         polygon (Polygon): polygon represent the area where mu_key should be find
-        ssurgo_folder_path (path):
+        ssurgo_folder_path (path): path to the ssurgo database at the state level
+        lookup_mode (str): LOOKUP_MODE_VECTOR (exact areas of the intersections with MUPOLYGON) or LOOKUP_MODE_RASTER
+                           (pixel count of MapunitRaster_10m inside the zone, much faster on large zones)
+        all_touched (bool): raster mode only, if True count every pixel touched by the zone, otherwise only the pixels
+                            whose center is inside the zone
 
     Returns:
         (dict): dict of mu_key inside the geojson area with their area percentage
@@ -60,103 +105,303 @@ def retrieve_mu_key_from_raster_by_zone(polygon, ssurgo_folder_path):
 
     transform = transform_wgs84_to_albers()
 
-    # open connection to geo database
-    gdb_connection = GbdConnect(ssurgo_folder_path)
-    gdb = gdb_connection.gdb
+    polygon = polygon.Clone()
+    polygon.Transform(transform)
 
-    layer_mu_polygon = gdb.GetLayer("MUPOLYGON")
+    if lookup_mode == LOOKUP_MODE_RASTER:
+        mu_keys, areas = MapunitRaster.get(ssurgo_folder_path).read_zone_mu_keys(polygon, all_touched)
+        response = dict(zip(mu_keys.tolist(), areas.tolist()))
+    elif lookup_mode == LOOKUP_MODE_VECTOR:
+        response = read_zone_mu_keys(polygon, ssurgo_folder_path)
+    else:
+        raise ValueError(f"unknown lookup mode {lookup_mode}, use {LOOKUP_MODE_VECTOR} or {LOOKUP_MODE_RASTER}")
+    return mu_key_area_to_percentage(response)
 
-    polygon.Transform(transform)
-    layer_mu_polygon.SetSpatialFilter(polygon)
 
-    response = {}
-    for feature in layer_mu_polygon:
-        geometry = feature.GetGeometryRef()
-        inter = polygon.Intersection(geometry)
-        if inter is not None and inter is not inter.IsEmpty():
-            mu_key = int(feature.GetField("MUKEY"))
-            if mu_key not in response.keys():
-                response[mu_key] = inter.GetArea()
-            else:
-                response[mu_key] += inter.GetArea()
+def mu_key_area_to_percentage(response):
+    """
+    Convert the area of each mu_key of a zone to its percentage of the zone area
+    """
     total_area = sum(response.values())
     for mu_key in response.keys():
         response[mu_key] = round(response[mu_key] / total_area * 100, 2)
     return response
 
 
+def read_zone_mu_keys(polygon, ssurgo_folder_path):
+    """
+    Exact area of each map unit inside a zone, from the intersection of the zone with MUPOLYGON
+    Args:
+        polygon (Polygon): ogr polygon of the zone (USA_Contiguous_Albers)
+        ssurgo_folder_path (path): path to the ssurgo database at the state level
+
+    Returns:
+        (dict): area (square meter) of each mu_key inside the zone
+    """
+    # take a connection to geo database from the pool
+    response = {}
+    with gdb_pool.connection(ssurgo_folder_path) as gdb_connection:
+        layer_mu_polygon = gdb_connection.gdb.GetLayer("MUPOLYGON")
+        layer_mu_polygon.SetSpatialFilter(polygon)
+        count('spatial_filter_queries')
+        for feature in layer_mu_polygon:
+            count('features_scanned')
+            count('geometry_predicates')
+            geometry = feature.GetGeometryRef()
+            inter = polygon.Intersection(geometry)
+            if inter is not None and not inter.IsEmpty():
+                mu_key = int(feature.GetField("MUKEY"))
+                response[mu_key] = response.get(mu_key, 0.) + inter.GetArea()
+        layer_mu_polygon.SetSpatialFilter(None)
+    return response
+
+
+def geojson_to_zone(geometry):
+    """
+    Convert a geojson geometry to a shapely zone
+    Args:
+        geometry (dict): geojson Polygon or MultiPolygon with coordinates as (long, lat), a Polygon can also be a single
+                         ring as in convert_geojson_to_polygon
+
+    Returns:
+        (BaseGeometry): valid shapely geometry (long, lat)
+    """
+    if geometry['type'].lower() not in ("polygon", "multipolygon"):
+        raise ValueError("Geojson should be of type polygon or multipolygon only")
+    if geometry['type'].lower() == "polygon" and len(geometry['coordinates']) > 0 and \
+            np.ndim(geometry['coordinates'][0]) == 1:
+        geometry = {'type': 'Polygon', 'coordinates': [geometry['coordinates']]}
+    zone = shape({'type': 'Polygon' if geometry['type'].lower() == "polygon" else 'MultiPolygon',
+                  'coordinates': geometry['coordinates']})
+    return zone if zone.is_valid else shapely.make_valid(zone)
+
+
+def project_zones_to_albers(zones):
+    """
+    Project shapely zones (long, lat) to USA_Contiguous_Albers, every vertex of every zone in one call
+    Args:
+        zones (list(BaseGeometry)): shapely geometries (long, lat)
+
+    Returns:
+        (ndarray): shapely geometries (USA_Contiguous_Albers)
+    """
+    def project(coordinates):
+        x, y = project_to_albers(coordinates[:, 1], coordinates[:, 0])
+        return np.column_stack((x, y))
+
+    return shapely.transform(np.asarray(zones, dtype=object), project)
+
+
+@timed_stage('retrieve_zones_mu_keys')
+def retrieve_zones_mu_keys(zones, ssurgo_folder_path, lookup_mode=LOOKUP_MODE_VECTOR, all_touched=False):
+    """
+    Retrieve the mu_key percentage of many zones of the same state, see retrieve_mu_key_from_raster_by_zone
+    Args:
+        zones (list(BaseGeometry)): shapely zones (USA_Contiguous_Albers)
+        ssurgo_folder_path (path): path to the ssurgo database at the state level
+        lookup_mode (str): LOOKUP_MODE_VECTOR (exact, one MUPOLYGON scan for all zones) or LOOKUP_MODE_RASTER
+        all_touched (bool): raster mode only, see MapunitRaster.read_zone_mu_keys
+
+    Returns:
+        (list(dict)): dict of mu_key inside each zone with their area percentage, in the same order as zones
+    """
+    if lookup_mode == LOOKUP_MODE_RASTER:
+        mapunit_raster = MapunitRaster.get(ssurgo_folder_path)
+        responses = []
+        for zone in zones:
+            mu_keys, areas = mapunit_raster.read_zone_mu_keys(ogr.CreateGeometryFromWkb(shapely.to_wkb(zone)),
+                                                              all_touched)
+            responses.append(dict(zip(mu_keys.tolist(), areas.tolist())))
+    elif lookup_mode == LOOKUP_MODE_VECTOR:
+        with gdb_pool.connection(ssurgo_folder_path) as gdb_connection:
+            responses = read_zones_mu_keys(zones, gdb_connection.gdb)
+    else:
+        raise ValueError(f"unknown lookup mode {lookup_mode}, use {LOOKUP_MODE_VECTOR} or {LOOKUP_MODE_RASTER}")
+    return [mu_key_area_to_percentage(response) for response in responses]
+
+
+def read_zones_mu_keys(zones, gdb):
+    """
+    Exact area of each map unit inside many zones. The zones are indexed in one STRtree and MUPOLYGON is read once,
+    on the envelope of each group of close zones, every feature being intersected with the zones it touches only
+    Args:
+        zones (list(BaseGeometry)): shapely zones (USA_Contiguous_Albers)
+        gdb (DataSource): ssurgo state datasource
+
+    Returns:
+        (list(dict)): area (square meter) of each mu_key inside each zone, in the same order as zones
+    """
+    responses = [{} for _ in zones]
+    if len(zones) == 0:
+        return responses
+    zone_index = PolygonIndex(zones)
+    bounds = shapely.bounds(zone_index.geometries)
+    center_x = (bounds[:, 0] + bounds[:, 2]) / 2
+    center_y = (bounds[:, 1] + bounds[:, 3]) / 2
+    cells = np.column_stack((np.floor(center_x / ZONE_CLUSTER_SIZE), np.floor(center_y / ZONE_CLUSTER_SIZE)))
+    cluster_id = np.unique(cells, axis=0, return_inverse=True)[1].reshape(-1)
+
+    layer_mu_polygon = gdb.GetLayer("MUPOLYGON")
+    read_fids = set()
+    for cluster in np.unique(cluster_id):
+        cluster_bounds = bounds[cluster_id == cluster]
+        layer_mu_polygon.SetSpatialFilterRect(cluster_bounds[:, 0].min(), cluster_bounds[:, 1].min(),
+                                              cluster_bounds[:, 2].max(), cluster_bounds[:, 3].max())
+        count('spatial_filter_queries')
+        for feature in layer_mu_polygon:
+            count('features_scanned')
+            geometry = feature.GetGeometryRef()
+            if feature.GetFID() in read_fids or geometry is None:
+                continue
+            read_fids.add(feature.GetFID())
+            mu_polygon = ogr_geometry_to_shapely(geometry)
+            if not mu_polygon.is_valid:
+                mu_polygon = shapely.make_valid(mu_polygon)
+            zone_ids, areas = zone_index.intersection_areas(mu_polygon)
+            if len(zone_ids) == 0:
+                continue
+            mu_key = int(feature.GetField("MUKEY"))
+            for zone_id, area in zip(zone_ids.tolist(), areas.tolist()):
+                responses[zone_id][mu_key] = responses[zone_id].get(mu_key, 0.) + area
+    layer_mu_polygon.SetSpatialFilter(None)
+    return responses
+
+
+def points_to_lat_long(points):
+    """
+    Convert a list of points to latitude and longitude arrays
+    Args:
+        points (list(Point)): list of Point(lat, long), shapely or ogr
+
+    Returns:
+        (ndarray, ndarray): latitude and longitude of each point
+    """
+    coordinates = np.array([(point.GetX(), point.GetY()) if isinstance(point, osgeo.ogr.Geometry) else
+                            (point.x, point.y) for point in points], dtype=np.float64).reshape(-1, 2)
+    return coordinates[:, 0], coordinates[:, 1]
+
+
+def cluster_envelopes(x, y, cluster_size, margin=1.):
+    """
+    Group points in clusters on a regular grid and return the envelope of each cluster
+    Args:
+        x (ndarray): x coordinate of each point
+        y (ndarray): y coordinate of each point
+        cluster_size (float): size of the grid cell used to group the points (same unit as x and y)
+        margin (float): margin added around each envelope
+
+    Returns:
+        (list(tuple)): (min_x, min_y, max_x, max_y) of each cluster
+    """
+    if len(x) == 0:
+        return []
+    cells = np.column_stack((np.floor(x / cluster_size), np.floor(y / cluster_size)))
+    cells, cluster_id = np.unique(cells, axis=0, return_inverse=True)
+    cluster_id = cluster_id.reshape(-1)
+    min_x = np.full(len(cells), np.inf)
+    min_y = np.full(len(cells), np.inf)
+    max_x = np.full(len(cells), -np.inf)
+    max_y = np.full(len(cells), -np.inf)
+    np.minimum.at(min_x, cluster_id, x)
+    np.minimum.at(min_y, cluster_id, y)
+    np.maximum.at(max_x, cluster_id, x)
+    np.maximum.at(max_y, cluster_id, y)
+    return list(zip((min_x - margin).tolist(), (min_y - margin).tolist(), (max_x + margin).tolist(),
+                    (max_y + margin).tolist()))
+
+
+@timed_stage('retrieve_state_code')
 def retrieve_state_code(points, states_gdf=None, disable_location_error=True):
     """
     Find US state code for the point (lat, long)
     Args:
         points (list(Point)): list of Point(lat, long)
-        states_gdf (GeoDataFrame/None): GeoDataFrame with all US state shapefile
+        states_gdf (GeoDataFrame/OpenMap/None): GeoDataFrame with all US state shapefile, or an already opened OpenMap
         disable_location_error (bool): if false display error and stop process if one point is out of USA
     Returns:
-        (list(StateInfo)): list of state_info with US code and update status
+        (list(StateInfo)): list of state_info with US code and update status, in the same order as points
     """
-    states_info_list = []
     if states_gdf is None:
-        open_map = OpenMap()
-        states_gdf = open_map.states_gdf
-
-    for state_name in states_gdf.NAME_1:
-        state_code = states_code[state_name.lower().replace(" ", "_")]
-        lat_lim = state_code['lat_lim']
-        long_lim = state_code['long_lim']
-        geom = None
-        for point in points:
-            if isinstance(point, osgeo.ogr.Geometry):
-                point_shp = Point(point.GetY(), point.GetX())
-            else:
-                point_shp = Point(point.y, point.x)
-            if lat_lim[0] <= point_shp.y <= lat_lim[1] and long_lim[0] <= point_shp.x <= long_lim[1]:
-                if geom is None:
-                    geom = states_gdf[states_gdf.NAME_1 == state_name].geometry.unary_union
-                if geom.contains(point_shp):
-                    points.remove(point)
-                    states_info_list.append(
-                        StateInfo(state_code=state_code["code"], points=point,
-                                  status=StateInfoStatus.IN_PROGRESS))
-        if len(points) == 0:
-            return states_info_list
-
-    [states_info_list.append(StateInfo(state_code=None, points=point, status=StateInfoStatus.NOT_IN_USA)) for point in
-     points]
-    if not disable_location_error:
+        states_gdf = OpenMap()
+    if isinstance(states_gdf, OpenMap):
+        state_locator = states_gdf.state_locator
+    else:
+        state_locator = StateLocator.from_gdf(states_gdf)
+
+    latitude, longitude = points_to_lat_long(points)
+    state_codes = state_locator.locate(latitude, longitude)
+
+    states_info_list = []
+    for point, state_code in zip(points, state_codes):
+        if state_code is None:
+            states_info_list.append(StateInfo(state_code=None, points=point, status=StateInfoStatus.NOT_IN_USA))
+        else:
+            states_info_list.append(StateInfo(state_code=state_code, points=point, status=StateInfoStatus.IN_PROGRESS))
+
+    if not disable_location_error and any(state_code is None for state_code in state_codes):
         raise ValueError(f'point is not in USA, please select a point in USA')
-    if not states_gdf.is_permanent:
-        del states_gdf
     return states_info_list
 
 
-def find_county_id(points, gdb):
+@timed_stage('retrieve_survey_area')
+def retrieve_survey_area(points, survey_area_index, disable_location_error=True):
+    """
+    Route each point straight to its state gdb and survey area with the national survey area index, in one bulk
+    query (no state map, no listing of SSURGO_DATA and no SAPOLYGON read of the state gdb)
+    Args:
+        points (list(Point)): list of Point(lat, long)
+        survey_area_index (SurveyAreaIndex): national index, see SurveyAreaIndex.open
+        disable_location_error (bool): if false stop process with an exception if one point is in no survey area
+
+    Returns:
+        (list(StateInfo)): list of state_info with US code, gdb path (state_folder_pth), area_symbol and status, in
+                           the same order as points
+    """
+    latitude, longitude = points_to_lat_long(points)
+    state_codes, gdb_paths, area_symbols = survey_area_index.locate(*project_to_albers(latitude, longitude))
+
+    states_info_list = []
+    for point, state_code, gdb_path, area_symbol in zip(points, state_codes, gdb_paths, area_symbols):
+        if state_code is None:
+            states_info_list.append(StateInfo(state_code=None, points=point, status=StateInfoStatus.NOT_IN_USA))
+        else:
+            state_info = StateInfo(state_code=state_code, points=point, status=StateInfoStatus.IN_PROGRESS)
+            state_info.state_folder_pth = gdb_path
+            state_info.area_symbol = area_symbol
+            states_info_list.append(state_info)
+
+    if not disable_location_error and any(state_code is None for state_code in state_codes):
+        raise ValueError('point is in no ssurgo survey area, please select a point in USA')
+    return states_info_list
+
+
+@timed_stage('find_county_id')
+def find_county_id(point_batch, gdb):
     """
         This function is useful to retrieve county id associated to each locations
 
     Args:
-        points(list): list of Points
+        point_batch (PointBatch): locations with x and y (USA_Contiguous_Albers), see points_batch
         gdb (DataSource): ssurgo state datasource
 
     Returns:
-        pts_info_df (DataFrame): dataframe with county_id for each location
+        point_batch (PointBatch): the same batch with county_id filled (None if the location is in no county)
     """
-    layer_sa_polygon = gdb.GetLayer("SAPOLYGON")
-    pts_info_df = pd.DataFrame({'points': [], 'county_id': []}, columns=['points', 'county_id'])
+    county_locator = CountyLocator.from_gdb(gdb)
+    point_batch.county_id[:] = county_locator.locate(point_batch.x, point_batch.y)
+    return point_batch
 
-    try:
-        for feature in layer_sa_polygon:
-            county_id = feature.GetField("AREASYMBOL")
-            geometry = feature.GetGeometryRef()
-            for point in points:
-                if point.Within(geometry):
-                    pt_info = {'county_id': county_id,
-                               'points': point}
-                    pts_info_df = pts_info_df.append(pt_info, ignore_index=True)
-                    points.remove(point)
-                    if len(points) < 0:
-                        raise ValueError("No more points to iterate")
-    except ValueError:
-        if len(points) < 0:
-            pass
-    return pts_info_df
+
+@timed_stage('points_batch')
+def points_batch(coordinates):
+    """
+    Build the batch of locations used by the soil lookup stages, all points are projected at once
+    Args:
+        coordinates (list(tuple)/ndarray): location (lat, long) of each point (espg 4326)
+
+    Returns:
+        point_batch (PointBatch): latitude longitude x y (USA_Contiguous_Albers) of each location
+    """
+    coordinates = np.asarray(coordinates, dtype=np.float64).reshape(-1, 2)
+    x, y = project_to_albers(coordinates[:, 0], coordinates[:, 1])
+    return PointBatch(coordinates[:, 0], coordinates[:, 1], x, y)